@@ -0,0 +1,15 @@
+from __future__ import annotations
+
+from fastapi import APIRouter
+
+from app.cache import get_result_cache
+
+router = APIRouter(prefix="/cache", tags=["Cache"])
+
+
+@router.get("/stats")
+def cache_stats() -> dict[str, int]:
+    """
+    Hit/miss/eviction counters and current size of the KML result cache.
+    """
+    return get_result_cache().stats()
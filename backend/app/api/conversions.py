@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Literal
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from app.api.kml import PointsMapping, convert_points
+from app.api.kml_graph import GraphMapping, convert_graph
+from app.api.kml_links import LinksMapping, convert_links
+from app.workers import Converter
+
+# The conversions that can be requested by name (/kml/batch, /jobs).
+ConversionKind = Literal["points", "links", "graph"]
+
+# kind -> (mapping model, converter, output name suffix)
+CONVERSIONS: dict[str, tuple[type[BaseModel], Converter, str]] = {
+    "points": (PointsMapping, convert_points, ""),
+    "links": (LinksMapping, convert_links, "_links"),
+    "graph": (GraphMapping, convert_graph, "_graph"),
+}
+
+
+def load_json(raw: str, field_name: str) -> Any:
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail=f"Invalid {field_name} JSON")
+
+
+def validate_mapping(model: type[BaseModel], data: Any) -> BaseModel:
+    try:
+        return model.model_validate(data)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Invalid mapping schema") from e
@@ -1,56 +1,208 @@
 from __future__ import annotations
 
 import csv
-import io
-from typing import Any, Union, Type
+import itertools
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Literal, Optional
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+
+from app.cache import file_sha256
+from app.datasets import DatasetTooLarge, get_dataset_store
+from app.ingest.dialect import CsvDialect, detect_dialect, dialect_cache, explicit_dialect
+from app.ingest.rows import ColumnTable, CsvTable, TableSource
+from app.ingest.upload import CsvTextStream
+from app.metrics import mark_upload_received, stage_timer
+from app.workers import run_in_thread
 
 router = APIRouter(prefix="/csv", tags=["CSV"])
 
-def _detect_dialect(sample: str) -> Union[csv.Dialect, Type[csv.Dialect]]:
+# Whether a conversion's dialect was given (by the mapping, or the dataset's
+# upload) or detected from the content.
+DialectSource = Literal["explicit", "detected"]
+
+
+def _check_csv_filename(file: UploadFile) -> None:
+    # Basic file type check (not bulletproof, but useful)
+    if file.filename is None or not file.filename.lower().endswith(".csv"):
+        raise HTTPException(status_code=400, detail="Please upload a .csv file")
+
+
+@dataclass
+class ConversionInput:
+    source: TableSource
+    filename: str
+    content_hash: str  # of the raw bytes: the dialect is not part of it
+    # the dialect the input is parsed with (a dataset's: its upload's)
+    dialect: Optional[CsvDialect] = None
+    dialect_source: DialectSource = "detected"
+
+
+def _upload_dialect(fileobj: BinaryIO, content_hash: str) -> CsvDialect:
+    """Detected dialect of an upload, cached by its content hash."""
+
+    def detect() -> CsvDialect:
+        fileobj.seek(0)
+        try:
+            with stage_timer("detect"):
+                return detect_dialect(CsvTextStream(fileobj).sample)
+        finally:
+            fileobj.seek(0)
+
+    return dialect_cache.get_or_detect(content_hash, detect)
+
+
+def _hash_upload(fileobj: BinaryIO, dialect: Optional[CsvDialect]) -> tuple[str, CsvDialect]:
+    with stage_timer("hash"):
+        content_hash = file_sha256(fileobj)
+    return content_hash, dialect or _upload_dialect(fileobj, content_hash)
+
+
+async def resolve_input(
+    file: Optional[UploadFile],
+    dataset_id: Optional[str],
+    dialect: Optional[CsvDialect] = None,
+) -> ConversionInput:
+    """
+    The input of a conversion endpoint: either an uploaded CSV file or a
+    dataset_id returned by POST /csv/upload (exactly one of the two).
+
+    - dialect: explicit dialect from the mapping; uploads otherwise get the
+      detected one. A dataset keeps the dialect it was uploaded with, which
+      is returned too (converters do not reparse it, results depend on it).
     """
-    Tries to detect CSV delimiter/quoting using a small sample.
-    Falls back to Excel dialect if detection fails.
+    if (file is None) == (not dataset_id):
+        raise HTTPException(status_code=400, detail="Provide either a file or a dataset_id")
+    mark_upload_received((file.size or 0) if file is not None else 0)
+
+    if dataset_id:
+        ds = get_dataset_store().get(dataset_id)
+        if ds is None:
+            raise HTTPException(status_code=404, detail="Dataset not found or expired")
+        parsed = ds.table.dialect
+        if dialect and (dialect.delimiter, dialect.quotechar) != (parsed.delimiter, parsed.quotechar):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Dataset was parsed with delimiter {parsed.delimiter!r}; upload it again with the wanted delimiter",
+            )
+        return ConversionInput(
+            source=ds.table, filename=ds.filename, content_hash=ds.content_hash, dialect=parsed,
+            dialect_source="explicit" if ds.dialect_explicit else "detected",
+        )
+
+    _check_csv_filename(file)
+    dialect_source: DialectSource = "explicit" if dialect else "detected"
+    content_hash, dialect = await run_in_thread(_hash_upload, file.file, dialect)
+    return ConversionInput(
+        source=file.file, filename=file.filename, content_hash=content_hash, dialect=dialect, dialect_source=dialect_source
+    )
+
+
+def _load_dataset(file: UploadFile, dialect: Optional[CsvDialect]) -> tuple[str, ColumnTable]:
+    content_hash, dialect = _hash_upload(file.file, dialect)
+    with stage_timer("parse"):
+        return content_hash, ColumnTable.from_csv(CsvTable(file.file, dialect))
+
+
+@router.post("/upload")
+async def upload_csv(
+    file: UploadFile = File(...),
+    delimiter: Optional[str] = Form(None),
+    quotechar: Optional[str] = Form(None),
+) -> dict[str, Any]:
     """
-    sniffer = csv.Sniffer()
+    Store a CSV once, parsed in columnar form, and return its dataset_id.
+
+    The id can then replace the file in /csv/preview and the /kml/*
+    endpoints. Datasets expire after a period without use, or earlier
+    when the server's dataset memory budget is exhausted.
+
+    - delimiter / quotechar: parse with these instead of detecting them
+    """
+    _check_csv_filename(file)
+    mark_upload_received(file.size or 0)
+    dialect = explicit_dialect(delimiter, quotechar)
+
+    content_hash, table = await run_in_thread(_load_dataset, file, dialect)
+
+    store = get_dataset_store()
     try:
-        return sniffer.sniff(sample)
-    except csv.Error:
-        return csv.excel
+        ds = store.add(file.filename, content_hash, table, dialect_explicit=dialect is not None)
+    except DatasetTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    return {
+        "dataset_id": ds.dataset_id,
+        "filename": ds.filename,
+        "headers": table.headers,
+        "row_count": table.row_count,
+        "detected_delimiter": table.delimiter,
+        "expires_in": store.ttl_seconds,
+    }
+
+
+@router.delete("/datasets/{dataset_id}")
+def delete_dataset(dataset_id: str) -> dict[str, Any]:
+    if not get_dataset_store().remove(dataset_id):
+        raise HTTPException(status_code=404, detail="Dataset not found or expired")
+    return {"deleted": dataset_id}
+
 
 @router.post("/preview")
-async def preview_csv(file: UploadFile = File(...), max_rows: int = 20) -> dict[str, Any]:
+async def preview_csv(
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    max_rows: int = 20,
+    header_only: bool = False,
+    partial: bool = False,
+    delimiter: Optional[str] = None,
+    quotechar: Optional[str] = None,
+) -> dict[str, Any]:
     """
     Return headers + first N rows of a CSV file.
 
-    - file: uploaded CSV
+    Only the sniff sample, the header and N rows are read and decoded;
+    the rest of the upload is never touched.
+
+    - file: uploaded CSV (or dataset_id: a dataset from POST /csv/upload)
     - max_rows: how many rows to return (default 20)
+    - header_only: skip the rows and return just the headers
+    - partial: the upload is only the first bytes of a larger file
+      (a cut UTF-8 character or last line is ignored)
+    - delimiter / quotechar: use these instead of detecting the dialect
     """
 
     if max_rows < 1 or max_rows > 200:
         raise HTTPException(status_code=400, detail="max_rows must be between 1 and 200")
+
+    if (file is None) == (not dataset_id):
+        raise HTTPException(status_code=400, detail="Provide either a file or a dataset_id")
+    mark_upload_received((file.size or 0) if file is not None else 0)
+
+    explicit = explicit_dialect(delimiter, quotechar)
+
+    if dataset_id:
+        ds = get_dataset_store().get(dataset_id)
+        if ds is None:
+            raise HTTPException(status_code=404, detail="Dataset not found or expired")
+        rows = [] if header_only else [list(r) for r in itertools.islice(ds.table.rows(), max_rows)]
+        return {
+            "filename" : ds.filename,
+            "headers" : ds.table.headers,
+            "rows" : rows,
+            "max_rows" : max_rows,
+            "detected_delimiter" : ds.table.delimiter,
+        }
+
+    _check_csv_filename(file)
     
-    # Basic file type check (not bulletproof, but useful)
-    if file.filename is None or not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Please upload a .csv file")
-    
-    raw = await file.read()
-    if not raw:
-        raise HTTPException(status_code=400, detail="Empty file.")
-    
-    # Decode (start simple: UTF-8 with BOM support)
-    try:
-        text = raw.decode("utf-8-sig")
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded (utf-8 or utf-8-sig)")
-    
+    # Decode incrementally (UTF-8 with BOM support)
+    source = CsvTextStream(file.file, truncated=partial)
+
     # Detect dialect from a small sample
-    sample = text[:4096]
-    dialect = _detect_dialect(sample)
+    dialect = explicit or detect_dialect(source.sample)
 
-    stream = io.StringIO(text)
-    reader = csv.reader(stream, dialect=dialect)
+    reader = csv.reader(source.lines(), dialect=dialect)
 
     try:
         headers = next(reader)
@@ -62,15 +214,14 @@ async def preview_csv(file: UploadFile = File(...), max_rows: int = 20) -> dict[
         raise HTTPException(status_code=400, detail="CSV header row is empty.")
     
     rows: list[list[str]] = []
-    for i, row in enumerate(reader):
-        if i >= max_rows:
-            break
-        rows.append([cell.strip() for cell in row])
+    if not header_only:
+        for row in itertools.islice(reader, max_rows):
+            rows.append([cell.strip() for cell in row])
     
     return {
         "filename" : file.filename,
         "headers" : headers,
         "rows" : rows,
         "max_rows" : max_rows,
-        "detected_delimiter" : getattr(dialect, "delimiter", ","),
-    }
\ No newline at end of file
+        "detected_delimiter" : dialect.delimiter,
+    }
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from functools import partial
+from typing import Any, BinaryIO, Callable, Optional
+
+from fastapi import APIRouter, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import FileResponse, JSONResponse
+
+from app.api.conversions import CONVERSIONS, ConversionKind, load_json, validate_mapping
+from app.api.csv import resolve_input
+from app.api.responses import OutputFormat, download_headers
+from app.ingest.dialect import explicit_dialect
+from app.jobs import Job, JobManager, JobQueueFull, get_job_manager
+from app.workers import convert_to_path, run_in_thread
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+_COPY_SIZE = 1024 * 1024
+
+
+def _copy_to(fileobj: BinaryIO, path: str) -> None:
+    fileobj.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(fileobj, out, _COPY_SIZE)
+
+
+def _get_job(manager: JobManager, job_id: str) -> Job:
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+
+@router.post("", status_code=202)
+async def create_job(
+    kind: ConversionKind = Form(...),
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    mapping: str = Form(...),
+    output: OutputFormat = Query("kml"),
+) -> JSONResponse:
+    """
+    Queue a conversion and return its job id right away.
+
+    Takes the same inputs as /kml/{kind}: an uploaded CSV or a dataset_id,
+    and the mapping JSON of that kind. Poll GET /jobs/{job_id} for its
+    progress, then download GET /jobs/{job_id}/result.
+    """
+    model, convert, suffix = CONVERSIONS[kind]
+    m = validate_mapping(model, load_json(mapping, "mapping"))
+
+    manager = get_job_manager()
+    try:
+        manager.check_capacity()
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    dialect = explicit_dialect(getattr(m, "delimiter", None), getattr(m, "quotechar", None))
+    inp = await resolve_input(file, dataset_id, dialect)
+    args = (m, inp.filename, inp.dialect)
+
+    src: Any = inp.source
+    cleanup: Optional[Callable[[], None]] = None
+    if file is not None:
+        # the upload is gone once this request ends: the job reads a copy
+        src = manager.new_file(".csv")
+        await run_in_thread(_copy_to, file.file, src)
+        cleanup = partial(os.remove, src)
+
+    def work(path: str, progress: Callable[[int], None]) -> None:
+        convert_to_path(convert, src, args, output, path, progress)
+
+    base_name = inp.filename.rsplit(".", 1)[0] + suffix
+    try:
+        job = manager.submit(kind, base_name, output, work, cleanup)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return JSONResponse(
+        status_code=202,
+        content=job.status(time.monotonic(), manager.ttl_seconds),
+        headers={"Location": f"/jobs/{job.job_id}"},
+    )
+
+
+@router.get("/{job_id}")
+def job_status(job_id: str) -> dict[str, Any]:
+    """
+    State (queued, running, done, failed), rows processed so far and
+    throughput of a job; failed jobs also carry the error.
+    """
+    manager = get_job_manager()
+    return _get_job(manager, job_id).status(time.monotonic(), manager.ttl_seconds)
+
+
+@router.get("/{job_id}/result")
+def job_result(job_id: str) -> FileResponse:
+    """
+    The converted file of a finished job. Until then 409; a failed job
+    answers with its error.
+    """
+    job = _get_job(get_job_manager(), job_id)
+    if job.state == "failed" and job.error:
+        raise HTTPException(status_code=job.error[0], detail=job.error[1])
+    if job.state != "done" or job.result_path is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job.state}")
+
+    media_type, download = download_headers(job.base_name, job.output)
+    return FileResponse(job.result_path, media_type=media_type, headers=download)
@@ -1,22 +1,61 @@
 from __future__ import annotations
 
-import csv
-import io
 import json
-import re
 from typing import Any, Optional
 
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, Query, Request, UploadFile
 from fastapi.responses import Response
 from pydantic import BaseModel, Field
 
-from app.api.csv import _detect_dialect
-from app.kml.builder import KmlPoint, KmlPointStyle, build_kml_points
+from app.api.csv import resolve_input
+from app.api.responses import OutputFormat, conversion_response
+from app.api.styling import StyleRule, hex_to_kml_color, point_rule_styles
+from app.ingest.coords import COORD_BATCH_SIZE, parse_lat_lon
+from app.ingest.dialect import CsvDialect, explicit_dialect
+from app.ingest.rows import TableSource, batched, open_table
+from app.ingest.validation import RowErrors
+from app.kml.builder import KmlPointStyle, iter_kml_points
+from app.kml.clusters import cluster_layers
+from app.kml.features import PointTable
+from app.kml.writer import MinifyOptions
+from app.kml.tiles import TileableDocument, point_position
 
 
 router = APIRouter(prefix="/kml", tags=["KML"])
 
-_HEX_COLOR_RE = re.compile(r"^#[0-9a-fA-F]{6}$")
+
+class ClusterConfig(BaseModel):
+    # one grid cluster layer per web map zoom level (e.g. [4, 7, 10]), each
+    # shown from its zoom level to the next one
+    zoom_levels: list[int] = Field(default_factory=list)
+    # write the points too, shown only when zoomed in past the last level
+    include_points: bool = True
+
+
+def check_cluster_config(cfg: ClusterConfig) -> None:
+    if len(cfg.zoom_levels) > 8:
+        raise HTTPException(status_code=400, detail="cluster.zoom_levels takes at most 8 levels")
+    if any(z < 0 or z > 20 for z in cfg.zoom_levels):
+        raise HTTPException(status_code=400, detail="cluster.zoom_levels must be between 0 and 20")
+
+
+class MinifyConfig(BaseModel):
+    # decimals kept per coordinate (6: about 0.1 m); null: as parsed
+    coord_decimals: Optional[int] = 6
+    # write the ",0" altitude of each coordinate
+    altitude: bool = False
+    # write <description> elements that are empty
+    empty_descriptions: bool = False
+
+
+def minify_options(cfg: Optional[MinifyConfig]) -> Optional[MinifyOptions]:
+    """The writer's output profile for a mapping's `minify` (None: full output)."""
+    if cfg is None:
+        return None
+    if cfg.coord_decimals is not None and (cfg.coord_decimals < 0 or cfg.coord_decimals > 12):
+        raise HTTPException(status_code=400, detail="minify.coord_decimals must be between 0 and 12")
+    return MinifyOptions(cfg.coord_decimals, cfg.altitude, cfg.empty_descriptions)
+
 
 class PointsMapping(BaseModel):
     name_col: str = Field(..., min_length=1)
@@ -28,6 +67,23 @@ class PointsMapping(BaseModel):
     icon_scale: float = 1.0
     icon_color: Optional[str] = None    #expect "#RRGGBB"
 
+    # optional data-driven style (icon/color/scale by column value)
+    style_rule: Optional[StyleRule] = None
+
+    # optional overview clusters
+    cluster: ClusterConfig = Field(default_factory=ClusterConfig)
+
+    # optional minified output (rounded coordinates, no altitude or empty descriptions)
+    minify: Optional[MinifyConfig] = None
+
+    # optional CSV format (detected when unset)
+    delimiter: Optional[str] = None
+    quotechar: Optional[str] = None
+
+    # false: rows with invalid coordinates are skipped instead of failing
+    # the conversion (also set by ?strict=false)
+    strict: bool = True
+
 def _parse_mapping(mapping_raw: str) -> PointsMapping:
     try:
         data = json.loads(mapping_raw)
@@ -40,105 +96,73 @@ def _parse_mapping(mapping_raw: str) -> PointsMapping:
         raise HTTPException(status_code=400, detail="Invalid mapping schema") from e
     
 
-def _hex_to_kml_color(hex_rgb: str) -> str:
-    """
-    Converts #RRGGBB to KML color format aabbggrr.
-    We'll use full opacity (aa == ff).
-    """
-    if not _HEX_COLOR_RE.match(hex_rgb):
-        raise HTTPException(status_code=400, detail="icon_color must be in format #RRGGBB")
-
-    hex_rgb = hex_rgb.lower()
-
-    rr = hex_rgb[1:3]
-    gg = hex_rgb[3:5]
-    bb = hex_rgb[5:7]
-    aa = "ff"
 
-    return f"{aa}{bb}{gg}{rr}"
-
-@router.post("/points")
-async def kml_points(
-    file: UploadFile = File(...),
-    mapping: str = Form(...),
-) -> Response:
-    # Basic file checks
-    if file.filename is None or not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Please upload a .csv file.")
-    
-    raw = await file.read()
-    if not raw:
-        raise HTTPException(status_code=400, detail="Empty file")
-    
-    # Decode
+def _parse_lat_lon(lat_raw: str, lon_raw: str, idx: int) -> tuple[float, float]:
     try:
-        text = raw.decode("utf-8-sig")
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded (utf-8 or utf-8-sig)")
+        lat = float(lat_raw)
+        lon = float(lon_raw)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid coordinates at row {idx}: lat='{lat_raw}', lon='{lon_raw}'",
+        )
     
+    if not (-90.0 <= lat <= 90.0):
+        raise HTTPException(status_code=400, detail=f"Latitude out of range at row {idx}: {lat}")
+    if not (-180.0 <= lon <= 180.0):
+        raise HTTPException(status_code=400, detail=f"Longitude out of range at row {idx}: {lon}")
+    
+    return lat, lon
 
-    mapping_obj = _parse_mapping(mapping)
+def convert_points(
+    source: TableSource,
+    mapping_obj: PointsMapping,
+    document_name: str,
+    dialect: Optional[CsvDialect] = None,
+    first_row: int = 1,
+    errors: Optional[RowErrors] = None,
+) -> TileableDocument:
+    """
+    Reads `source` (an upload or a stored dataset) with the given mapping
+    and returns the KML document (see iter_kml_points). Input errors are raised
+    here, before any output is produced. Runs in a worker, see app.workers.
 
-    # CSV dialect detection
-    sample = text[:4096]
-    dialect = _detect_dialect(sample)
+    Only the output is streamed: every row is read into the feature table
+    first, so a bad row late in the file is still a 400 (and clusters,
+    dedupe and tiles see all features). Time to first byte and memory
+    thus grow with the row count, the table being the compact part
+    (columns, not placemark strings).
 
-    stream = io.StringIO(text)
-    reader = csv.DictReader(stream, dialect=dialect)
+    - first_row: number of the first data row, when `source` is a chunk of
+      a larger file (see app.cli); used in default names and error messages
+    - errors: collects the invalid rows, which are skipped, instead of
+      raising on the first one (one is made for non-strict mappings); with
+      errors.dry_run the rows are only checked
+    """
+    if errors is None and not mapping_obj.strict:
+        errors = RowErrors(limit=0)
+    dry_run = errors is not None and errors.dry_run
 
-    if reader.fieldnames is None:
-        raise HTTPException(status_code=400, detail="CSV has no header row.")
-    
-    headers = [h.strip() for h in reader.fieldnames]
+    table = open_table(source, dialect)
 
     # Validate required columns exist
-    required = [mapping_obj.name_col, mapping_obj.lat_col, mapping_obj.lon_col]
-    missing = [c for c in required if c not in headers]
+    missing = table.missing([mapping_obj.name_col, mapping_obj.lat_col, mapping_obj.lon_col])
     if missing:
         raise HTTPException(status_code=400, detail=f"Missing required columns: {', '.join(missing)}")
     
-    for c in mapping_obj.description_cols:
-        if c not in headers:
-            raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
-    
-    points: list[KmlPoint] = []
+    for c in table.missing(mapping_obj.description_cols):
+        raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
 
-    for idx, row in enumerate(reader, start=1):
-        # DictReader keys are headers; values are raw strings
-        name = (row.get(mapping_obj.name_col) or "").strip()
-        lat_raw = (row.get(mapping_obj.lat_col) or "").strip()
-        lon_raw = (row.get(mapping_obj.lon_col) or "").strip()
-    
-        if not name:
-            name = f"Point {idx}"
-        
-        try:
-            lat = float(lat_raw)
-            lon = float(lon_raw)
-        except ValueError:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid coordinates at row {idx}: lat='{lat_raw}', lon='{lon_raw}'",
-            )
-        
-        if not (-90.0 <= lat <= 90.0):
-            raise HTTPException(status_code=400, detail=f"Latitude out of range at row {idx}: {lat}")
-        if not (-180.0 <= lon <= 180.0):
-            raise HTTPException(status_code=400, detail=f"Longitude out of range at row {idx}: {lon}")
-    
-        # Build description from selected columns
-        desc_parts: list[str] = []
-        for col in mapping_obj.description_cols:
-            val = (row.get(col) or "").strip()
-            desc_parts.append(f"{col}: {val}")
+    rule = mapping_obj.style_rule
+    if rule and table.missing([rule.column]):
+        raise HTTPException(status_code=400, detail=f"Style column not found: {rule.column}")
 
-        description = "<br/>".join(desc_parts)
+    check_cluster_config(mapping_obj.cluster)
+    minify = minify_options(mapping_obj.minify)
 
-        points.append(KmlPoint(name=name, lat=lat, lon=lon, description_html=description))
-    
     style = None
     if mapping_obj.icon_url or mapping_obj.icon_color or mapping_obj.icon_scale != 1.0:
-        kml_color = _hex_to_kml_color(mapping_obj.icon_color) if mapping_obj.icon_color else None
+        kml_color = hex_to_kml_color(mapping_obj.icon_color, "icon_color") if mapping_obj.icon_color else None
 
         # basic scale validation
         if mapping_obj.icon_scale <= 0 or mapping_obj.icon_scale > 10:
@@ -151,12 +175,106 @@ async def kml_points(
             icon_color=kml_color,
         )
 
-    kml = build_kml_points(document_name=file.filename or "csv2kml", points=points, style=style)
+    rule_styles = point_rule_styles(rule, style, "style_rule") if rule else None
+    
+    # Column names resolved to indices once; rows come back as tuples
+    # (name, lat, lon, *description values, [style column value])
+    desc_labels = [f"{col}: " for col in mapping_obj.description_cols]
+    desc_end = 3 + len(mapping_obj.description_cols)
+    rows = table.select([
+        mapping_obj.name_col,
+        mapping_obj.lat_col,
+        mapping_obj.lon_col,
+        *mapping_obj.description_cols,
+        *([rule.column] if rule else []),
+    ])
+
+    points = PointTable()
+
+    idx = first_row - 1
+    for batch in batched(rows, COORD_BATCH_SIZE):
+        # Bulk parse + range check; rows from n_ok on take the per-row path,
+        # which raises the row-numbered error
+        (lats, lons), n_ok = parse_lat_lon(batch, [(1, 2)])
+
+        for i, values in enumerate(batch):
+            idx += 1
+            if i < n_ok:
+                lat, lon = lats[i], lons[i]
+            elif errors is None:
+                lat, lon = _parse_lat_lon(values[1], values[2], idx)
+            else:
+                try:
+                    lat, lon = _parse_lat_lon(values[1], values[2], idx)
+                except HTTPException as e:
+                    errors.add(idx, e.detail)
+                    continue
+
+            if dry_run:
+                continue
+
+            name = values[0] or f"Point {idx}"
+
+            # Build description from selected columns
+            description = "<br/>".join([label + val for label, val in zip(desc_labels, values[3:desc_end])])
+
+            style_id = rule_styles.style_id(values[desc_end]) if rule_styles else ""
+
+            points.append(name, lat, lon, description, style_id)
+
+    document_data: list[tuple[str, object]] = []
+    if errors is not None:
+        errors.rows = idx - first_row + 1
+        if errors.invalid:
+            document_data.append(("skipped_rows", errors.invalid))
+    
+    shared_styles = rule_styles.styles if rule_styles else []
+
+    overview: list[str] = []
+    points_region = ""
+    if mapping_obj.cluster.zoom_levels:
+        layers = cluster_layers(
+            points.lats,
+            points.lons,
+            mapping_obj.cluster.zoom_levels,
+            mapping_obj.cluster.include_points,
+            style.style_id if style else None,
+            minify,
+        )
+        overview, points_region = layers.folders, layers.points_region
+        if not mapping_obj.cluster.include_points:
+            points = PointTable()
+
+    return TileableDocument(
+        document_name=document_name,
+        features=points,
+        position=point_position,
+        render=lambda name, items, extra: iter_kml_points(
+            name, items, style, extra, points_region, shared_styles, minify, document_data
+        ),
+        overview=overview,
+    )
+
+
+@router.post("/points")
+async def kml_points(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    mapping: str = Form(...),
+    output: OutputFormat = Query("kml"),
+    profile: bool = Query(False),
+    strict: bool = Query(True),
+) -> Response:
+    mapping_obj = _parse_mapping(mapping)
+    if not strict:
+        mapping_obj = mapping_obj.model_copy(update={"strict": False})
+
+    inp = await resolve_input(file, dataset_id, explicit_dialect(mapping_obj.delimiter, mapping_obj.quotechar))
 
-    out_name = (file.filename or "points.csv").rsplit(".", 1)[0] + ".kml"
+    out_name = inp.filename.rsplit(".", 1)[0]
 
-    return Response(
-        content=kml,
-        media_type="application/vnd.google-earth.kml+xml",
-        headers={"Content-Disposition": f'attachment; filename="{out_name}"'},
+    return await conversion_response(
+        request, "points", convert_points, inp.source, inp.content_hash, mapping_obj, inp.filename, out_name, output, inp.dialect, profile,
+        dialect_source=inp.dialect_source,
     )
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import json
+import logging
+import posixpath
+import tempfile
+import zipfile
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, BinaryIO, Optional
+
+import anyio
+from fastapi import APIRouter, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.api.conversions import CONVERSIONS, ConversionKind, load_json, validate_mapping
+from app.api.responses import OutputFormat
+from app.ingest.dialect import explicit_dialect
+from app.ingest.upload import CsvInputError
+from app.kml.kmz import ZipSink
+from app.metrics import mark_upload_received
+from app.settings import get_settings
+from app.workers import Converter, run_conversion, run_in_thread
+
+router = APIRouter(prefix="/kml", tags=["KML"])
+
+logger = logging.getLogger(__name__)
+
+# Results (and CSVs taken out of a zip) above this size go to disk.
+_SPOOL_SIZE = 8 * 1024 * 1024
+_COPY_SIZE = 64 * 1024
+
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclass
+class BatchItem:
+    filename: str  # path of the CSV, as uploaded or inside the zip
+    source: BinaryIO
+    mapping: Optional[BaseModel] = None
+    arcname: str = ""
+    result: Optional[BinaryIO] = None
+    size: int = 0
+    error: Optional[tuple[int, Any]] = None  # (status code, detail)
+    owned: list[BinaryIO] = field(default_factory=list)  # files to close afterwards
+
+    def manifest_entry(self) -> dict[str, Any]:
+        if self.error:
+            return {"file": self.filename, "status": "error", "status_code": self.error[0], "detail": self.error[1]}
+        return {"file": self.filename, "status": "ok", "output": self.arcname, "bytes": self.size}
+
+
+def _safe_path(name: str) -> str:
+    """Zip member path without absolute or parent (..) components."""
+    parts = [p for p in posixpath.normpath(name.replace("\\", "/")).split("/") if p not in ("", ".", "..")]
+    return "/".join(parts)
+
+
+def _extract_csvs(archive: BinaryIO, max_files: int, max_bytes: int) -> list[BatchItem]:
+    """The .csv members of a zip, each copied to a spooled temp file."""
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip archive")
+
+    with zf:
+        members = [
+            m for m in zf.infolist()
+            if not m.is_dir() and m.filename.lower().endswith(".csv") and not m.filename.startswith("__MACOSX/")
+        ]
+        if len(members) > max_files:
+            raise HTTPException(status_code=413, detail=f"Batch takes at most {max_files} files")
+        if sum(m.file_size for m in members) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Zip content exceeds {max_bytes} bytes")
+
+        items = []
+        for m in members:
+            out = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
+            with zf.open(m) as src:
+                while True:
+                    chunk = src.read(_COPY_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            out.seek(0)
+            items.append(BatchItem(filename=_safe_path(m.filename), source=out, owned=[out]))
+    return items
+
+
+def _assign_arcnames(items: list[BatchItem], suffix: str, output: OutputFormat) -> None:
+    ext = "kml" if output == "kml" else "kmz"
+    used = {MANIFEST_NAME}
+    for item in items:
+        base = item.filename.rsplit(".", 1)[0] + suffix
+        name = f"{base}.{ext}"
+        n = 2
+        while name in used:
+            name = f"{base}_{n}.{ext}"
+            n += 1
+        used.add(name)
+        item.arcname = name
+
+
+async def _convert_item(item: BatchItem, convert: Converter, output: OutputFormat) -> None:
+    if item.mapping is None:
+        item.error = (400, "No mapping for this file")
+        return
+
+    m = item.mapping
+    try:
+        dialect = explicit_dialect(getattr(m, "delimiter", None), getattr(m, "quotechar", None))
+        body = await run_conversion(convert, item.source, m, posixpath.basename(item.filename), dialect, output=output)
+        out = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
+        item.owned.append(out)
+        async for chunk in body:
+            out.write(chunk)
+            item.size += len(chunk)
+        out.seek(0)
+        item.result = out
+    except HTTPException as e:
+        item.error = (e.status_code, e.detail)
+    except CsvInputError as e:
+        item.error = (400, str(e))
+    except Exception:
+        # any other failure is this file's: the batch and its manifest go on
+        logger.exception("Batch conversion of %s failed", item.filename)
+        item.error = (500, "Conversion failed")
+
+
+def _write_entry(zf: zipfile.ZipFile, arcname: str, data: BinaryIO, compress: bool) -> None:
+    compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    info = zipfile.ZipInfo(arcname)
+    info.compress_type = compress_type
+    # sizes unknown to the streaming sink: zip64 headers (see ZipSink)
+    with zf.open(info, "w", force_zip64=True) as entry:
+        while True:
+            chunk = data.read(_COPY_SIZE)
+            if not chunk:
+                break
+            entry.write(chunk)
+
+
+async def _iter_batch_zip(items: list[BatchItem], output: OutputFormat) -> AsyncIterator[bytes]:
+    """
+    Streams the results as a zip: manifest.json first, then one entry per
+    converted file. KML is deflated, KMZ results (already compressed) are
+    stored.
+    """
+    sink = ZipSink()
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            manifest = {"output": output, "files": [item.manifest_entry() for item in items]}
+            zf.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+            yield sink.drain()
+
+            for item in items:
+                if item.result is None:
+                    continue
+                await run_in_thread(_write_entry, zf, item.arcname, item.result, output == "kml")
+                data = sink.drain()
+                if data:
+                    yield data
+        yield sink.drain()
+    finally:
+        _close_items(items)
+
+
+def _close_items(items: list[BatchItem]) -> None:
+    for item in items:
+        for f in item.owned:
+            f.close()
+
+
+@router.post("/batch")
+async def kml_batch(
+    files: list[UploadFile] = File(...),
+    kind: ConversionKind = Form(...),
+    mapping: Optional[str] = Form(None),
+    mappings: Optional[str] = Form(None),
+    output: OutputFormat = Query("kml"),
+    strict: bool = Query(True),
+) -> StreamingResponse:
+    """
+    Convert many CSVs in one request.
+
+    - files: several .csv files, or one .zip of CSVs
+    - kind: points, links or graph
+    - mapping: mapping JSON shared by all files
+    - mappings: JSON object of per-file mappings, keyed by file name (or
+      path inside the zip); overrides `mapping` for those files
+    - strict: false skips rows with invalid coordinates in every file
+
+    Files are converted concurrently in the worker pool. The response is a
+    zip with one result per file and a manifest.json with each file's
+    status; a file that fails does not fail the batch.
+    """
+    settings = get_settings()
+    model, convert, suffix = CONVERSIONS[kind]
+    mark_upload_received(sum(f.size or 0 for f in files))
+
+    if mapping is None and mappings is None:
+        raise HTTPException(status_code=400, detail="Provide mapping and/or mappings")
+    shared = validate_mapping(model, load_json(mapping, "mapping")) if mapping is not None else None
+    per_file = load_json(mappings, "mappings") if mappings is not None else {}
+    if not isinstance(per_file, dict):
+        raise HTTPException(status_code=400, detail="mappings must be a JSON object")
+
+    if len(files) == 1 and (files[0].filename or "").lower().endswith(".zip"):
+        items = await run_in_thread(_extract_csvs, files[0].file, settings.batch_max_files, settings.batch_max_bytes)
+    else:
+        if len(files) > settings.batch_max_files:
+            raise HTTPException(status_code=413, detail=f"Batch takes at most {settings.batch_max_files} files")
+        items = []
+        for f in files:
+            if f.filename is None or not f.filename.lower().endswith(".csv"):
+                raise HTTPException(status_code=400, detail="Please upload .csv files or a single .zip")
+            items.append(BatchItem(filename=_safe_path(f.filename), source=f.file))
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No CSV files in the batch")
+
+    for item in items:
+        raw = per_file.get(item.filename, per_file.get(posixpath.basename(item.filename)))
+        if raw is not None:
+            try:
+                item.mapping = validate_mapping(model, raw)
+            except HTTPException as e:
+                item.error = (e.status_code, e.detail)
+        else:
+            item.mapping = shared
+        if not strict and item.mapping is not None:
+            item.mapping = item.mapping.model_copy(update={"strict": False})
+
+    _assign_arcnames(items, suffix, output)
+
+    try:
+        async with anyio.create_task_group() as tg:
+            for item in items:
+                if item.error is None:
+                    tg.start_soon(_convert_item, item, convert, output)
+    except BaseException:
+        _close_items(items)
+        raise
+
+    return StreamingResponse(
+        _iter_batch_zip(items, output),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="csv2kml_batch.zip"'},
+    )
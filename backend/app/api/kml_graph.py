@@ -1,39 +1,29 @@
 from __future__ import annotations
 
-import csv
-import io
 import json
-import re
-from typing import Literal, Optional
+from typing import Hashable, Iterable, Iterator, Literal, Optional
 
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, Query, Request, UploadFile
 from fastapi.responses import Response
 from pydantic import BaseModel, Field
 
-from app.api.csv import _detect_dialect
-from app.kml.graph_builder import (
-    KmlLink,
-    KmlLineStyle,
-    KmlPoint,
-    KmlPointStyle,
-    build_kml_graph,
-)
+from app.api.csv import resolve_input
+from app.api.kml import ClusterConfig, MinifyConfig, check_cluster_config, minify_options
+from app.api.kml_links import EdgeDedupeConfig
+from app.api.responses import OutputFormat, conversion_response
+from app.api.styling import StyleRule, hex_to_kml_color, line_rule_styles, point_rule_styles
+from app.dedupe import merge_parallel_edges, node_key_fn
+from app.ingest.coords import COORD_BATCH_SIZE, parse_lat_lon
+from app.ingest.dialect import CsvDialect, explicit_dialect
+from app.ingest.rows import TableSource, batched, open_table
+from app.ingest.validation import RowErrors
+from app.kml.graph_builder import KmlLineStyle, KmlPointStyle, iter_kml_graph
+from app.kml.clusters import cluster_layers
+from app.kml.features import GraphTable, KmlPoint, LinkTable, PointTable
+from app.kml.tiles import TileableDocument, link_position, point_position
 
 router = APIRouter(prefix="/kml", tags=["KML"])
 
-_HEX_COLOR_RE = re.compile(r"^#[0-9a-fA-F]{6}$")
-
-
-def _hex_to_kml_color(hex_rgb: str, field_name: str) -> str:
-    """#RRGGBB -> aabbggrr (opaque, lowercase)"""
-    hex_rgb = hex_rgb.strip()
-    if not _HEX_COLOR_RE.match(hex_rgb):
-        raise HTTPException(status_code=400, detail=f"{field_name} must be in format #RRGGBB")
-    hex_rgb = hex_rgb.lower()
-    rr = hex_rgb[1:3]
-    gg = hex_rgb[3:5]
-    bb = hex_rgb[5:7]
-    return f"ff{bb}{gg}{rr}"
 
 
 class GraphNodeSpec(BaseModel):
@@ -51,6 +41,12 @@ class GraphPointsConfig(BaseModel):
     icon_scale: float = 1.0
     icon_color: Optional[str] = None  # "#RRGGBB"
 
+    # optional data-driven style, from the row where a point is first seen
+    style_rule: Optional[StyleRule] = None
+
+    # optional overview clusters of the (deduped) points
+    cluster: ClusterConfig = Field(default_factory=ClusterConfig)
+
 
 class GraphLinksConfig(BaseModel):
     a_lat_col: str = Field(..., min_length=1)
@@ -65,16 +61,32 @@ class GraphLinksConfig(BaseModel):
     line_color: Optional[str] = None  # "#RRGGBB"
     line_width: float = 2.0
 
+    # optional data-driven style (color/width by column value)
+    style_rule: Optional[StyleRule] = None
+
 
 class DedupeConfig(BaseModel):
-    mode: Literal["coords", "name"] = "coords"
-    precision: int = 6
+    mode: Literal["coords", "name", "distance"] = "coords"
+    precision: int = 6  # coords: decimals compared
+    tolerance_m: float = 1.0  # distance: nodes closer than this are merged
 
 
 class GraphMapping(BaseModel):
     points: GraphPointsConfig
     links: GraphLinksConfig
     dedupe: DedupeConfig = Field(default_factory=DedupeConfig)
+    edge_dedupe: EdgeDedupeConfig = Field(default_factory=EdgeDedupeConfig)
+
+    # optional minified output (rounded coordinates, no altitude or empty descriptions)
+    minify: Optional[MinifyConfig] = None
+
+    # optional CSV format (detected when unset)
+    delimiter: Optional[str] = None
+    quotechar: Optional[str] = None
+
+    # false: rows with invalid coordinates are skipped instead of failing
+    # the conversion (also set by ?strict=false)
+    strict: bool = True
 
 
 def _parse_mapping(mapping_raw: str) -> GraphMapping:
@@ -103,21 +115,55 @@ def _validate_lat_lon(lat: float, lon: float, row_idx: int, label: str) -> None:
         raise HTTPException(status_code=400, detail=f"Longitude out of range at row {row_idx} ({label}): {lon}")
 
 
-@router.post("/graph")
-async def kml_graph(file: UploadFile = File(...), mapping: str = Form(...)) -> Response:
-    if file.filename is None or not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Please upload a .csv file")
-
-    raw = await file.read()
-    if not raw:
-        raise HTTPException(status_code=400, detail="Empty file")
-
-    try:
-        text = raw.decode("utf-8-sig")
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded (utf-8 or utf-8-sig)")
-
-    m = _parse_mapping(mapping)
+def _parse_row_coords(
+    values: tuple[str, ...],
+    row_idx: int,
+    m: GraphMapping,
+    node_offsets: list[tuple[int, GraphNodeSpec]],
+) -> list[float]:
+    """
+    Per-row parsing + validation, in the order errors are reported:
+    link A/B first, then each node. Returns [a_lat, a_lon, b_lat, b_lon, lat, lon per node].
+    """
+    a_lat = _parse_float(values[0], row_idx, m.links.a_lat_col)
+    a_lon = _parse_float(values[1], row_idx, m.links.a_lon_col)
+    b_lat = _parse_float(values[2], row_idx, m.links.b_lat_col)
+    b_lon = _parse_float(values[3], row_idx, m.links.b_lon_col)
+
+    _validate_lat_lon(a_lat, a_lon, row_idx, "A")
+    _validate_lat_lon(b_lat, b_lon, row_idx, "B")
+
+    coords = [a_lat, a_lon, b_lat, b_lon]
+    for off, node in node_offsets:
+        name = values[off] or "Unnamed"
+        lat = _parse_float(values[off + 1], row_idx, node.lat_col)
+        lon = _parse_float(values[off + 2], row_idx, node.lon_col)
+        _validate_lat_lon(lat, lon, row_idx, name)
+        coords += [lat, lon]
+    return coords
+
+
+def convert_graph(
+    source: TableSource,
+    m: GraphMapping,
+    document_name: str,
+    dialect: Optional[CsvDialect] = None,
+    errors: Optional[RowErrors] = None,
+) -> TileableDocument:
+    """
+    Reads `source` (an upload or a stored dataset) with the given mapping
+    and returns the KML document (see iter_kml_graph). Input errors are raised
+    here, before any output is produced (all rows are read first, see
+    convert_points). Runs in a worker, see app.workers.
+
+    - errors: collects the invalid rows instead of raising (see
+      convert_points); a skipped row adds neither its link nor its points
+    """
+    if errors is None and not m.strict:
+        errors = RowErrors(limit=0)
+    dry_run = errors is not None and errors.dry_run
+
+    table = open_table(source, dialect)
 
     # Validate styles
     if m.points.icon_scale <= 0 or m.points.icon_scale > 10:
@@ -126,10 +172,16 @@ async def kml_graph(file: UploadFile = File(...), mapping: str = Form(...)) -> R
         raise HTTPException(status_code=400, detail="line_width must be between 0 and 50")
     if m.dedupe.precision < 0 or m.dedupe.precision > 12:
         raise HTTPException(status_code=400, detail="dedupe.precision must be between 0 and 12")
+    if m.dedupe.tolerance_m <= 0 or m.dedupe.tolerance_m > 100_000:
+        raise HTTPException(status_code=400, detail="dedupe.tolerance_m must be between 0 and 100000")
+    if m.edge_dedupe.precision < 0 or m.edge_dedupe.precision > 12:
+        raise HTTPException(status_code=400, detail="edge_dedupe.precision must be between 0 and 12")
+    check_cluster_config(m.points.cluster)
+    minify = minify_options(m.minify)
 
     point_style = None
     if m.points.icon_url or m.points.icon_color or m.points.icon_scale != 1.0:
-        kml_color = _hex_to_kml_color(m.points.icon_color, "icon_color") if m.points.icon_color else None
+        kml_color = hex_to_kml_color(m.points.icon_color, "icon_color") if m.points.icon_color else None
         point_style = KmlPointStyle(
             style_id="pointStyle",
             icon_url=m.points.icon_url,
@@ -139,109 +191,184 @@ async def kml_graph(file: UploadFile = File(...), mapping: str = Form(...)) -> R
 
     line_style = None
     if m.links.line_color or m.links.line_width != 2.0:
-        kml_color = _hex_to_kml_color(m.links.line_color, "line_color") if m.links.line_color else None
+        kml_color = hex_to_kml_color(m.links.line_color, "line_color") if m.links.line_color else None
         line_style = KmlLineStyle(style_id="lineStyle", color=kml_color, width=m.links.line_width)
 
-    # Parse CSV once
-    dialect = _detect_dialect(text[:4096])
-    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
-
-    if reader.fieldnames is None:
-        raise HTTPException(status_code=400, detail="CSV has no header row")
-
-    headers = [h.strip() for h in reader.fieldnames]
-
     # Column validation (points)
     for node in m.points.nodes:
-        for c in [node.name_col, node.lat_col, node.lon_col]:
-            if c not in headers:
-                raise HTTPException(status_code=400, detail=f"Missing required column: {c}")
+        for c in table.missing([node.name_col, node.lat_col, node.lon_col]):
+            raise HTTPException(status_code=400, detail=f"Missing required column: {c}")
 
-    for c in m.points.description_cols:
-        if c not in headers:
-            raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
+    for c in table.missing(m.points.description_cols):
+        raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
 
     # Column validation (links)
-    for c in [m.links.a_lat_col, m.links.a_lon_col, m.links.b_lat_col, m.links.b_lon_col]:
-        if c not in headers:
-            raise HTTPException(status_code=400, detail=f"Missing required column: {c}")
+    link_cols = [m.links.a_lat_col, m.links.a_lon_col, m.links.b_lat_col, m.links.b_lon_col]
+    for c in table.missing(link_cols):
+        raise HTTPException(status_code=400, detail=f"Missing required column: {c}")
 
-    if m.links.link_name_col and m.links.link_name_col not in headers:
+    if m.links.link_name_col and table.missing([m.links.link_name_col]):
         raise HTTPException(status_code=400, detail=f"link_name_col not found: {m.links.link_name_col}")
 
-    for c in m.links.description_cols:
-        if c not in headers:
-            raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
+    for c in table.missing(m.links.description_cols):
+        raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
+
+    point_rule, link_rule = m.points.style_rule, m.links.style_rule
+    for rule in (point_rule, link_rule):
+        if rule and table.missing([rule.column]):
+            raise HTTPException(status_code=400, detail=f"Style column not found: {rule.column}")
+    point_rule_ids = point_rule_styles(point_rule, point_style, "points.style_rule") if point_rule else None
+    link_rule_ids = line_rule_styles(link_rule, line_style, "links.style_rule") if link_rule else None
+
+    # Row layout: a_lat, a_lon, b_lat, b_lon, [link name], link descriptions,
+    # (name, lat, lon) per node, point descriptions, [point style column],
+    # [link style column]
+    columns = [*link_cols]
+    if m.links.link_name_col:
+        columns.append(m.links.link_name_col)
+    link_desc = slice(len(columns), len(columns) + len(m.links.description_cols))
+    columns += m.links.description_cols
+    node_offsets = []
+    for node in m.points.nodes:
+        node_offsets.append((len(columns), node))
+        columns += [node.name_col, node.lat_col, node.lon_col]
+    point_desc = slice(len(columns), len(columns) + len(m.points.description_cols))
+    columns += m.points.description_cols
+    point_style_pos = len(columns)
+    if point_rule:
+        columns.append(point_rule.column)
+    link_style_pos = len(columns)
+    if link_rule:
+        columns.append(link_rule.column)
+
+    link_desc_labels = [f"{c}: " for c in m.links.description_cols]
+    point_desc_labels = [f"{c}: " for c in m.points.description_cols]
 
     # Build points (deduped) + links
-    points_by_key: dict[str, KmlPoint] = {}
-    links: list[KmlLink] = []
-
-    for idx, row in enumerate(reader, start=1):
-        # links
-        a_lat = _parse_float((row.get(m.links.a_lat_col) or "").strip(), idx, m.links.a_lat_col)
-        a_lon = _parse_float((row.get(m.links.a_lon_col) or "").strip(), idx, m.links.a_lon_col)
-        b_lat = _parse_float((row.get(m.links.b_lat_col) or "").strip(), idx, m.links.b_lat_col)
-        b_lon = _parse_float((row.get(m.links.b_lon_col) or "").strip(), idx, m.links.b_lon_col)
-
-        _validate_lat_lon(a_lat, a_lon, idx, "A")
-        _validate_lat_lon(b_lat, b_lon, idx, "B")
-
-        if m.links.link_name_col:
-            link_name = ((row.get(m.links.link_name_col) or "").strip()) or f"Link {idx}"
-        else:
-            link_name = f"Link {idx}"
-
-        link_desc_parts = []
-        for c in m.links.description_cols:
-            link_desc_parts.append(f"{c}: {(row.get(c) or '').strip()}")
-        link_desc = "<br/>".join(link_desc_parts)
-
-        links.append(
-            KmlLink(
-                name=link_name,
-                a_lat=a_lat,
-                a_lon=a_lon,
-                b_lat=b_lat,
-                b_lon=b_lon,
-                description_html=link_desc,
-            )
+    seen_nodes: set[Hashable] = set()
+    node_key = node_key_fn(m.dedupe.mode, m.dedupe.precision, m.dedupe.tolerance_m)
+    points = PointTable()
+    links = LinkTable()
+
+    pairs = [(0, 1), (2, 3)] + [(off + 1, off + 2) for off, _ in node_offsets]
+
+    idx = 0
+    for batch in batched(table.select(columns), COORD_BATCH_SIZE):
+        # Bulk parse + range check; rows from n_ok on take the per-row path,
+        # which raises the row-numbered error
+        coord_cols, n_ok = parse_lat_lon(batch, pairs)
+
+        for i, values in enumerate(batch):
+            idx += 1
+            if i < n_ok:
+                coords = [col[i] for col in coord_cols]
+            elif errors is None:
+                coords = _parse_row_coords(values, idx, m, node_offsets)
+            else:
+                try:
+                    coords = _parse_row_coords(values, idx, m, node_offsets)
+                except HTTPException as e:
+                    errors.add(idx, e.detail)
+                    continue
+
+            if dry_run:
+                continue
+
+            # links
+            a_lat, a_lon, b_lat, b_lon = coords[0], coords[1], coords[2], coords[3]
+
+            link_name = (values[4] if m.links.link_name_col else "") or f"Link {idx}"
+
+            link_desc_html = "<br/>".join([l + v for l, v in zip(link_desc_labels, values[link_desc])])
+            link_style_id = link_rule_ids.style_id(values[link_style_pos]) if link_rule_ids else ""
+            links.append(link_name, a_lat, a_lon, b_lat, b_lon, link_desc_html, 1, link_style_id)
+
+            # points from each node spec
+            for n, (off, node) in enumerate(node_offsets):
+                name = values[off] or "Unnamed"
+                lat = coords[4 + 2 * n]
+                lon = coords[5 + 2 * n]
+
+                key = node_key(lat, lon, name)
+
+                # keep first occurrence (simple + deterministic)
+                if key not in seen_nodes:
+                    seen_nodes.add(key)
+                    desc = "<br/>".join([l + v for l, v in zip(point_desc_labels, values[point_desc])])
+                    point_style_id = point_rule_ids.style_id(values[point_style_pos]) if point_rule_ids else ""
+                    points.append(name, lat, lon, desc, point_style_id)
+
+    if m.edge_dedupe.mode != "none":
+        links = merge_parallel_edges(links, m.edge_dedupe.mode == "directed", m.edge_dedupe.precision)
+
+    document_data: list[tuple[str, object]] = []
+    if errors is not None:
+        errors.rows = idx
+        if errors.invalid:
+            document_data.append(("skipped_rows", errors.invalid))
+
+    shared_styles = [
+        *(point_rule_ids.styles if point_rule_ids else []),
+        *(link_rule_ids.styles if link_rule_ids else []),
+    ]
+
+    overview: list[str] = []
+    points_region = ""
+    if m.points.cluster.zoom_levels:
+        layers = cluster_layers(
+            points.lats,
+            points.lons,
+            m.points.cluster.zoom_levels,
+            m.points.cluster.include_points,
+            point_style.style_id if point_style else None,
+            minify,
+        )
+        overview, points_region = layers.folders, layers.points_region
+        if not m.points.cluster.include_points:
+            points = PointTable()
+
+    def render(name: str, features: GraphTable, extra: Iterable[str]) -> Iterator[bytes]:
+        return iter_kml_graph(
+            document_name=name,
+            points=features.points,
+            links=features.links,
+            point_style=point_style,
+            line_style=line_style,
+            extra=extra,
+            points_region=points_region,
+            shared_styles=shared_styles,
+            minify=minify,
+            document_data=document_data,
         )
 
-        # points from each node spec
-        for node in m.points.nodes:
-            name = ((row.get(node.name_col) or "").strip()) or "Unnamed"
-            lat = _parse_float((row.get(node.lat_col) or "").strip(), idx, node.lat_col)
-            lon = _parse_float((row.get(node.lon_col) or "").strip(), idx, node.lon_col)
-            _validate_lat_lon(lat, lon, idx, name)
-
-            point_desc_parts = []
-            for c in m.points.description_cols:
-                point_desc_parts.append(f"{c}: {(row.get(c) or '').strip()}")
-            point_desc = "<br/>".join(point_desc_parts)
+    return TileableDocument(
+        document_name=document_name,
+        features=GraphTable(points, links),
+        position=lambda f: point_position(f) if isinstance(f, KmlPoint) else link_position(f),
+        render=render,
+        overview=overview,
+    )
 
-            if m.dedupe.mode == "coords":
-                key = f"{round(lat, m.dedupe.precision)},{round(lon, m.dedupe.precision)}"
-            else:
-                key = name.strip().lower()
 
-            # keep first occurrence (simple + deterministic)
-            if key not in points_by_key:
-                points_by_key[key] = KmlPoint(name=name, lat=lat, lon=lon, description_html=point_desc)
+@router.post("/graph")
+async def kml_graph(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    mapping: str = Form(...),
+    output: OutputFormat = Query("kml"),
+    profile: bool = Query(False),
+    strict: bool = Query(True),
+) -> Response:
+    m = _parse_mapping(mapping)
+    if not strict:
+        m = m.model_copy(update={"strict": False})
 
-    points = list(points_by_key.values())
+    inp = await resolve_input(file, dataset_id, explicit_dialect(m.delimiter, m.quotechar))
 
-    out_name = (file.filename or "graph.csv").rsplit(".", 1)[0] + "_graph.kml"
-    kml = build_kml_graph(
-        document_name=file.filename or "csv2kml-graph",
-        points=points,
-        links=links,
-        point_style=point_style,
-        line_style=line_style,
-    )
+    out_name = inp.filename.rsplit(".", 1)[0] + "_graph"
 
-    return Response(
-        content=kml,
-        media_type="application/vnd.google-earth.kml+xml",
-        headers={"Content-Disposition": f'attachment; filename="{out_name}"'},
+    return await conversion_response(
+        request, "graph", convert_graph, inp.source, inp.content_hash, m, inp.filename, out_name, output, inp.dialect, profile,
+        dialect_source=inp.dialect_source,
     )
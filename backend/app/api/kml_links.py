@@ -1,33 +1,27 @@
 from __future__ import annotations
 
-import csv
-import io
 import json
-import re
-from typing import Optional
+from typing import Literal, Optional
 
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, Query, Request, UploadFile
 from fastapi.responses import Response
 from pydantic import BaseModel, Field
 
-from app.api.csv import _detect_dialect
-from app.kml.links_builder import KmlLink, KmlLineStyle, build_kml_links
+from app.api.csv import resolve_input
+from app.api.kml import MinifyConfig, minify_options
+from app.api.responses import OutputFormat, conversion_response
+from app.api.styling import StyleRule, hex_to_kml_color, line_rule_styles
+from app.dedupe import merge_parallel_edges
+from app.ingest.coords import COORD_BATCH_SIZE, parse_lat_lon
+from app.ingest.dialect import CsvDialect, explicit_dialect
+from app.ingest.rows import TableSource, batched, open_table
+from app.ingest.validation import RowErrors
+from app.kml.features import LinkTable
+from app.kml.links_builder import KmlLineStyle, iter_kml_links
+from app.kml.tiles import TileableDocument, link_position
 
 router = APIRouter(prefix="/kml", tags=["KML"])
 
-_HEX_COLOR_RE = re.compile(r"^#[0-9a-fA-F]{6}$")
-
-
-def _hex_to_kml_color(hex_rgb: str) -> str:
-    """#RRGGBB -> aabbggrr (opaque)"""
-    hex_rgb = hex_rgb.strip()
-    if not _HEX_COLOR_RE.match(hex_rgb):
-        raise HTTPException(status_code=400, detail="line_color must be in format #RRGGBB")
-    hex_rgb = hex_rgb.lower()
-    rr = hex_rgb[1:3]
-    gg = hex_rgb[3:5]
-    bb = hex_rgb[5:7]
-    return f"ff{bb}{gg}{rr}"
 
 def _parse_mapping(mapping_raw: str) -> LinksMapping:
     try:
@@ -41,6 +35,13 @@ def _parse_mapping(mapping_raw: str) -> LinksMapping:
         raise HTTPException(status_code=400, detail="Invalid mapping schema") from e
 
 
+class EdgeDedupeConfig(BaseModel):
+    # none: one link per row; directed: merge rows with the same A and B;
+    # undirected: also merge B-A with A-B
+    mode: Literal["none", "directed", "undirected"] = "none"
+    precision: int = 6  # decimals compared
+
+
 class LinksMapping(BaseModel):
     # endpoint A columns
     a_lat_col: str = Field(..., min_length=1)
@@ -58,105 +59,186 @@ class LinksMapping(BaseModel):
     line_color: Optional[str] = None # "#RRGGBB"
     line_width: float = 2.0
 
+    # optional data-driven style (color/width by column value)
+    style_rule: Optional[StyleRule] = None
 
-@router.post("/links")
-async def kml_links(file: UploadFile = File(...), mapping: str = Form(...)) -> Response:
-    if file.filename is None or not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Please upload a .csv file")
-    
-    raw = await file.read()
-    if not raw:
-        raise HTTPException(status_code=400, detail="Empty file.")
+    # optional merging of parallel links
+    edge_dedupe: EdgeDedupeConfig = Field(default_factory=EdgeDedupeConfig)
 
-    try:
-        text = raw.decode("utf-8-sig")
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded (utf-8 or utf-8-sig)")
+    # optional minified output (rounded coordinates, no altitude or empty descriptions)
+    minify: Optional[MinifyConfig] = None
+
+    # optional CSV format (detected when unset)
+    delimiter: Optional[str] = None
+    quotechar: Optional[str] = None
+
+    # false: rows with invalid coordinates are skipped instead of failing
+    # the conversion (also set by ?strict=false)
+    strict: bool = True
 
-    m = _parse_mapping(mapping)
+
+def _parse_link_coords(values: tuple[str, ...], idx: int) -> tuple[float, float, float, float]:
+    a_lat_raw, a_lon_raw, b_lat_raw, b_lon_raw = values[0], values[1], values[2], values[3]
+
+    try:
+        a_lat = float(a_lat_raw)
+        a_lon = float(a_lon_raw)
+        b_lat = float(b_lat_raw)
+        b_lon = float(b_lon_raw)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid coordinates at row {idx}: "
+                f"A=({a_lat_raw},{a_lon_raw}) B=({b_lat_raw},{b_lon_raw})",
+        )
+    
+    # range cheks
+    for lat, lon, label in [(a_lat, a_lon, "A"), (b_lat, b_lon, "B")]:
+        if not (-90.0 <= lat <= 90.0):
+            raise HTTPException(status_code=400, detail=f"Latitude out of range at row {idx} ({label}): {lat}")
+        if not (-180.0 <= lon <= 180.0):
+            raise HTTPException(status_code=400, detail=f"Longitude out of range at row {idx} ({label}): {lon}")
+
+    return a_lat, a_lon, b_lat, b_lon
+
+
+def convert_links(
+    source: TableSource,
+    m: LinksMapping,
+    document_name: str,
+    dialect: Optional[CsvDialect] = None,
+    first_row: int = 1,
+    errors: Optional[RowErrors] = None,
+) -> TileableDocument:
+    """
+    Reads `source` (an upload or a stored dataset) with the given mapping
+    and returns the KML document (see iter_kml_links). Input errors are raised
+    here, before any output is produced (all rows are read first, see
+    convert_points). Runs in a worker, see app.workers.
+
+    - first_row: number of the first data row, when `source` is a chunk of
+      a larger file (see app.cli); used in default names and error messages
+    - errors: collects the invalid rows instead of raising (see convert_points)
+    """
+    if errors is None and not m.strict:
+        errors = RowErrors(limit=0)
+    dry_run = errors is not None and errors.dry_run
+
+    table = open_table(source, dialect)
 
     # style validation
     if m.line_width <= 0 or m.line_width > 50:
         raise HTTPException(status_code=400, detail="line_width must be between 0 and 50")
+    if m.edge_dedupe.precision < 0 or m.edge_dedupe.precision > 12:
+        raise HTTPException(status_code=400, detail="edge_dedupe.precision must be between 0 and 12")
+    minify = minify_options(m.minify)
     
     line_style = None
     if m.line_color or m.line_width !=2.0:
-        kml_color = _hex_to_kml_color(m.line_color) if m.line_color else None
+        kml_color = hex_to_kml_color(m.line_color, "line_color") if m.line_color else None
         line_style = KmlLineStyle(style_id="lineStyle", color=kml_color, width=m.line_width)
     
-    dialect = _detect_dialect(text[:4096])
-    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
-
-    if reader.fieldnames is None:
-        raise HTTPException(status_code=400, detail="CSV has no header now.")
-
-    headers = [h.strip() for h in reader.fieldnames]
-
     required = [m.a_lat_col, m.a_lon_col, m.b_lat_col, m.b_lon_col]
-    missing = [c for c in required if c not in headers]
+    missing = table.missing(required)
     if missing:
         raise HTTPException(status_code=400, detail=f"Missing required columns: {missing}")
     
-    for c in m.description_cols:
-        if c not in headers:
-            raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
+    if m.link_name_col and table.missing([m.link_name_col]):
+        raise HTTPException(status_code=400, detail=f"link_name_col not found: {m.link_name_col}")
+
+    for c in table.missing(m.description_cols):
+        raise HTTPException(status_code=400, detail=f"Description column not found: {c}")
+
+    rule = m.style_rule
+    if rule and table.missing([rule.column]):
+        raise HTTPException(status_code=400, detail=f"Style column not found: {rule.column}")
+    rule_styles = line_rule_styles(rule, line_style, "style_rule") if rule else None
     
+    # Rows come back as (a_lat, a_lon, b_lat, b_lon, [name], *description values, [style column value])
+    columns = [
+        *required,
+        *([m.link_name_col] if m.link_name_col else []),
+        *m.description_cols,
+        *([rule.column] if rule else []),
+    ]
+    desc_start = 5 if m.link_name_col else 4
+    desc_end = desc_start + len(m.description_cols)
+    desc_labels = [f"{c}: " for c in m.description_cols]
+
+    links = LinkTable()
+
+    idx = first_row - 1
+    for batch in batched(table.select(columns), COORD_BATCH_SIZE):
+        # Bulk parse + range check; rows from n_ok on take the per-row path,
+        # which raises the row-numbered error
+        (a_lats, a_lons, b_lats, b_lons), n_ok = parse_lat_lon(batch, [(0, 1), (2, 3)])
+
+        for i, values in enumerate(batch):
+            idx += 1
+            if i < n_ok:
+                a_lat, a_lon, b_lat, b_lon = a_lats[i], a_lons[i], b_lats[i], b_lons[i]
+            elif errors is None:
+                a_lat, a_lon, b_lat, b_lon = _parse_link_coords(values, idx)
+            else:
+                try:
+                    a_lat, a_lon, b_lat, b_lon = _parse_link_coords(values, idx)
+                except HTTPException as e:
+                    errors.add(idx, e.detail)
+                    continue
+
+            if dry_run:
+                continue
+
+            # name
+            name = (values[4] if m.link_name_col else "") or f"Link {idx}"
+
+            # description
+            description = "<br/>".join([label + val for label, val in zip(desc_labels, values[desc_start:desc_end])])
+
+            style_id = rule_styles.style_id(values[desc_end]) if rule_styles else ""
+
+            links.append(name, a_lat, a_lon, b_lat, b_lon, description, 1, style_id)
+
+    if m.edge_dedupe.mode != "none":
+        links = merge_parallel_edges(links, m.edge_dedupe.mode == "directed", m.edge_dedupe.precision)
+
+    document_data: list[tuple[str, object]] = []
+    if errors is not None:
+        errors.rows = idx - first_row + 1
+        if errors.invalid:
+            document_data.append(("skipped_rows", errors.invalid))
+
+    shared_styles = rule_styles.styles if rule_styles else []
+
+    return TileableDocument(
+        document_name=document_name,
+        features=links,
+        position=link_position,
+        render=lambda name, items, extra: iter_kml_links(
+            name, items, line_style, extra, shared_styles, minify, document_data
+        ),
+    )
 
-    links: list[KmlLink] = []
-
-    for idx, row in enumerate(reader, start=1):
-        a_lat_raw = (row.get(m.a_lat_col) or "").strip()
-        a_lon_raw = (row.get(m.a_lon_col) or "").strip()
-        b_lat_raw = (row.get(m.b_lat_col) or "").strip()
-        b_lon_raw = (row.get(m.b_lon_col) or "").strip()
-
-        try:
-            a_lat = float(a_lat_raw)
-            a_lon = float(a_lon_raw)
-            b_lat = float(b_lat_raw)
-            b_lon = float(b_lon_raw)
-        except ValueError:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid coordinates at row {idx}: "
-                    f"A=({a_lat_raw},{a_lon_raw}) B=({b_lat_raw},{b_lon_raw})",
-            )
-        
-        # range cheks
-        for lat, lon, label in [(a_lat, a_lon, "A"), (b_lat, b_lon, "B")]:
-            if not (-90.0 <= lat <= 90.0):
-                raise HTTPException(status_code=400, detail=f"Latitude out of range at row {idx} ({label}): {lat}")
-            if not (-180.0 <= lon <= 180.0):
-                raise HTTPException(status_code=400, detail=f"Longitude out of range at row {idx} ({label}): {lon}")
-        
-        # name
-        if m.link_name_col:
-            name = ((row.get(m.link_name_col) or "").strip()) or f"Link {idx}"
-        else:
-            name = f"Link {idx}"
-        
-        # description
-        desc_parts = []
-        for c in m.description_cols:
-            desc_parts.append(f"{c}: {(row.get(c) or '').strip()}")
-        description = "<br/>".join(desc_parts)
-
-        links.append(
-            KmlLink(
-                name=name,
-                a_lat=a_lat,
-                a_lon=a_lon,
-                b_lat=b_lat,
-                b_lon=b_lon,
-                description_html=description,
-            )
-        )
 
-    kml = build_kml_links(document_name=file.filename or "csv2kml-links", links=links, style=line_style)
+@router.post("/links")
+async def kml_links(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    mapping: str = Form(...),
+    output: OutputFormat = Query("kml"),
+    profile: bool = Query(False),
+    strict: bool = Query(True),
+) -> Response:
+    m = _parse_mapping(mapping)
+    if not strict:
+        m = m.model_copy(update={"strict": False})
+
+    inp = await resolve_input(file, dataset_id, explicit_dialect(m.delimiter, m.quotechar))
+
+    out_name = inp.filename.rsplit(".", 1)[0] + "_links"
 
-    out_name = (file.filename or "links.csv").rsplit(".", 1)[0] + "_links.kml"
-    return Response(
-        content=kml,
-        media_type="application/vnd.google-earth.kml+xml",
-        headers={"Content-Disposition": f'attachment; filename="{out_name}"'},
-    )
\ No newline at end of file
+    return await conversion_response(
+        request, "links", convert_links, inp.source, inp.content_hash, m, inp.filename, out_name, output, inp.dialect, profile,
+        dialect_source=inp.dialect_source,
+    )
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import time
+from functools import partial
+from typing import Any, Optional
+
+from fastapi import APIRouter, File, Form, UploadFile
+
+from app.api.conversions import CONVERSIONS, ConversionKind, load_json, validate_mapping
+from app.api.csv import resolve_input
+from app.ingest.dialect import explicit_dialect
+from app.ingest.validation import RowErrors
+from app.workers import run_in_thread
+
+router = APIRouter(prefix="/kml", tags=["KML"])
+
+
+@router.post("/validate")
+async def kml_validate(
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    kind: ConversionKind = Form(...),
+    mapping: str = Form(...),
+) -> dict[str, Any]:
+    """
+    Checks a CSV (upload or dataset) against a points, links or graph
+    mapping without building any KML: the whole file is read in one pass
+    and every invalid row is reported (the first MAX_REPORTED_ROWS with
+    their error), with row totals.
+
+    Errors that stop a conversion outright (bad mapping, missing columns,
+    unreadable CSV) are still a 400.
+    """
+    model, convert, _ = CONVERSIONS[kind]
+    m = validate_mapping(model, load_json(mapping, "mapping"))
+
+    inp = await resolve_input(file, dataset_id, explicit_dialect(getattr(m, "delimiter", None), getattr(m, "quotechar", None)))
+
+    errors = RowErrors(dry_run=True)
+    started = time.perf_counter()
+    await run_in_thread(partial(convert, inp.source, m, inp.filename, inp.dialect, errors=errors))
+
+    return {
+        "kind": kind,
+        "file": inp.filename,
+        **errors.summary(),
+        "seconds": round(time.perf_counter() - started, 6),
+    }
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.cache import get_result_cache
+from app.datasets import get_dataset_store
+from app.jobs import job_counts
+from app.metrics import CONTENT_TYPE, registry, sample_family
+
+router = APIRouter(tags=["Metrics"])
+
+
+def _cache_metrics() -> list[str]:
+    stats = get_result_cache().stats()
+    lines = []
+    for name in ("hits", "misses", "evictions"):
+        lines += sample_family(f"csv2kml_cache_{name}_total", "counter", f"Result cache {name}", [({}, stats[name])])
+    lines += sample_family(
+        "csv2kml_cache_bytes",
+        "gauge",
+        "Result cache size",
+        [({"tier": "memory"}, stats["memory_bytes"]), ({"tier": "disk"}, stats["disk_bytes"])],
+    )
+    return lines
+
+
+def _state_metrics() -> list[str]:
+    datasets = get_dataset_store().stats()
+    lines = sample_family("csv2kml_datasets", "gauge", "Stored datasets", [({}, datasets["datasets"])])
+    lines += sample_family("csv2kml_datasets_bytes", "gauge", "Estimated memory of stored datasets", [({}, datasets["bytes"])])
+    lines += sample_family(
+        "csv2kml_jobs", "gauge", "Background jobs by state", [({"state": k}, v) for k, v in job_counts().items()]
+    )
+    return lines
+
+
+registry.collectors += [_cache_metrics, _state_metrics]
+
+
+@router.get("/metrics")
+def metrics() -> Response:
+    """
+    Prometheus metrics: request and per-stage latency histograms (upload,
+    hash, detect, queue, parse, build, send) per endpoint, rows and bytes
+    processed, response sizes, result cache counters and in-flight requests.
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import hmac
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Literal, Optional, Union
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+from app import profiling
+from app.cache import ResultCache, get_result_cache, result_key
+from app.ingest.dialect import CsvDialect
+from app.ingest.rows import TableSource
+from app.metrics import current
+from app.settings import get_settings
+from app.workers import Converter, run_conversion, run_in_thread
+
+# kml: plain document; kmz: zipped document; tiled: Region/Lod tiled KMZ
+OutputFormat = Literal["kml", "kmz", "tiled"]
+
+KML_MEDIA_TYPE = "application/vnd.google-earth.kml+xml"
+KMZ_MEDIA_TYPE = "application/vnd.google-earth.kmz"
+
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+
+
+def download_headers(base_name: str, output: OutputFormat) -> tuple[str, dict[str, str]]:
+    """Media type and Content-Disposition of a download (tiled output is a .kmz)."""
+    if output == "kml":
+        return KML_MEDIA_TYPE, {"Content-Disposition": f'attachment; filename="{base_name}.kml"'}
+    return KMZ_MEDIA_TYPE, {"Content-Disposition": f'attachment; filename="{base_name}.kmz"'}
+
+
+def kml_response(
+    body: Union[Iterable[bytes], AsyncIterable[bytes]],
+    base_name: str,
+    output: OutputFormat = "kml",
+    headers: Optional[dict[str, str]] = None,
+) -> StreamingResponse:
+    """
+    Streams an encoded KML or KMZ document as a file download.
+
+    - base_name: download file name without extension
+    """
+    media_type, download = download_headers(base_name, output)
+    return StreamingResponse(body, media_type=media_type, headers={**download, **(headers or {})})
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, as If-None-Match requires
+    candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in candidates
+
+
+async def _store_when_complete(body: AsyncIterator[bytes], cache: ResultCache, key: str) -> AsyncIterator[bytes]:
+    """
+    Passes the chunks through and stores the full result once the stream
+    ends, unless it grew past the cache entry limit (or the client left).
+    """
+    parts: Optional[list[bytes]] = []
+    size = 0
+    async for chunk in body:
+        if parts is not None:
+            size += len(chunk)
+            if size > cache.max_entry_bytes:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        await run_in_thread(cache.put, key, b"".join(parts))
+
+
+def check_profile_access(request: Request) -> None:
+    """Profiling needs CSV2KML_PROFILE_TOKEN set and sent in X-Profile-Token."""
+    token = get_settings().profile_token
+    if token is None:
+        raise HTTPException(status_code=403, detail="Profiling is not enabled on this server")
+    sent = request.headers.get(PROFILE_TOKEN_HEADER, "")
+    if not hmac.compare_digest(sent.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail=f"Profiling needs a valid {PROFILE_TOKEN_HEADER} header")
+
+
+async def _profiled_conversion(
+    kind: str,
+    convert: Converter,
+    source: TableSource,
+    mapping: BaseModel,
+    document_name: str,
+    output: OutputFormat,
+    dialect: Optional[CsvDialect],
+) -> JSONResponse:
+    """
+    Converts under the profiler, discarding the output, and returns the
+    report: stage timings of the request so far, rows, output size and the
+    hottest functions (plus the pstats file, when CSV2KML_PROFILE_DIR is set).
+    "profile_scope" tells whether the functions are this conversion's only
+    ("conversion") or everything the process ran meanwhile ("process").
+    """
+    profiler = profiling.acquire()
+    if profiler is None:
+        raise HTTPException(status_code=503, detail="Another profiled conversion is running, retry later")
+    try:
+        body = await run_conversion(convert, source, mapping, document_name, dialect, output=output, profiler=profiler)
+        output_bytes = 0
+        async for chunk in body:
+            output_bytes += len(chunk)
+
+        m = current()
+        stages: dict[str, float] = {}
+        for stage, seconds in m.stages if m else ():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        report: dict[str, Any] = {
+            "kind": kind,
+            "output": output,
+            "rows": m.rows if m else None,
+            "output_bytes": output_bytes,
+            "seconds": round(time.perf_counter() - m.started, 6) if m else None,
+            "stages": {stage: round(seconds, 6) for stage, seconds in stages.items()},
+            "profile_scope": "process" if profiling.PROCESS_WIDE else "conversion",
+            "hot_functions": profiler.hot_functions(),
+        }
+        profile_dir = get_settings().profile_dir
+        if profile_dir:
+            report["pstats_file"] = profiler.dump(profile_dir, kind)
+    finally:
+        profiling.release()
+    return JSONResponse(report)
+
+
+async def conversion_response(
+    request: Request,
+    kind: str,
+    convert: Converter,
+    source: TableSource,
+    content_hash: str,
+    mapping: BaseModel,
+    document_name: str,
+    base_name: str,
+    output: OutputFormat = "kml",
+    dialect: Optional[CsvDialect] = None,
+    profile: bool = False,
+    dialect_source: str = "detected",
+) -> Response:
+    """
+    Converts an upload or dataset and returns the download response, going
+    through the result cache.
+
+    The result is addressed by the input's content hash, the mapping and
+    the output parameters, which is also sent as a strong ETag: a request
+    whose If-None-Match carries it gets a 304 without any conversion, a
+    cache hit is answered from memory/disk, and a miss is converted and
+    streamed while being stored.
+
+    `dialect` (explicit, detected, or a dataset's, as told by
+    `dialect_source`) is part of the key: the content hash is of the raw
+    bytes, which read with another dialect give other rows.
+
+    With `profile`, the conversion bypasses the cache and runs under the
+    profiler, and the response is the profile report instead of the file.
+    """
+    if profile:
+        check_profile_access(request)
+        return await _profiled_conversion(kind, convert, source, mapping, document_name, output, dialect)
+
+    key = result_key(kind, content_hash, mapping, dialect, dialect_source, document_name, output)
+    etag = f'"{key}"'
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cache = get_result_cache()
+    if cache.enabled:
+        data = await run_in_thread(cache.get, key)
+        if data is not None:
+            media_type, download = download_headers(base_name, output)
+            return Response(content=data, media_type=media_type, headers={**download, "ETag": etag})
+
+    body = await run_conversion(convert, source, mapping, document_name, dialect, output=output)
+    if cache.enabled:
+        body = _store_when_complete(body, cache, key)
+
+    return kml_response(body, base_name, output, headers={"ETag": etag})
@@ -4,6 +4,11 @@ from app.api.csv import router as csv_router
 from app.api.kml import router as kml_router
 from app.api.kml_links import router as kml_links_router
 from app.api.kml_graph import router as kml_graph_router
+from app.api.kml_batch import router as kml_batch_router
+from app.api.kml_validate import router as kml_validate_router
+from app.api.jobs import router as jobs_router
+from app.api.cache import router as cache_router
+from app.api.metrics import router as metrics_router
 
 router = APIRouter()
 
@@ -11,4 +16,9 @@ router.include_router(health_router)
 router.include_router(csv_router)
 router.include_router(kml_router)
 router.include_router(kml_links_router)
-router.include_router(kml_graph_router)
\ No newline at end of file
+router.include_router(kml_graph_router)
+router.include_router(kml_batch_router)
+router.include_router(kml_validate_router)
+router.include_router(jobs_router)
+router.include_router(cache_router)
+router.include_router(metrics_router)
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Data-driven styling: a style rule picks the style of each point or link
+from the value of a CSV column, by category (exact values) or graduated
+(numeric ranges). The rule's styles are shared <Style> elements of the
+document, which placemarks refer to by id (see app.kml.writer).
+"""
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from dataclasses import replace
+from typing import Callable, Generic, Literal, Optional, TypeVar
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from app.kml.builder import KmlPointStyle
+from app.kml.features import INTERN_MAX_DISTINCT
+from app.kml.links_builder import KmlLineStyle
+
+_HEX_COLOR_RE = re.compile(r"^#[0-9a-fA-F]{6}$")
+
+# Max categories + classes of a rule (each one a <Style> at most).
+MAX_STYLE_RULE_ENTRIES = 256
+
+S = TypeVar("S", KmlPointStyle, KmlLineStyle)
+
+
+class StyleValues(BaseModel):
+    # unset values are taken from the mapping's own style
+    color: Optional[str] = None  # "#RRGGBB": icon color of points, line color of links
+    width: Optional[float] = None  # links
+    icon_url: Optional[str] = None  # points
+    icon_scale: Optional[float] = None  # points
+
+
+class StyleClass(StyleValues):
+    # values from min (inclusive) up to the next class's min
+    min: float
+
+
+class StyleRule(BaseModel):
+    column: str = Field(..., min_length=1)
+    # categorical: a style per column value; graduated: per numeric range
+    type: Literal["categorical", "graduated"] = "categorical"
+    categories: dict[str, StyleValues] = Field(default_factory=dict)
+    classes: list[StyleClass] = Field(default_factory=list)
+    # values matching no category or class (unset: the mapping's style)
+    default: Optional[StyleValues] = None
+
+
+def hex_to_kml_color(hex_rgb: str, field_name: str) -> str:
+    """#RRGGBB -> aabbggrr (opaque, lowercase); a 400 naming `field_name` otherwise"""
+    hex_rgb = hex_rgb.strip()
+    if not _HEX_COLOR_RE.match(hex_rgb):
+        raise HTTPException(status_code=400, detail=f"{field_name} must be in format #RRGGBB")
+    hex_rgb = hex_rgb.lower()
+    return f"ff{hex_rgb[5:7]}{hex_rgb[3:5]}{hex_rgb[1:3]}"
+
+
+def check_style_rule(rule: StyleRule, field_name: str) -> None:
+    if rule.type == "categorical" and not rule.categories:
+        raise HTTPException(status_code=400, detail=f"{field_name}.categories is required for a categorical rule")
+    if rule.type == "graduated" and not rule.classes:
+        raise HTTPException(status_code=400, detail=f"{field_name}.classes is required for a graduated rule")
+    if len(rule.categories) + len(rule.classes) > MAX_STYLE_RULE_ENTRIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{field_name} takes at most {MAX_STYLE_RULE_ENTRIES} categories and classes",
+        )
+
+
+class RuleStyles(Generic[S]):
+    """
+    The shared styles of a style rule, and the style id of a column value.
+
+    Every entry of the rule is resolved to a style up front and interned by
+    value (entries that look the same share one style), with ids given in
+    rule order, so parts of a file converted apart (app.cli) agree on them.
+    A column value then costs one dict lookup: categories are a dict,
+    classes are bisected once per distinct value and cached.
+    "" is the id of values left to the mapping's own style.
+    """
+
+    def __init__(self, rule: StyleRule, make_style: Callable[[StyleValues], S], prefix: str) -> None:
+        self.styles: list[S] = []
+        ids: dict[S, str] = {}
+
+        def intern(values: StyleValues) -> str:
+            style = make_style(values)
+            style_id = ids.get(style)
+            if style_id is None:
+                style_id = ids[style] = f"{prefix}{len(ids) + 1}"
+                self.styles.append(replace(style, style_id=style_id))
+            return style_id
+
+        self._default = intern(rule.default) if rule.default is not None else ""
+        self._graduated = rule.type == "graduated"
+        self._ids: dict[str, str] = {}
+        self._mins: list[float] = []
+        self._class_ids: list[str] = []
+        if self._graduated:
+            classes = sorted(rule.classes, key=lambda c: c.min)
+            self._mins = [c.min for c in classes]
+            self._class_ids = [intern(c) for c in classes]
+        else:
+            self._ids = {value.strip(): intern(values) for value, values in rule.categories.items()}
+
+    def style_id(self, value: str) -> str:
+        style_id = self._ids.get(value)
+        if style_id is not None:
+            return style_id
+        if not self._graduated:
+            return self._default
+
+        style_id = self._default
+        try:
+            number = float(value)
+        except ValueError:
+            number = None
+        if number is not None and number == number:  # NaN: default
+            i = bisect_right(self._mins, number) - 1
+            if i >= 0:
+                style_id = self._class_ids[i]
+        # cache distinct values, up to a bound (a numeric column may be unique per row)
+        if len(self._ids) < INTERN_MAX_DISTINCT:
+            self._ids[value] = style_id
+        return style_id
+
+
+def point_rule_styles(rule: StyleRule, base: Optional[KmlPointStyle], field_name: str) -> RuleStyles[KmlPointStyle]:
+    """A point style rule, over the mapping's point style `base`."""
+    check_style_rule(rule, field_name)
+    base = base or KmlPointStyle(style_id="")
+
+    def make_style(values: StyleValues) -> KmlPointStyle:
+        scale = base.icon_scale if values.icon_scale is None else values.icon_scale
+        if scale <= 0 or scale > 10:
+            raise HTTPException(status_code=400, detail=f"{field_name}: icon_scale must be between 0 and 10")
+        return KmlPointStyle(
+            style_id="",
+            icon_url=values.icon_url or base.icon_url,
+            icon_scale=scale,
+            icon_color=hex_to_kml_color(values.color, f"{field_name}: color") if values.color else base.icon_color,
+        )
+
+    return RuleStyles(rule, make_style, "pointStyle")
+
+
+def line_rule_styles(rule: StyleRule, base: Optional[KmlLineStyle], field_name: str) -> RuleStyles[KmlLineStyle]:
+    """A link style rule, over the mapping's line style `base`."""
+    check_style_rule(rule, field_name)
+    base = base or KmlLineStyle(style_id="")
+
+    def make_style(values: StyleValues) -> KmlLineStyle:
+        width = base.width if values.width is None else values.width
+        if width <= 0 or width > 50:
+            raise HTTPException(status_code=400, detail=f"{field_name}: width must be between 0 and 50")
+        return KmlLineStyle(
+            style_id="",
+            color=hex_to_kml_color(values.color, f"{field_name}: color") if values.color else base.color,
+            width=width,
+        )
+
+    return RuleStyles(rule, make_style, "lineStyle")
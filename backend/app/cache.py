@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+from pydantic import BaseModel
+
+from app.ingest.dialect import CsvDialect
+from app.settings import get_settings
+
+# Bump when the KML output for a given input changes, so stale disk
+# entries are never served.
+CACHE_VERSION = "4"
+
+_HASH_READ_SIZE = 1024 * 1024
+
+
+def file_sha256(fileobj: BinaryIO) -> str:
+    """sha256 of a file's content. The file is rewound afterwards."""
+    h = hashlib.sha256()
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(_HASH_READ_SIZE)
+        if not chunk:
+            break
+        h.update(chunk)
+    fileobj.seek(0)
+    return h.hexdigest()
+
+
+def result_key(
+    kind: str,
+    content_hash: str,
+    mapping: BaseModel,
+    dialect: Optional[CsvDialect],
+    dialect_source: str,
+    *params: str,
+) -> str:
+    """
+    Content address of a conversion result: the input's content hash, the
+    normalized mapping, the dialect the input is parsed with (the same
+    bytes read with another quotechar are other rows) and where it comes
+    from, and any other output-affecting parameter (document name, output
+    format, ...).
+    """
+    h = hashlib.sha256()
+    for part in (CACHE_VERSION, kind, content_hash, mapping.model_dump_json(), repr(dialect), dialect_source, *params):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of encoded conversion results (KML/KMZ bytes),
+    in memory and optionally in a directory on disk.
+
+    Entries larger than max_entry_bytes are never stored. Thread-safe:
+    the endpoints look results up, and store them once their stream ends,
+    through the worker threads (app.workers.run_in_thread), since either
+    may touch the disk. Files are read and written outside the lock.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entry_bytes: int,
+        directory: Optional[str] = None,
+        disk_max_bytes: int = 0,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes if directory else 0
+
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entry_bytes > 0 and (self.max_bytes > 0 or self.disk_max_bytes > 0)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory or "", f"{key}.bin")
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            st = os.stat(os.path.join(self.directory, name))
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+            if key not in self._disk:
+                self.misses += 1
+                return None
+
+        # Read outside the lock, so a large file does not hold up other
+        # lookups and stores: entries are content-addressed and written
+        # with a rename, so the file is complete (or gone, if evicted).
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory(key, data)
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._put_memory(key, data)
+            to_disk = bool(self.directory) and key not in self._disk and len(data) <= self.disk_max_bytes
+        if not to_disk or not self._write_disk(key, data):
+            return
+        with self._lock:
+            if key not in self._disk:  # unless a concurrent put of the same result won
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+                self._evict_disk()
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes or key in self._memory:
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self.evictions += 1
+
+    def _write_disk(self, key: str, data: bytes) -> bool:
+        # write + rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+    def _evict_disk(self) -> None:
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+@lru_cache
+def get_result_cache() -> ResultCache:
+    s = get_settings()
+    return ResultCache(
+        max_bytes=s.cache_max_bytes,
+        max_entry_bytes=s.cache_max_entry_bytes,
+        directory=s.cache_dir,
+        disk_max_bytes=s.cache_disk_max_bytes,
+    )
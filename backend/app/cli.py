@@ -0,0 +1,318 @@
+"""
+Converts CSV files to KML from the command line, without the HTTP server.
+
+Run from backend/:
+
+    python -m app.cli points --mapping points.json data/*.csv -o out/
+    python -m app.cli graph --mapping graph.json exports/ --output kmz --workers 8
+    python -m app.cli links --mapping links.json huge.csv --chunks 8
+
+Inputs are CSV files or directories (their *.csv files). Every file is
+converted with the same mapping JSON as POST /kml/<kind> and written to the
+output directory (next to its input by default), named like the endpoint
+downloads. Files are converted in parallel in a process pool.
+
+--chunks splits each file into line-aligned chunks converted in parallel
+instead, for single large files. It applies to points and links whose
+result does not depend on the whole file (no clusters, no edge dedupe)
+and to files with one record per line: a file with line breaks inside
+quoted fields, like other conversions, falls back to one process.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, BinaryIO, Optional, Sequence
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from app.api.conversions import CONVERSIONS, validate_mapping
+from app.ingest.dialect import CsvDialect, detect_dialect, explicit_dialect
+from app.ingest.upload import CsvInputError, CsvTextStream
+from app.kml.stream import encode_output
+
+_READ_SIZE = 1024 * 1024
+
+# Empty lines, which the CSV reader skips: not counted as rows.
+_BLANK_LINE_RE = re.compile(rb"^\r?\n", re.MULTILINE)
+
+
+def collect_inputs(paths: Sequence[str]) -> list[str]:
+    """The given files, plus the *.csv files of the given directories (sorted)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(".csv") and os.path.isfile(os.path.join(path, name))
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def output_path(src: str, out_dir: Optional[str], suffix: str, output: str) -> str:
+    ext = "kml" if output == "kml" else "kmz"
+    base = os.path.splitext(os.path.basename(src))[0] + suffix
+    return os.path.join(out_dir if out_dir is not None else os.path.dirname(src), f"{base}.{ext}")
+
+
+def _error_message(e: Exception) -> str:
+    return str(e.detail) if isinstance(e, HTTPException) else str(e)
+
+
+def _write_document(doc: Any, output: str, dst: str) -> None:
+    # write + rename, so a partial file never has the final name
+    tmp = dst + ".part"
+    try:
+        with open(tmp, "wb") as out:
+            for chunk in encode_output(doc, output):
+                out.write(chunk)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def convert_file(kind: str, m: BaseModel, src: str, dst: str, output: str) -> Optional[str]:
+    """Converts one CSV file to `dst`. Returns the error message on bad input."""
+    convert = CONVERSIONS[kind][1]
+    dialect = explicit_dialect(getattr(m, "delimiter", None), getattr(m, "quotechar", None))
+    try:
+        with open(src, "rb") as f:
+            doc = convert(f, m, os.path.basename(src), dialect)
+        _write_document(doc, output, dst)
+    except (HTTPException, CsvInputError) as e:
+        return _error_message(e)
+    return None
+
+
+def chunkable(kind: str, m: Any) -> bool:
+    """Whether a conversion's result is the concatenation of its chunks' results."""
+    if not m.strict:
+        return False  # skipped rows are counted per document
+    if kind == "points":
+        return not m.cluster.zoom_levels
+    if kind == "links":
+        return m.edge_dedupe.mode == "none"
+    return False
+
+
+def _count_rows(f: BinaryIO, start: int, end: int) -> int:
+    """Rows in bytes [start, end) of a CSV file: its non-empty lines."""
+    f.seek(start)
+    rows = 0
+    at_line_start = True
+    block = b""
+    remaining = end - start
+    while remaining > 0:
+        block = f.read(min(_READ_SIZE, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        rows += block.count(b"\n") - len(_BLANK_LINE_RE.findall(block))
+        if not at_line_start and _BLANK_LINE_RE.match(block):
+            rows += 1  # the block starts mid-line: that match ends a non-empty line
+        # a block ending in "\r" of a "\r\n" line is still at the line start
+        tail = block.rstrip(b"\r")
+        at_line_start = tail.endswith(b"\n") or (not tail and at_line_start)
+    if block and not block.endswith(b"\n"):
+        rows += 1  # unterminated last line
+    return rows
+
+
+def _has_quoted_line_break(path: str, quotechar: str) -> bool:
+    """
+    Whether a line break of a CSV file falls inside a quoted field (a
+    record spanning lines, which chunks split on lines would cut). Quotes
+    are paired from the start of the file; an escaped "" closes and
+    reopens the field.
+    """
+    quote = quotechar.encode()
+    quoted = False
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(_READ_SIZE)
+            if not block:
+                return False
+            parts = block.split(quote)
+            # parts alternate outside / inside quotes
+            if b"\n" in b"".join(parts[0 if quoted else 1::2]):
+                return True
+            quoted ^= len(parts) % 2 == 0
+
+
+def chunk_ranges(path: str, chunks: int) -> tuple[bytes, list[tuple[int, int, int]]]:
+    """
+    Splits a CSV file into up to `chunks` byte ranges ending on line
+    boundaries. Returns the header line and (start, end, first row number)
+    per range.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.readline()
+        bounds = [f.tell()]
+        for i in range(1, chunks):
+            f.seek(max(bounds[-1], bounds[0] + (size - bounds[0]) * i // chunks))
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+        bounds.append(size)
+
+        ranges = []
+        row = 1
+        for start, end in zip(bounds, bounds[1:]):
+            if start >= end:
+                continue
+            ranges.append((start, end, row))
+            row += _count_rows(f, start, end)
+    return header, ranges
+
+
+def _read_chunk(path: str, header: bytes, start: int, end: int) -> io.BytesIO:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return io.BytesIO(header + f.read(end - start))
+
+
+def _convert_chunk(
+    kind: str,
+    m: BaseModel,
+    path: str,
+    header: bytes,
+    span: tuple[int, int, int],
+    dialect: CsvDialect,
+) -> tuple[Any, Optional[str]]:
+    """Worker process entry point: (feature table of one chunk, error message)."""
+    start, end, first_row = span
+    try:
+        doc = CONVERSIONS[kind][1](_read_chunk(path, header, start, end), m, os.path.basename(path), dialect, first_row)
+    except (HTTPException, CsvInputError) as e:
+        return None, _error_message(e)
+    return doc.features, None
+
+
+def convert_file_chunked(
+    pool: Executor,
+    kind: str,
+    m: BaseModel,
+    src: str,
+    dst: str,
+    output: str,
+    chunks: int,
+) -> Optional[str]:
+    """
+    Converts one CSV file to `dst`, its chunks in parallel in `pool`. The
+    first chunk is converted here and its document takes the features of
+    the others, in file order.
+    """
+    if not chunkable(kind, m):
+        return pool.submit(convert_file, kind, m, src, dst, output).result()
+
+    dialect = explicit_dialect(getattr(m, "delimiter", None), getattr(m, "quotechar", None))
+    try:
+        if dialect is None:
+            with open(src, "rb") as f:
+                dialect = detect_dialect(CsvTextStream(f).sample)
+        if _has_quoted_line_break(src, dialect.quotechar):
+            return convert_file(kind, m, src, dst, output)
+        header, ranges = chunk_ranges(src, chunks)
+        if len(ranges) < 2:
+            return convert_file(kind, m, src, dst, output)
+
+        futures = [pool.submit(_convert_chunk, kind, m, src, header, span, dialect) for span in ranges[1:]]
+        start, end, _ = ranges[0]
+        doc = CONVERSIONS[kind][1](_read_chunk(src, header, start, end), m, os.path.basename(src), dialect)
+
+        for future in futures:
+            part, error = future.result()
+            if error:
+                return error
+            doc.features.extend(part)
+        _write_document(doc, output, dst)
+    except (HTTPException, CsvInputError) as e:
+        return _error_message(e)
+    return None
+
+
+def _parse_args(argv: Optional[Sequence[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.cli",
+        description="Convert CSV files to KML/KMZ with a points, links or graph mapping.",
+    )
+    parser.add_argument("kind", choices=sorted(CONVERSIONS))
+    parser.add_argument("inputs", nargs="+", help="CSV files or directories of CSV files")
+    parser.add_argument("-m", "--mapping", required=True, help="mapping JSON file (as sent to /kml/<kind>)")
+    parser.add_argument("-o", "--out-dir", help="output directory (default: next to each input)")
+    parser.add_argument("--output", choices=["kml", "kmz", "tiled"], default="kml")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--chunks", type=int, default=1, help="split each file into this many parallel chunks")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.chunks < 1:
+        parser.error("--workers and --chunks must be >= 1")
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = _parse_args(argv)
+    model, _, suffix = CONVERSIONS[args.kind]
+    try:
+        with open(args.mapping, "rb") as f:
+            m = validate_mapping(model, json.load(f))
+    except (OSError, ValueError, HTTPException) as e:
+        print(f"error: cannot load mapping {args.mapping}: {_error_message(e)}", file=sys.stderr)
+        return 2
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("error: no CSV files to convert", file=sys.stderr)
+        return 2
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    jobs = [(src, output_path(src, args.out_dir, suffix, args.output)) for src in inputs]
+
+    started = time.perf_counter()
+    failed = 0
+
+    def report(src: str, dst: str, error: Optional[str]) -> None:
+        nonlocal failed
+        if error:
+            failed += 1
+            print(f"{src}: error: {error}", file=sys.stderr)
+        else:
+            print(f"{src} -> {dst}")
+
+    workers = min(args.workers, max(len(jobs), args.chunks))
+    if workers == 1:
+        for src, dst in jobs:
+            report(src, dst, convert_file(args.kind, m, src, dst, args.output))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            if args.chunks > 1 and chunkable(args.kind, m):
+                # one file at a time, its chunks spread over the pool
+                for src, dst in jobs:
+                    report(src, dst, convert_file_chunked(pool, args.kind, m, src, dst, args.output, args.chunks))
+            else:
+                # one process per file (also when --chunks does not apply)
+                futures = [(src, dst, pool.submit(convert_file, args.kind, m, src, dst, args.output)) for src, dst in jobs]
+                for src, dst, future in futures:
+                    report(src, dst, future.result())
+
+    elapsed = time.perf_counter() - started
+    print(f"{len(jobs) - failed}/{len(jobs)} files converted in {elapsed:.2f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from app.ingest.rows import ColumnTable
+from app.settings import get_settings
+
+
+@dataclass
+class Dataset:
+    """An uploaded CSV kept in parsed, columnar form for repeated conversions."""
+
+    dataset_id: str
+    filename: str
+    content_hash: str  # sha256 of the uploaded bytes (see app.cache.file_sha256)
+    table: ColumnTable
+    nbytes: int
+    last_used: float
+    dialect_explicit: bool = False  # parsed with the upload's delimiter/quotechar, not detected ones
+
+
+class DatasetTooLarge(Exception):
+    pass
+
+
+class DatasetStore:
+    """
+    In-memory datasets with an idle TTL and a total memory budget.
+
+    Datasets unused for `ttl_seconds` expire; when the budget is exceeded
+    the least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, Dataset] = OrderedDict()
+        self._bytes = 0
+
+    def add(self, filename: str, content_hash: str, table: ColumnTable, dialect_explicit: bool = False) -> Dataset:
+        nbytes = table.estimate_bytes()
+        if nbytes > self.max_bytes:
+            raise DatasetTooLarge(f"Dataset needs ~{nbytes} bytes, the budget is {self.max_bytes}")
+
+        ds = Dataset(
+            dataset_id=uuid.uuid4().hex,
+            filename=filename,
+            content_hash=content_hash,
+            table=table,
+            nbytes=nbytes,
+            last_used=time.monotonic(),
+            dialect_explicit=dialect_explicit,
+        )
+        with self._lock:
+            self._expire(time.monotonic())
+            self._items[ds.dataset_id] = ds
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= old.nbytes
+        return ds
+
+    def get(self, dataset_id: str) -> Optional[Dataset]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            ds = self._items.get(dataset_id)
+            if ds is None:
+                return None
+            ds.last_used = now
+            self._items.move_to_end(dataset_id)
+            return ds
+
+    def remove(self, dataset_id: str) -> bool:
+        with self._lock:
+            ds = self._items.pop(dataset_id, None)
+            if ds is None:
+                return False
+            self._bytes -= ds.nbytes
+            return True
+
+    def _expire(self, now: float) -> None:
+        # LRU order: the oldest entries are first
+        while self._items:
+            ds = next(iter(self._items.values()))
+            if now - ds.last_used <= self.ttl_seconds:
+                break
+            self._items.popitem(last=False)
+            self._bytes -= ds.nbytes
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"datasets": len(self._items), "bytes": self._bytes}
+
+
+@lru_cache
+def get_dataset_store() -> DatasetStore:
+    s = get_settings()
+    return DatasetStore(max_bytes=s.dataset_max_bytes, ttl_seconds=s.dataset_ttl_seconds)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import math
+from typing import Callable, Hashable
+
+from app.kml.features import LinkTable
+
+# Metres per degree of latitude (mean Earth radius 6371 km).
+METERS_PER_DEGREE = 6_371_000.0 * math.pi / 180.0
+
+
+def coord_key_fn(precision: int) -> Callable[[float, float], tuple[int, int]]:
+    """
+    Dedupe key of a coordinate pair at `precision` decimals: both values
+    quantized to integers, which is cheaper to build and hash than a
+    formatted string of two rounded floats.
+    """
+    scale = 10.0 ** precision
+
+    def key(lat: float, lon: float) -> tuple[int, int]:
+        return round(lat * scale), round(lon * scale)
+
+    return key
+
+
+class DistanceIndex:
+    """
+    Snaps coordinates to the first seen coordinate within `tolerance_m`
+    metres, using a grid hash: each lookup only checks the 3x3 cells
+    around the point, so indexing n nodes stays O(n).
+
+    Latitude bands are `tolerance_m` high; within a band, cells are as wide
+    in longitude as `tolerance_m` at the most poleward latitude of the band
+    and its neighbours, so any match lies in an adjacent cell. Distances use
+    the equirectangular approximation (accurate at the metre scale this is
+    meant for). Longitudes are not wrapped at the antimeridian.
+    """
+
+    def __init__(self, tolerance_m: float) -> None:
+        self.tolerance_m = tolerance_m
+        self._band_deg = tolerance_m / METERS_PER_DEGREE
+        self._cell_width: dict[int, float] = {}
+        self._cells: dict[tuple[int, int], list[tuple[float, float, int]]] = {}
+        self._count = 0
+
+    def _width(self, band: int) -> float:
+        width = self._cell_width.get(band)
+        if width is None:
+            edge = min(90.0, max(abs(band - 1), abs(band + 2)) * self._band_deg)
+            cos = math.cos(math.radians(edge))
+            width = self._band_deg / cos if cos > 1e-9 else 360.0
+            width = min(width, 360.0)
+            self._cell_width[band] = width
+        return width
+
+    def key(self, lat: float, lon: float) -> int:
+        """
+        Id of the first indexed coordinate within the tolerance of
+        (lat, lon); if there is none, (lat, lon) is indexed under a new id.
+        """
+        band = math.floor(lat / self._band_deg)
+        tol2 = self.tolerance_m * self.tolerance_m
+        ky = METERS_PER_DEGREE
+        kx = METERS_PER_DEGREE * math.cos(math.radians(lat))
+        cells = self._cells.get
+
+        found = -1
+        for b in (band - 1, band, band + 1):
+            col = math.floor(lon / self._width(b))
+            for c in (col - 1, col, col + 1):
+                for p_lat, p_lon, p_id in cells((b, c), ()):
+                    dy = (lat - p_lat) * ky
+                    dx = (lon - p_lon) * kx
+                    if dx * dx + dy * dy <= tol2 and (found < 0 or p_id < found):
+                        found = p_id
+        if found >= 0:
+            return found
+
+        new_id = self._count
+        self._count += 1
+        cell = (band, math.floor(lon / self._width(band)))
+        self._cells.setdefault(cell, []).append((lat, lon, new_id))
+        return new_id
+
+
+def node_key_fn(mode: str, precision: int, tolerance_m: float) -> Callable[[float, float, str], Hashable]:
+    """
+    The graph node dedupe key for a dedupe mode: nodes with equal keys are
+    merged (the first one is kept).
+
+    - coords: coordinates equal at `precision` decimals
+    - name: same name, case-insensitive
+    - distance: within `tolerance_m` metres of an earlier node
+    """
+    if mode == "name":
+        return lambda lat, lon, name: name.strip().lower()
+
+    if mode == "distance":
+        index = DistanceIndex(tolerance_m)
+        return lambda lat, lon, name: index.key(lat, lon)
+
+    coord_key = coord_key_fn(precision)
+    return lambda lat, lon, name: coord_key(lat, lon)
+
+
+def merge_parallel_edges(links: LinkTable, directed: bool, precision: int) -> LinkTable:
+    """
+    Merges links with the same endpoints (compared at `precision`
+    decimals) into one, in a single pass over a hash index.
+
+    Undirected: A-B and B-A are the same edge. The merged link keeps the
+    first link's name, style and geometry, the number of merged links as `count`
+    and their distinct non-empty descriptions. Order of first occurrence
+    is kept.
+    """
+    coord_key = coord_key_fn(precision)
+    groups: dict[tuple[tuple[int, int], tuple[int, int]], list[int]] = {}
+    coords = zip(links.a_lats, links.a_lons, links.b_lats, links.b_lons)
+    for i, (a_lat, a_lon, b_lat, b_lon) in enumerate(coords):
+        a = coord_key(a_lat, a_lon)
+        b = coord_key(b_lat, b_lon)
+        if not directed and b < a:
+            a, b = b, a
+        group = groups.get((a, b))
+        if group is None:
+            groups[(a, b)] = [i]
+        else:
+            group.append(i)
+
+    merged = LinkTable()
+    for group in groups.values():
+        i = group[0]
+        description = links.descriptions[i]
+        if len(group) > 1:
+            descriptions = dict.fromkeys(links.descriptions[j] for j in group if links.descriptions[j])
+            description = "<hr/>".join(descriptions)
+        merged.append(
+            links.names[i],
+            links.a_lats[i],
+            links.a_lons[i],
+            links.b_lats[i],
+            links.b_lons[i],
+            description,
+            len(group),
+            links.style_ids[i],
+        )
+    return merged
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python path below
+    np = None
+
+# Rows per coordinate batch. Large enough to amortize the array setup,
+# small enough that a batch of string tuples stays a few MB.
+COORD_BATCH_SIZE = 8192
+
+
+def parse_lat_lon(
+    batch: Sequence[Sequence[str]],
+    pairs: Sequence[tuple[int, int]],
+) -> tuple[list[list[float]], int]:
+    """
+    Parses and range-checks (lat, lon) cells for a batch of rows.
+
+    - batch: row tuples as yielded by CsvTable.select()
+    - pairs: (lat position, lon position) inside each row tuple
+
+    Returns one float column per position, in the order lat0, lon0, lat1,
+    lon1, ..., and the number of leading rows that are valid. Callers take
+    the rows from that index on through their own per-row parsing, which
+    raises the row-numbered error (or, should the two ever disagree, just
+    parses the row).
+
+    Uses NumPy when it is installed, plain float() otherwise.
+    """
+    if np is not None and batch:
+        return _parse_numpy(batch, pairs)
+    return _parse_python(batch, pairs)
+
+
+def _parse_python(
+    batch: Sequence[Sequence[str]],
+    pairs: Sequence[tuple[int, int]],
+) -> tuple[list[list[float]], int]:
+    columns: list[list[float]] = [[] for _ in range(2 * len(pairs))]
+    for i, row in enumerate(batch):
+        parsed = []
+        for lat_pos, lon_pos in pairs:
+            try:
+                lat = float(row[lat_pos])
+                lon = float(row[lon_pos])
+            except ValueError:
+                return _truncate(columns, i), i
+            if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+                return _truncate(columns, i), i
+            parsed.append(lat)
+            parsed.append(lon)
+        for col, value in zip(columns, parsed):
+            col.append(value)
+    return columns, len(batch)
+
+
+def _truncate(columns: list[list[float]], n: int) -> list[list[float]]:
+    return [col[:n] for col in columns]
+
+
+def _parse_numpy(
+    batch: Sequence[Sequence[str]],
+    pairs: Sequence[tuple[int, int]],
+) -> tuple[list[list[float]], int]:
+    # transpose once (C speed), then parse whole columns
+    cells = list(zip(*batch))
+    invalid = np.zeros(len(batch), dtype=bool)
+    arrays = []
+
+    for lat_pos, lon_pos in pairs:
+        try:
+            lat = np.array(cells[lat_pos], dtype=np.float64)
+            lon = np.array(cells[lon_pos], dtype=np.float64)
+        except ValueError:
+            # an unparsable cell somewhere: let the scalar path find the row
+            return _parse_python(batch, pairs)
+
+        # NaN compares False, so non-finite values fail the range check too
+        invalid |= ~((lat >= -90.0) & (lat <= 90.0))
+        invalid |= ~((lon >= -180.0) & (lon <= 180.0))
+        arrays.append(lat)
+        arrays.append(lon)
+
+    valid = int(invalid.argmax()) if invalid.any() else len(batch)
+    return [a[:valid].tolist() for a in arrays], valid
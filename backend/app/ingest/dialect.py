@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from app.ingest.upload import CsvInputError
+
+# Delimiters tried by detect_dialect, in order of preference on ties.
+DELIMITER_CANDIDATES = ",;\t|"
+
+# Lines of the sample looked at: enough for a stable count, cheap on wide rows.
+_MAX_SAMPLE_LINES = 50
+
+
+@dataclass(frozen=True)
+class CsvDialect:
+    """
+    The CSV format parameters this app varies, usable directly as
+    csv.reader(..., dialect=...). Hashable and picklable, so it can be
+    cached per upload and sent to worker processes.
+    """
+
+    delimiter: str = ","
+    quotechar: str = '"'
+    skipinitialspace: bool = False
+
+
+DEFAULT_DIALECT = CsvDialect()
+
+
+def explicit_dialect(delimiter: Optional[str], quotechar: Optional[str]) -> Optional[CsvDialect]:
+    """
+    The dialect given by a mapping's `delimiter` / `quotechar`, or None
+    when neither is set (the dialect is then detected).
+    """
+    if delimiter is None and quotechar is None:
+        return None
+
+    delimiter = "," if delimiter is None else delimiter
+    quotechar = '"' if quotechar is None else quotechar
+    for name, value in (("delimiter", delimiter), ("quotechar", quotechar)):
+        if len(value) != 1 or value in "\r\n":
+            raise CsvInputError(f"{name} must be a single character other than a line break")
+    if delimiter == quotechar:
+        raise CsvInputError("delimiter and quotechar must differ")
+
+    return CsvDialect(delimiter=delimiter, quotechar=quotechar)
+
+
+def detect_dialect(sample: str) -> CsvDialect:
+    """
+    Detects the delimiter of a CSV from a small sample.
+
+    Each candidate is counted on every sample line, outside quoted fields;
+    the delimiter is the candidate that occurs in the header and the same
+    number of times on the most lines. Falls back to a comma when no
+    candidate occurs in the header (a single-column file).
+    """
+    lines = sample.splitlines()
+    if len(lines) > 1 and not sample.endswith(("\n", "\r")):
+        # the sample most likely cuts the last line
+        lines.pop()
+    lines = [line for line in lines[:_MAX_SAMPLE_LINES] if line.strip()]
+    if not lines:
+        return DEFAULT_DIALECT
+
+    quotechar = _detect_quotechar(sample)
+    quoted = re.compile(f"{re.escape(quotechar)}[^{re.escape(quotechar)}]*{re.escape(quotechar)}")
+    lines = [quoted.sub("", line) for line in lines]
+    header, rows = lines[0], lines[1:]
+
+    best: Optional[str] = None
+    best_score = -1.0
+    for c in DELIMITER_CANDIDATES:
+        n = header.count(c)
+        if n == 0:
+            continue
+        score = sum(1 for row in rows if row.count(c) == n) / len(rows) if rows else 1.0
+        if score > best_score:
+            best, best_score = c, score
+
+    if best is None:
+        return CsvDialect(quotechar=quotechar)
+
+    text = "".join(lines)
+    skipinitialspace = text.count(best + " ") == text.count(best)
+    return CsvDialect(delimiter=best, quotechar=quotechar, skipinitialspace=skipinitialspace)
+
+
+def _detect_quotechar(sample: str) -> str:
+    # Single quotes only when they open fields and double quotes are absent
+    if '"' not in sample and re.search(r"(^|[,;\t|]\s*)'", sample, re.MULTILINE):
+        return "'"
+    return '"'
+
+
+class DialectCache:
+    """
+    Detected dialects by upload content hash (see app.cache.file_sha256),
+    so repeated exports of the same file skip detection. Bounded LRU.
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, CsvDialect] = OrderedDict()
+
+    def get_or_detect(self, content_hash: str, detect: Callable[[], CsvDialect]) -> CsvDialect:
+        with self._lock:
+            dialect = self._items.get(content_hash)
+            if dialect is not None:
+                self._items.move_to_end(content_hash)
+                return dialect
+
+        dialect = detect()
+        with self._lock:
+            self._items[content_hash] = dialect
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return dialect
+
+
+dialect_cache = DialectCache()
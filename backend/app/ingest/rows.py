@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import csv
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from operator import itemgetter
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Sequence, TypeVar, Union
+
+from app.ingest.dialect import DEFAULT_DIALECT, CsvDialect, detect_dialect
+from app.ingest.upload import CsvInputError, CsvTextStream
+
+T = TypeVar("T")
+
+
+_progress = threading.local()
+
+
+@contextmanager
+def count_rows(callback: Callable[[int], None]) -> Iterator[None]:
+    """
+    Within the block, batched() calls `callback(n)` in this thread for
+    every n rows it hands out (progress of a conversion, see app.jobs).
+    """
+    previous = getattr(_progress, "callback", None)
+    _progress.callback = callback
+    try:
+        yield
+    finally:
+        _progress.callback = previous
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Yields lists of up to `size` consecutive items."""
+    it = iter(items)
+    report = getattr(_progress, "callback", None)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        if report is not None:
+            report(len(batch))
+        yield batch
+
+
+class CsvTable:
+    """
+    A CSV upload opened for row extraction: decoded incrementally, dialect
+    detected on the first 4 KB (unless given), header row read and stripped.
+
+    Rows are pulled with `select()`, which resolves the wanted column names
+    to indices once and then reads only those cells from csv.reader lists,
+    instead of building a dict per row like csv.DictReader.
+    """
+
+    def __init__(self, fileobj: BinaryIO, dialect: Optional[CsvDialect] = None) -> None:
+        self.source = CsvTextStream(fileobj)
+        self.dialect = dialect or detect_dialect(self.source.sample)
+        self._reader = csv.reader(self.source.lines(), dialect=self.dialect)
+
+        try:
+            header = next(self._reader)
+        except StopIteration:
+            raise CsvInputError("CSV has no header row.") from None
+
+        self.headers = [h.strip() for h in header]
+        self._index = {}
+        for i, h in enumerate(self.headers):
+            self._index.setdefault(h, i)
+
+    def missing(self, columns: Sequence[str]) -> list[str]:
+        """Returns the columns (in order) that are not in the header."""
+        return [c for c in columns if c not in self._index]
+
+    def select(self, columns: Sequence[str]) -> Iterator[tuple[str, ...]]:
+        """
+        Yields, for every data row, the stripped values of `columns` as a tuple
+        (same order as `columns`). Blank lines are skipped like csv.DictReader
+        does, so enumerate(..., start=1) gives the same row numbers.
+
+        Cells missing from short rows read as "".
+        """
+        if not columns:
+            raise ValueError("select() needs at least one column")
+
+        missing = self.missing(columns)
+        if missing:
+            raise CsvInputError(f"Missing required columns: {', '.join(missing)}")
+
+        indices = [self._index[c] for c in columns]
+        width = max(indices) + 1
+        pick = itemgetter(*indices)
+        strip = str.strip
+
+        if len(indices) == 1:
+            for row in self._reader:
+                if not row:
+                    continue
+                if len(row) < width:
+                    row = row + [""] * (width - len(row))
+                yield (strip(pick(row)),)
+            return
+
+        for row in self._reader:
+            if not row:
+                continue
+            if len(row) < width:
+                row = row + [""] * (width - len(row))
+            yield tuple(map(strip, pick(row)))
+
+    def rows(self) -> Iterator[list[str]]:
+        """
+        Yields every data row with all cells stripped, padded or cut to the
+        header width. Blank lines are skipped, as in select().
+        """
+        width = len(self.headers)
+        for row in self._reader:
+            if not row:
+                continue
+            if len(row) != width:
+                row = (row + [""] * (width - len(row)))[:width]
+            yield list(map(str.strip, row))
+
+
+# Approximate per-cell overhead of a str object plus its list slot (CPython, 64-bit).
+_CELL_OVERHEAD = 57
+
+
+class ColumnTable:
+    """
+    A parsed CSV held in memory column by column (see app.datasets).
+
+    Offers the same `headers` / `missing()` / `select()` interface as
+    CsvTable, but can be read any number of times: select() just zips the
+    wanted column lists.
+    """
+
+    def __init__(self, headers: list[str], columns: list[list[str]], dialect: CsvDialect = DEFAULT_DIALECT) -> None:
+        self.headers = headers
+        self.columns = columns
+        self.dialect = dialect
+        self._index = {}
+        for i, h in enumerate(headers):
+            self._index.setdefault(h, i)
+
+    @classmethod
+    def from_csv(cls, table: CsvTable, batch_size: int = 8192) -> "ColumnTable":
+        columns: list[list[str]] = [[] for _ in table.headers]
+        for batch in batched(table.rows(), batch_size):
+            for col, values in zip(columns, zip(*batch)):
+                col.extend(values)
+        return cls(list(table.headers), columns, table.dialect)
+
+    @property
+    def delimiter(self) -> str:
+        return self.dialect.delimiter
+
+    @property
+    def row_count(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def estimate_bytes(self) -> int:
+        """Rough memory footprint of the cell strings."""
+        return sum(sum(map(len, col)) + _CELL_OVERHEAD * len(col) for col in self.columns)
+
+    def missing(self, columns: Sequence[str]) -> list[str]:
+        """Returns the columns (in order) that are not in the header."""
+        return [c for c in columns if c not in self._index]
+
+    def select(self, columns: Sequence[str]) -> Iterator[tuple[str, ...]]:
+        """Yields the values of `columns` for every row, like CsvTable.select()."""
+        if not columns:
+            raise ValueError("select() needs at least one column")
+
+        missing = self.missing(columns)
+        if missing:
+            raise CsvInputError(f"Missing required columns: {', '.join(missing)}")
+
+        return zip(*[self.columns[self._index[c]] for c in columns])
+
+    def rows(self) -> Iterator[tuple[str, ...]]:
+        return zip(*self.columns)
+
+
+# What a conversion reads from: an uploaded file or a stored dataset.
+TableSource = Union[BinaryIO, ColumnTable]
+
+
+def open_table(source: TableSource, dialect: Optional[CsvDialect] = None) -> Union[CsvTable, ColumnTable]:
+    """
+    Table for a conversion source: an uploaded file (parsed on the fly with
+    `dialect`, detected when None) or an already parsed dataset.
+    """
+    if isinstance(source, ColumnTable):
+        return source
+    return CsvTable(source, dialect)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import codecs
+from typing import BinaryIO, Iterator, Optional
+
+# Bytes pulled from the upload per read() call.
+READ_CHUNK_SIZE = 64 * 1024
+
+# Characters of decoded text kept aside for dialect detection.
+SAMPLE_SIZE = 4096
+
+
+class CsvInputError(ValueError):
+    """
+    Raised when an upload cannot be read as CSV.
+    The API layer turns it into a 400 response.
+    """
+
+
+class CsvTextStream:
+    """
+    Reads a binary file in chunks through an incremental UTF-8 decoder.
+
+    Only the current chunk is held in memory: `sample` exposes the first
+    SAMPLE_SIZE characters for dialect detection and `lines()` yields text
+    lines (with their line endings) that can be fed straight into csv.reader.
+
+    With truncated=True the input is treated as a prefix of a larger file:
+    an incomplete UTF-8 sequence and an unterminated last line are dropped
+    instead of being reported or parsed.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        chunk_size: int = READ_CHUNK_SIZE,
+        sample_size: int = SAMPLE_SIZE,
+        truncated: bool = False,
+    ) -> None:
+        self._fp = fileobj
+        self._chunk_size = chunk_size
+        self._truncated = truncated
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._pending: list[str] = []
+        self._eof = False
+        self.bytes_read = 0
+
+        # Decode just enough to get a detection sample.
+        buffered = 0
+        while buffered < sample_size:
+            text = self._read_text()
+            if text is None:
+                break
+            self._pending.append(text)
+            buffered += len(text)
+
+        if self.bytes_read == 0:
+            raise CsvInputError("Empty file.")
+
+        self.sample = "".join(self._pending)[:sample_size]
+
+    def _read_text(self) -> Optional[str]:
+        """Returns the next decoded piece of text, or None once the file is exhausted."""
+        if self._eof:
+            return None
+
+        raw = self._fp.read(self._chunk_size)
+        final = not raw
+        self.bytes_read += len(raw)
+
+        try:
+            text = self._decoder.decode(raw, final=final and not self._truncated)
+        except UnicodeDecodeError:
+            raise CsvInputError("File must be UTF-8 encoded (utf-8 or utf-8-sig)") from None
+
+        if final:
+            self._eof = True
+            return text or None
+        return text
+
+    def _iter_text(self) -> Iterator[str]:
+        while self._pending:
+            yield self._pending.pop(0)
+        while True:
+            text = self._read_text()
+            if text is None:
+                return
+            yield text
+
+    def lines(self) -> Iterator[str]:
+        """
+        Yields lines split on "\\n" (endings kept), like io.StringIO would.
+        """
+        carry = ""
+        for text in self._iter_text():
+            parts = (carry + text).split("\n")
+            carry = parts.pop()
+            for part in parts:
+                yield part + "\n"
+        if carry and not self._truncated:
+            yield carry
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from typing import Any
+
+# Invalid rows reported one by one; past this they are only counted.
+MAX_REPORTED_ROWS = 1000
+
+
+class RowErrors:
+    """
+    The invalid rows of a lenient conversion or a validation (POST
+    /kml/validate): every one is counted and skipped, the first `limit`
+    are kept with their error message.
+
+    - dry_run: the converter only checks the rows and builds no features
+    """
+
+    def __init__(self, limit: int = MAX_REPORTED_ROWS, dry_run: bool = False) -> None:
+        self.limit = limit
+        self.dry_run = dry_run
+        self.rows = 0  # rows read, set by the converter
+        self.invalid = 0
+        self.errors: list[dict[str, Any]] = []
+
+    def add(self, row: int, detail: Any) -> None:
+        self.invalid += 1
+        if len(self.errors) < self.limit:
+            self.errors.append({"row": row, "error": detail})
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "valid_rows": self.rows - self.invalid,
+            "invalid_rows": self.invalid,
+            "errors": self.errors,
+            "errors_truncated": self.invalid > len(self.errors),
+        }
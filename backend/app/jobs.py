@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Literal, Optional
+
+from fastapi import HTTPException
+
+from app.ingest.upload import CsvInputError
+from app.metrics import ROWS, STAGE_SECONDS
+from app.settings import get_settings
+
+# Metrics label of the conversions run by jobs (the route that queues them).
+JOBS_ENDPOINT = "/jobs"
+
+logger = logging.getLogger(__name__)
+
+JobState = Literal["queued", "running", "done", "failed"]
+
+# Writes the job's result to the given path, reporting rows read to the callback.
+JobWork = Callable[[str, Callable[[int], None]], None]
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    base_name: str  # download file name without extension
+    output: str
+    state: JobState = "queued"
+    created_at: float = 0.0  # wall clock, for display
+    started: Optional[float] = None  # monotonic
+    finished: Optional[float] = None  # monotonic
+    rows: int = 0
+    result_path: Optional[str] = None
+    result_bytes: int = 0
+    error: Optional[tuple[int, Any]] = None  # (status code, detail)
+
+    def add_rows(self, n: int) -> None:
+        self.rows += n
+
+    def status(self, now: float, ttl_seconds: float) -> dict[str, Any]:
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished if self.finished is not None else now) - self.started
+
+        status: dict[str, Any] = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "output": self.output,
+            "state": self.state,
+            "created_at": self.created_at,
+            "rows": self.rows,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        if self.state == "done":
+            status["result_bytes"] = self.result_bytes
+        if self.error:
+            status["status_code"], status["detail"] = self.error
+        if self.finished is not None:
+            status["expires_in"] = max(0, round(ttl_seconds - (now - self.finished)))
+        return status
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    """
+    Background conversions: a bounded queue in front of a thread pool,
+    with results stored as files in `directory`.
+
+    At most `max_queued` jobs wait for one of the `max_workers` threads;
+    submitting more raises JobQueueFull. Finished jobs (and their result
+    files) expire `ttl_seconds` after they finish.
+    """
+
+    def __init__(self, directory: str, max_workers: int, max_queued: int, ttl_seconds: float) -> None:
+        self.directory = directory
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="csv2kml-job")
+
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_files()
+
+    def _remove_stale_files(self) -> None:
+        # results and inputs left behind by an earlier server process
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isfile(path) and os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _queued(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.state == "queued")
+
+    def check_capacity(self) -> None:
+        """Raises JobQueueFull when a new job would not fit in the queue."""
+        with self._lock:
+            if self._queued() >= self.max_queued:
+                raise JobQueueFull(f"Job queue is full ({self.max_queued} jobs waiting)")
+
+    def new_file(self, suffix: str) -> str:
+        """Path of a new empty file in the jobs directory (e.g. a job's input)."""
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=suffix)
+        os.close(fd)
+        return path
+
+    def submit(
+        self,
+        kind: str,
+        base_name: str,
+        output: str,
+        work: JobWork,
+        cleanup: Optional[Callable[[], None]] = None,
+    ) -> Job:
+        """
+        Queues `work` and returns the new job. `cleanup` runs once the job
+        has finished (e.g. to remove its input file), or right away when the
+        queue is full.
+        """
+        job = Job(job_id=uuid.uuid4().hex, kind=kind, base_name=base_name, output=output, created_at=time.time())
+        with self._lock:
+            self._expire(time.monotonic())
+            if self._queued() >= self.max_queued:
+                if cleanup:
+                    cleanup()
+                raise JobQueueFull(f"Job queue is full ({self.max_queued} jobs waiting)")
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job, work, cleanup)
+        return job
+
+    def _run(self, job: Job, work: JobWork, cleanup: Optional[Callable[[], None]]) -> None:
+        job.started = time.monotonic()
+        job.state = "running"
+        path = os.path.join(self.directory, f"{job.job_id}.out")
+        try:
+            work(path, job.add_rows)
+            job.result_bytes = os.path.getsize(path)
+            job.result_path = path
+            job.state = "done"
+        except Exception as e:
+            if isinstance(e, HTTPException):
+                job.error = (e.status_code, e.detail)
+            elif isinstance(e, CsvInputError):
+                job.error = (400, str(e))
+            else:
+                logger.exception("Job %s failed", job.job_id)
+                job.error = (500, "Conversion failed")
+            job.state = "failed"
+            _remove(path)
+        finally:
+            job.finished = time.monotonic()
+            STAGE_SECONDS.observe((JOBS_ENDPOINT, "job"), job.finished - job.started)
+            ROWS.inc((JOBS_ENDPOINT,), job.rows)
+            if cleanup:
+                cleanup()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._jobs.get(job_id)
+
+    def _expire(self, now: float) -> None:
+        expired = [
+            job for job in self._jobs.values()
+            if job.finished is not None and now - job.finished > self.ttl_seconds
+        ]
+        for job in expired:
+            del self._jobs[job.job_id]
+            if job.result_path:
+                _remove(job.result_path)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            counts = {state: 0 for state in ("queued", "running", "done", "failed")}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            return counts
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            s = get_settings()
+            _manager = JobManager(
+                directory=s.jobs_dir or os.path.join(tempfile.gettempdir(), "csv2kml-jobs"),
+                max_workers=s.jobs_max_workers,
+                max_queued=s.jobs_max_queued,
+                ttl_seconds=s.jobs_ttl_seconds,
+            )
+        return _manager
+
+
+def job_counts() -> dict[str, int]:
+    """Jobs per state; empty while no job manager has been started."""
+    with _manager_lock:
+        manager = _manager
+    return manager.stats() if manager is not None else {}
+
+
+def shutdown_jobs() -> None:
+    """Stops the job threads (queued jobs are dropped). Called on application shutdown."""
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.shutdown()
+        _manager = None
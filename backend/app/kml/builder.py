@@ -1,15 +1,10 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from html import escape
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, Optional, Sequence
 
-@dataclass(frozen=True)
-class KmlPoint:
-    name: str
-    lat: float
-    lon: float
-    description_html: str = ""
+from app.kml.features import KmlPoint
+from app.kml.writer import MinifyOptions, folder, iter_point_placemarks, point_style_xml, write_document
 
 @dataclass(frozen=True)
 class KmlPointStyle:
@@ -18,60 +13,44 @@ class KmlPointStyle:
     icon_scale: float = 1.0
     icon_color: Optional[str] = None    # already converted to aabbggrr
 
-def build_kml_points(document_name: str, points: Iterable[KmlPoint], style: Optional[KmlPointStyle] = None) -> str:
+    def xml(self) -> str:
+        return point_style_xml(self.style_id, self.icon_url, self.icon_scale, self.icon_color)
+
+def iter_kml_points(
+    document_name: str,
+    points: Iterable[KmlPoint],
+    style: Optional[KmlPointStyle] = None,
+    extra: Iterable[str] = (),
+    points_region: str = "",
+    shared_styles: Sequence[KmlPointStyle] = (),
+    minify: Optional[MinifyOptions] = None,
+    document_data: Sequence[tuple[str, object]] = (),
+) -> Iterator[bytes]:
     """
-    Builds a minimal, valid KML document with Point Placemarks.
+    Writes a minimal, valid KML document with Point Placemarks, as UTF-8 chunks
+    (see app.kml.writer).
+
+    - extra: KML fragments written after the placemarks (e.g. tile NetworkLinks)
+    - points_region: a <Region> for the placemarks, which then go in a Points folder
+    - shared_styles: the styles points refer to by style_id (data-driven styling)
+    - minify: the minified output profile (rounded coordinates, no altitude
+      or empty descriptions)
+    - document_data: (name, value) pairs written as the document's ExtendedData
+    - points: a PointTable (read column-wise) or any KmlPoints
 
     Note: KML coordinates are in the order: lon, lat, alt
     """
+    placemarks = iter_point_placemarks(points, style.style_id if style else None, minify)
+    if points_region:
+        placemarks = folder("Points", placemarks, points_region)
+    styles = [s.xml() for s in (style, *shared_styles) if s]
+    return write_document(document_name, styles, placemarks, extra, document_data)
 
-    style_block = ""
-    if style:
-        icon_href = escape(style.icon_url) if style.icon_url else ""
-        color_tag = f"<color>{escape(style.icon_color)}</color>" if style.icon_color else ""
-        icon_tag = f"""
-        <Icon>
-          <href>{icon_href}</href>
-        </Icon>""".rstrip() if style.icon_url else ""
-
-        style_block = f"""
-        <Style id="{escape(style.style_id)}">
-        <IconStyle>
-            {color_tag}
-            <scale>{style.icon_scale}</scale>
-            {icon_tag}
-        </IconStyle>
-        </Style>""".rstrip()
-
-
-    placemarks = []
-    for p in points:
-        # Escape name, keep description as HTML-safe (we'll escape it too far safety)
-        # For example convert "<" → "&lt"
-        name = escape(p.name)
-        desc = escape(p.description_html)
-
-        style_url_line = f'\n      <styleUrl>#{escape(style.style_id)}</styleUrl>' if style else ""
 
-        placemarks.append(
-            f"""
-            <Placemark>
-            <name>{name}</name>{style_url_line}
-            <description><![CDATA[{desc}]]></description>
-            <Point>
-                <coordinates>{p.lon},{p.lat},0</coordinates>
-            </Point>
-            </Placemark>""".rstrip()
-                )
-
-    placemarks_str = "\n".join(placemarks)
-
-    return f"""<?xml version="1.0" encoding="UTF-8"?>
-            <kml xmlns="http://www.opengis.net/kml/2.2">
-            <Document>
-                <name>{escape(document_name)}</name>{style_block}
-            {placemarks_str}
-            </Document>
-            </kml>
-            """
+def build_kml_points(document_name: str, points: Iterable[KmlPoint], style: Optional[KmlPointStyle] = None) -> str:
+    """
+    Builds a minimal, valid KML document with Point Placemarks.
 
+    Note: KML coordinates are in the order: lon, lat, alt
+    """
+    return b"".join(iter_kml_points(document_name, points, style)).decode("utf-8")
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from html import escape
+from typing import Optional, Sequence
+
+from app.kml.writer import MinifyOptions, coordinates_text
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python path below
+    np = None
+
+# Web map tiles are 256 px; a zoom level z shows the world 256 * 2**z px wide.
+TILE_PIXELS = 256
+
+# Width of a cluster cell on screen at its zoom level.
+CLUSTER_CELL_PIXELS = 64
+
+
+@dataclass(frozen=True)
+class Cluster:
+    count: int
+    lat: float  # mean position of the points in the cell
+    lon: float
+
+
+@dataclass(frozen=True)
+class BoundingBox:
+    north: float
+    south: float
+    east: float
+    west: float
+
+    @classmethod
+    def of(cls, lats: Sequence[float], lons: Sequence[float]) -> "BoundingBox":
+        if not lats:
+            return cls(0.0, 0.0, 0.0, 0.0)
+        return cls(max(lats), min(lats), max(lons), min(lons))
+
+    def pixels(self, zoom: float) -> int:
+        """
+        Approximate on-screen size (square root of the area, as KML's Lod
+        measures it) of the box at a web map zoom level.
+        """
+        extent = math.sqrt(max(self.north - self.south, 1e-6) * max(self.east - self.west, 1e-6))
+        return max(1, round(extent / 360.0 * TILE_PIXELS * 2 ** zoom))
+
+
+def cell_size_deg(zoom: int) -> float:
+    return 360.0 / 2 ** zoom * CLUSTER_CELL_PIXELS / TILE_PIXELS
+
+
+def grid_clusters(lats: Sequence[float], lons: Sequence[float], cell_deg: float) -> list[Cluster]:
+    """
+    Bins points into a grid of `cell_deg` cells and returns one cluster per
+    non-empty cell (point count and mean position), in the order of each
+    cell's first point.
+
+    Uses NumPy when it is installed (one vectorized pass), plain Python
+    otherwise.
+    """
+    if np is not None and len(lats):
+        return _grid_numpy(lats, lons, cell_deg)
+    return _grid_python(lats, lons, cell_deg)
+
+
+def _grid_python(lats: Sequence[float], lons: Sequence[float], cell_deg: float) -> list[Cluster]:
+    cells: dict[tuple[int, int], list[float]] = {}
+    floor = math.floor
+    for lat, lon in zip(lats, lons):
+        key = (floor((lat + 90.0) / cell_deg), floor((lon + 180.0) / cell_deg))
+        acc = cells.get(key)
+        if acc is None:
+            cells[key] = [1, lat, lon]
+        else:
+            acc[0] += 1
+            acc[1] += lat
+            acc[2] += lon
+    return [Cluster(int(n), s_lat / n, s_lon / n) for n, s_lat, s_lon in cells.values()]
+
+
+def _grid_numpy(lats: Sequence[float], lons: Sequence[float], cell_deg: float) -> list[Cluster]:
+    lat = np.asarray(lats, dtype=np.float64)
+    lon = np.asarray(lons, dtype=np.float64)
+    row = np.floor((lat + 90.0) / cell_deg).astype(np.int64)
+    col = np.floor((lon + 180.0) / cell_deg).astype(np.int64)
+    keys = row * (int(360.0 / cell_deg) + 2) + col
+
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    sum_lat = np.bincount(inverse, weights=lat, minlength=len(counts))
+    sum_lon = np.bincount(inverse, weights=lon, minlength=len(counts))
+
+    order = np.argsort(first, kind="stable")
+    return [Cluster(int(counts[k]), float(sum_lat[k] / counts[k]), float(sum_lon[k] / counts[k])) for k in order]
+
+
+def region_xml(box: BoundingBox, min_pixels: int, max_pixels: int = -1) -> str:
+    return (
+        f"<Region><LatLonAltBox><north>{box.north}</north><south>{box.south}</south>"
+        f"<east>{box.east}</east><west>{box.west}</west></LatLonAltBox>"
+        f"<Lod><minLodPixels>{min_pixels}</minLodPixels><maxLodPixels>{max_pixels}</maxLodPixels></Lod></Region>"
+    )
+
+
+@dataclass(frozen=True)
+class ClusterLayers:
+    """
+    Cluster folders for an overview of a point layer, one per zoom level,
+    each shown (through a Region/Lod on the data's bounding box) from its
+    zoom level up to the next one.
+
+    - points_region: Region for the full-detail points, shown past the last
+      level ("" when the points are not included)
+    """
+
+    folders: list[str]
+    points_region: str
+
+
+def cluster_layers(
+    lats: Sequence[float],
+    lons: Sequence[float],
+    zoom_levels: Sequence[int],
+    include_points: bool = True,
+    style_id: Optional[str] = None,
+    minify: Optional[MinifyOptions] = None,
+) -> ClusterLayers:
+    levels = sorted(set(zoom_levels))
+    box = BoundingBox.of(lats, lons)
+    style_url = f"<styleUrl>#{escape(style_id)}</styleUrl>" if style_id else ""
+
+    folders = []
+    for i, zoom in enumerate(levels):
+        min_px = 0 if i == 0 else box.pixels(zoom)
+        if i + 1 < len(levels):
+            max_px = box.pixels(levels[i + 1])
+        else:
+            max_px = box.pixels(zoom + 1) if include_points else -1
+
+        placemarks = []
+        for c in grid_clusters(lats, lons, cell_size_deg(zoom)):
+            placemarks.append(
+                f"<Placemark><name>{c.count}</name>{style_url}"
+                f'<ExtendedData><Data name="count"><value>{c.count}</value></Data></ExtendedData>'
+                f"<Point><coordinates>{coordinates_text(c.lon, c.lat, minify)}</coordinates></Point></Placemark>\n"
+            )
+
+        folders.append(
+            f"<Folder><name>Clusters (zoom {zoom})</name>{region_xml(box, min_px, max_px)}\n"
+            f"{''.join(placemarks)}</Folder>\n"
+        )
+
+    points_region = ""
+    if include_points and levels:
+        points_region = region_xml(box, box.pixels(levels[-1] + 1))
+    return ClusterLayers(folders=folders, points_region=points_region)
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
+# A string column interns its values (repeated values share one str) until
+# it has seen this many distinct ones: then it is a name/id-like column and
+# the intern table would only cost memory.
+INTERN_MAX_DISTINCT = 4096
+
+
+@dataclass(frozen=True, slots=True)
+class KmlPoint:
+    name: str
+    lat: float
+    lon: float
+    description_html: str = ""
+    style_id: str = ""  # a shared style of the document ("" = the default style)
+
+
+@dataclass(frozen=True, slots=True)
+class KmlLink:
+    name: str
+    a_lat: float
+    a_lon: float
+    b_lat: float
+    b_lon: float
+    description_html: str = ""
+    count: int = 1  # parallel rows merged into this link
+    style_id: str = ""  # a shared style of the document ("" = the default style)
+
+
+class _Interner:
+    def __init__(self) -> None:
+        self._seen: Optional[dict[str, str]] = {}
+
+    def __call__(self, value: str) -> str:
+        seen = self._seen
+        if seen is None:
+            return value
+        interned = seen.get(value)
+        if interned is not None:
+            return interned
+        if len(seen) >= INTERN_MAX_DISTINCT:
+            self._seen = None
+        else:
+            seen[value] = value
+        return value
+
+    def __getstate__(self) -> tuple[bool]:
+        # tables are pickled for worker processes: the intern table is not
+        # needed there (pickle shares equal values anyway)
+        return (self._seen is not None,)
+
+    def __setstate__(self, state: tuple[bool]) -> None:
+        self._seen = {} if state[0] else None
+
+
+class PointTable:
+    """
+    Points stored column-wise: coordinates in array('d') columns, names,
+    descriptions and style ids in (interned) lists. Costs a fraction of a
+    KmlPoint object per point; indexing or iterating yields KmlPoint views,
+    the builders read the columns (rows()).
+    """
+
+    def __init__(self) -> None:
+        self.names: list[str] = []
+        self.lats = array("d")
+        self.lons = array("d")
+        self.descriptions: list[str] = []
+        self.style_ids: list[str] = []
+        self._intern_name = _Interner()
+        self._intern_description = _Interner()
+
+    @classmethod
+    def of(cls, points: Iterable[KmlPoint]) -> "PointTable":
+        table = cls()
+        for p in points:
+            table.append(p.name, p.lat, p.lon, p.description_html, p.style_id)
+        return table
+
+    def append(self, name: str, lat: float, lon: float, description_html: str = "", style_id: str = "") -> None:
+        self.names.append(self._intern_name(name))
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.descriptions.append(self._intern_description(description_html))
+        self.style_ids.append(style_id)
+
+    def extend(self, other: "PointTable") -> None:
+        self.names += other.names
+        self.lats += other.lats
+        self.lons += other.lons
+        self.descriptions += other.descriptions
+        self.style_ids += other.style_ids
+
+    def take(self, indices: Sequence[int]) -> "PointTable":
+        """A table of the rows at `indices`, in that order."""
+        table = PointTable()
+        table.names = [self.names[i] for i in indices]
+        table.lats = array("d", [self.lats[i] for i in indices])
+        table.lons = array("d", [self.lons[i] for i in indices])
+        table.descriptions = [self.descriptions[i] for i in indices]
+        table.style_ids = [self.style_ids[i] for i in indices]
+        return table
+
+    def positions(self) -> tuple[array, array]:
+        """The (lat, lon) columns points are tiled by (app.kml.tiles), not copied."""
+        return self.lats, self.lons
+
+    def rows(self) -> Iterator[tuple[str, float, float, str, str]]:
+        """(name, lat, lon, description_html, style_id) per point."""
+        return zip(self.names, self.lats, self.lons, self.descriptions, self.style_ids)
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def __getitem__(self, i: int) -> KmlPoint:
+        return KmlPoint(self.names[i], self.lats[i], self.lons[i], self.descriptions[i], self.style_ids[i])
+
+    def __iter__(self) -> Iterator[KmlPoint]:
+        return (KmlPoint(*row) for row in self.rows())
+
+
+class LinkTable:
+    """
+    Links stored column-wise, like PointTable: four array('d') coordinate
+    columns, an array of merged-row counts and interned string columns
+    (names, descriptions, style ids).
+    """
+
+    def __init__(self) -> None:
+        self.names: list[str] = []
+        self.a_lats = array("d")
+        self.a_lons = array("d")
+        self.b_lats = array("d")
+        self.b_lons = array("d")
+        self.descriptions: list[str] = []
+        self.counts = array("I")
+        self.style_ids: list[str] = []
+        self._intern_name = _Interner()
+        self._intern_description = _Interner()
+
+    @classmethod
+    def of(cls, links: Iterable[KmlLink]) -> "LinkTable":
+        table = cls()
+        for l in links:
+            table.append(l.name, l.a_lat, l.a_lon, l.b_lat, l.b_lon, l.description_html, l.count, l.style_id)
+        return table
+
+    def append(
+        self,
+        name: str,
+        a_lat: float,
+        a_lon: float,
+        b_lat: float,
+        b_lon: float,
+        description_html: str = "",
+        count: int = 1,
+        style_id: str = "",
+    ) -> None:
+        self.names.append(self._intern_name(name))
+        self.a_lats.append(a_lat)
+        self.a_lons.append(a_lon)
+        self.b_lats.append(b_lat)
+        self.b_lons.append(b_lon)
+        self.descriptions.append(self._intern_description(description_html))
+        self.counts.append(count)
+        self.style_ids.append(style_id)
+
+    def extend(self, other: "LinkTable") -> None:
+        self.names += other.names
+        self.a_lats += other.a_lats
+        self.a_lons += other.a_lons
+        self.b_lats += other.b_lats
+        self.b_lons += other.b_lons
+        self.descriptions += other.descriptions
+        self.counts += other.counts
+        self.style_ids += other.style_ids
+
+    def take(self, indices: Sequence[int]) -> "LinkTable":
+        """A table of the rows at `indices`, in that order."""
+        table = LinkTable()
+        table.names = [self.names[i] for i in indices]
+        table.a_lats = array("d", [self.a_lats[i] for i in indices])
+        table.a_lons = array("d", [self.a_lons[i] for i in indices])
+        table.b_lats = array("d", [self.b_lats[i] for i in indices])
+        table.b_lons = array("d", [self.b_lons[i] for i in indices])
+        table.descriptions = [self.descriptions[i] for i in indices]
+        table.counts = array("I", [self.counts[i] for i in indices])
+        table.style_ids = [self.style_ids[i] for i in indices]
+        return table
+
+    def positions(self) -> tuple[array, array]:
+        """Midpoint (lat, lon) columns: links are tiled by their midpoint."""
+        lats = array("d", [(a + b) / 2 for a, b in zip(self.a_lats, self.b_lats)])
+        lons = array("d", [(a + b) / 2 for a, b in zip(self.a_lons, self.b_lons)])
+        return lats, lons
+
+    def rows(self) -> Iterator[tuple[str, float, float, float, float, str, int, str]]:
+        """(name, a_lat, a_lon, b_lat, b_lon, description_html, count, style_id) per link."""
+        return zip(
+            self.names,
+            self.a_lats,
+            self.a_lons,
+            self.b_lats,
+            self.b_lons,
+            self.descriptions,
+            self.counts,
+            self.style_ids,
+        )
+
+    def __len__(self) -> int:
+        return len(self.a_lats)
+
+    def __getitem__(self, i: int) -> KmlLink:
+        return KmlLink(
+            self.names[i],
+            self.a_lats[i],
+            self.a_lons[i],
+            self.b_lats[i],
+            self.b_lons[i],
+            self.descriptions[i],
+            self.counts[i],
+            self.style_ids[i],
+        )
+
+    def __iter__(self) -> Iterator[KmlLink]:
+        return (KmlLink(*row) for row in self.rows())
+
+
+class GraphTable:
+    """
+    The features of a graph document: its points, then its links, as one
+    sequence (of KmlPoint and KmlLink views) for tiling.
+    """
+
+    def __init__(self, points: PointTable, links: LinkTable) -> None:
+        self.points = points
+        self.links = links
+
+    def take(self, indices: Sequence[int]) -> "GraphTable":
+        n = len(self.points)
+        return GraphTable(
+            self.points.take([i for i in indices if i < n]),
+            self.links.take([i - n for i in indices if i >= n]),
+        )
+
+    def positions(self) -> tuple[array, array]:
+        """Positions of the points, then of the links."""
+        point_lats, point_lons = self.points.positions()
+        link_lats, link_lons = self.links.positions()
+        return point_lats + link_lats, point_lons + link_lons
+
+    def __len__(self) -> int:
+        return len(self.points) + len(self.links)
+
+    def __getitem__(self, i: int) -> Union[KmlPoint, KmlLink]:
+        n = len(self.points)
+        if i < 0:
+            i += len(self)
+        return self.points[i] if i < n else self.links[i - n]
+
+    def __iter__(self) -> Iterator[Union[KmlPoint, KmlLink]]:
+        yield from self.points
+        yield from self.links
+
+
+def point_rows(points: Iterable[KmlPoint]) -> Iterator[tuple[str, float, float, str, str]]:
+    """PointTable.rows() of a PointTable, or any KmlPoints."""
+    if isinstance(points, PointTable):
+        return points.rows()
+    return ((p.name, p.lat, p.lon, p.description_html, p.style_id) for p in points)
+
+
+def link_rows(links: Iterable[KmlLink]) -> Iterator[tuple[str, float, float, float, float, str, int, str]]:
+    """LinkTable.rows() of a LinkTable, or any KmlLinks."""
+    if isinstance(links, LinkTable):
+        return links.rows()
+    return ((l.name, l.a_lat, l.a_lon, l.b_lat, l.b_lon, l.description_html, l.count, l.style_id) for l in links)
@@ -1,71 +1,47 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from html import escape
-from typing import Iterable, Optional
+from itertools import chain
+from typing import Iterable, Iterator, Optional, Sequence
 
+from app.kml.builder import KmlPointStyle
+from app.kml.features import KmlLink, KmlPoint
+from app.kml.links_builder import KmlLineStyle
+from app.kml.writer import MinifyOptions, folder, iter_link_placemarks, iter_point_placemarks, write_document
 
-@dataclass(frozen=True)
-class KmlPoint:
-    name: str
-    lat: float
-    lon: float
-    description_html: str = ""
 
-
-@dataclass(frozen=True)
-class KmlLink:
-    name: str
-    a_lat: float
-    a_lon: float
-    b_lat: float
-    b_lon: float
-    description_html: str = ""
-
-
-@dataclass(frozen=True)
-class KmlPointStyle:
-    style_id: str = "pointStyle"
-    icon_url: Optional[str] = None
-    icon_scale: float = 1.0
-    icon_color: Optional[str] = None #aabbggrr
-
-
-@dataclass(frozen=True)
-class KmlLineStyle:
-    style_id: str = "lineStyle"
-    color: Optional[str] = None #aabbggrr
-    width: float = 2.0
-
-
-def _build_point_style(style: KmlPointStyle) -> str:
-    color_tag = f"<color>{escape(style.icon_color)}</color>" if style.icon_color else ""
-    icon_tag = ""
-    if style.icon_url:
-        icon_tag = f"""
-        <Icon>
-          <href>{escape(style.icon_url)}</href>
-        </Icon>""".rstrip()
-
-    return f"""
-    <Style id="{escape(style.style_id)}">
-      <IconStyle>
-        {color_tag}
-        <scale>{style.icon_scale}</scale>
-        {icon_tag}
-      </IconStyle>
-    </Style>""".rstrip()
-
-
-def _build_line_style(style: KmlLineStyle) -> str:
-    color_tag = f"<color>{escape(style.color)}</color>" if style.color else ""
-    return f"""
-    <Style id="{escape(style.style_id)}">
-      <LineStyle>
-        {color_tag}
-        <width>{style.width}</width>
-      </LineStyle>
-    </Style>""".rstrip()
+def iter_kml_graph(
+    document_name: str,
+    points: Iterable[KmlPoint],
+    links: Iterable[KmlLink],
+    point_style: Optional[KmlPointStyle] = None,
+    line_style: Optional[KmlLineStyle] = None,
+    extra: Iterable[str] = (),
+    points_region: str = "",
+    shared_styles: Sequence[KmlPointStyle | KmlLineStyle] = (),
+    minify: Optional[MinifyOptions] = None,
+    document_data: Sequence[tuple[str, object]] = (),
+) -> Iterator[bytes]:
+    """
+    Writes a KML document with a Points and a Links folder, as UTF-8 chunks
+    (see app.kml.writer).
+
+    - extra: KML fragments written after the folders (e.g. tile NetworkLinks)
+    - points_region: a <Region> for the Points folder
+    - points, links: a PointTable / LinkTable (read column-wise) or any
+      KmlPoints / KmlLinks
+    - shared_styles: the styles points and links refer to by style_id
+      (data-driven styling)
+    - minify: the minified output profile (see iter_kml_points)
+    - document_data: (name, value) pairs written as the document's ExtendedData
+    """
+    styles = [s.xml() for s in (point_style, line_style, *shared_styles) if s]
+    point_style_id = point_style.style_id if point_style else None
+    line_style_id = line_style.style_id if line_style else None
+    body = chain(
+        folder("Points", iter_point_placemarks(points, point_style_id, minify), points_region),
+        folder("Links", iter_link_placemarks(links, line_style_id, minify)),
+    )
+    return write_document(document_name, styles, body, extra, document_data)
 
 
 def build_kml_graph(
@@ -75,63 +51,4 @@ def build_kml_graph(
     point_style: Optional[KmlPointStyle] = None,
     line_style: Optional[KmlLineStyle] = None,
 ) -> str:
-    styles = []
-    if point_style:
-        styles.append(_build_point_style(point_style))
-    if line_style:
-        styles.append(_build_line_style(line_style))
-    styles_block = "\n".join(styles)
-
-    point_placemarks = []
-    for p in points:
-        name = escape(p.name)
-        desc = escape(p.description_html)
-        style_url = f"\n      <styleUrl>#{escape(point_style.style_id)}</styleUrl>" if point_style else ""
-        point_placemarks.append(
-            f"""
-      <Placemark>
-        <name>{name}</name>{style_url}
-        <description><![CDATA[{desc}]]></description>
-        <Point>
-          <coordinates>{p.lon},{p.lat},0</coordinates>
-        </Point>
-      </Placemark>""".rstrip()
-        )
-
-    link_placemarks = []
-    for l in links:
-        name = escape(l.name)
-        desc = escape(l.description_html)
-        style_url = f"\n      <styleUrl>#{escape(line_style.style_id)}</styleUrl>" if line_style else ""
-        coords = f"{l.a_lon},{l.a_lat},0 {l.b_lon},{l.b_lat},0"
-        link_placemarks.append(
-            f"""
-      <Placemark>
-        <name>{name}</name>{style_url}
-        <description><![CDATA[{desc}]]></description>
-        <LineString>
-          <tessellate>1</tessellate>
-          <coordinates>{coords}</coordinates>
-        </LineString>
-      </Placemark>""".rstrip()
-        )
-
-    points_block = "\n".join(point_placemarks)
-    links_block = "\n".join(link_placemarks)
-
-    return f"""<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-  <Document>
-    <name>{escape(document_name)}</name>
-{styles_block}
-    <Folder>
-      <name>Points</name>
-{points_block}
-    </Folder>
-    <Folder>
-      <name>Links</name>
-{links_block}
-    </Folder>
-  </Document>
-</kml>
-"""
\ No newline at end of file
+    return b"".join(iter_kml_graph(document_name, points, links, point_style, line_style)).decode("utf-8")
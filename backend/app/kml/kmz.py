@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import zipfile
+from typing import Iterable, Iterator
+
+# KMZ readers (Google Earth included) open the first .kml entry, by convention doc.kml.
+KMZ_DOC_NAME = "doc.kml"
+
+
+class ZipSink:
+    """
+    Write-only, non-seekable file object collecting what ZipFile writes.
+    ZipFile falls back to data descriptors when it cannot seek, so entries
+    can be written without knowing their size up front. Such entries must
+    be opened with force_zip64: the headers cannot be rewritten once an
+    entry passes 2 GiB, and ZipFile would raise mid-stream.
+    """
+
+    def __init__(self) -> None:
+        self._parts: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_kmz(
+    chunks: Iterable[bytes],
+    arcname: str = KMZ_DOC_NAME,
+    compresslevel: int = 6,
+) -> Iterator[bytes]:
+    """
+    Compresses a stream of KML chunks into a KMZ (zip) stream.
+
+    The zip is produced while the chunks are generated: compressed bytes are
+    yielded as soon as the deflater emits them, the uncompressed document is
+    never held in memory.
+    """
+    return iter_kmz_entries([(arcname, chunks)], compresslevel)
+
+
+def iter_kmz_entries(
+    entries: Iterable[tuple[str, Iterable[bytes]]],
+    compresslevel: int = 6,
+) -> Iterator[bytes]:
+    """
+    Like iter_kmz, for a KMZ of several files: `entries` yields
+    (arcname, chunks) pairs, written in order. The first one should be
+    the root document (doc.kml).
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        for arcname, chunks in entries:
+            with zf.open(arcname, "w", force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+    # central directory
+    data = sink.drain()
+    if data:
+        yield data
@@ -1,20 +1,10 @@
 from __future__ import annotations
 
-import textwrap
-
 from dataclasses import dataclass
-from html import escape
-from typing import Iterable, Optional
-
+from typing import Iterable, Iterator, Optional, Sequence
 
-@dataclass(frozen=True)
-class KmlLink:
-    name: str
-    a_lat: float
-    a_lon: float
-    b_lat: float
-    b_lon: float
-    description_html: str = ""
+from app.kml.features import KmlLink
+from app.kml.writer import MinifyOptions, iter_link_placemarks, line_style_xml, write_document
 
 
 @dataclass(frozen=True)
@@ -23,49 +13,33 @@ class KmlLineStyle:
     color: Optional[str] = None # KML aabbggrr
     width: float = 2.0
 
+    def xml(self) -> str:
+        return line_style_xml(self.style_id, self.color, self.width)
 
-def build_kml_links(document_name: str, links: Iterable[KmlLink], style: Optional[KmlLineStyle] = None) -> str:
-    style_block = ""
-    if style:
-        color_tag = f"<color>{escape(style.color)}</color>" if style.color else ""
-        style_block = f"""
-        <Style id="{escape(style.style_id)}">
-            <LineStyle>
-                {color_tag}
-                <width>{style.width}</width>
-            </LineStyle>
-        </Style>
-        """.rstrip()
-    
-    placemarks = []
-    for l in links:
-        name = escape(l.name)
-        desc = escape(l.description_html)
-        style_url_line = f'\n      <styleUrl>#{escape(style.style_id)}</styleUrl>' if style else ""
-
-        # LineString coordinates: lon,lat,alt for each vertex
-        coords = f"{l.a_lon},{l.a_lat},0 {l.b_lon},{l.b_lat},0"
 
-        placemarks.append(
-            textwrap.dedent(f"""\
-                <Placemark>
-                    <name>{escape(name)}</name>{style_url_line}
-                    <description><![CDATA[{desc}]]></description>
-                    <LineString>
-                        <tessellate>1</tessellate>
-                        <coordinates>{coords}</coordinates>
-                    </LineString>
-                </Placemark>
-            """).rstrip()
-        )
+def iter_kml_links(
+    document_name: str,
+    links: Iterable[KmlLink],
+    style: Optional[KmlLineStyle] = None,
+    extra: Iterable[str] = (),
+    shared_styles: Sequence[KmlLineStyle] = (),
+    minify: Optional[MinifyOptions] = None,
+    document_data: Sequence[tuple[str, object]] = (),
+) -> Iterator[bytes]:
+    """
+    Writes a KML document with one LineString Placemark per link, as UTF-8
+    chunks (see app.kml.writer).
+
+    - extra: KML fragments written after the placemarks (e.g. tile NetworkLinks)
+    - links: a LinkTable (read column-wise) or any KmlLinks
+    - shared_styles: the styles links refer to by style_id (data-driven styling)
+    - minify: the minified output profile (see iter_kml_points)
+    - document_data: (name, value) pairs written as the document's ExtendedData
+    """
+    placemarks = iter_link_placemarks(links, style.style_id if style else None, minify)
+    styles = [s.xml() for s in (style, *shared_styles) if s]
+    return write_document(document_name, styles, placemarks, extra, document_data)
 
-    placemarks_str = "\n".join(placemarks)
 
-    return f"""<?xml version="1.0" encoding="UTF-8"?>
-    <kml xmlns="http://www.opengis.net/kml/2.2">
-        <Document>
-            <name>{escape(document_name)}</name>{style_block}
-            {placemarks_str}
-        </Document>
-    </kml>
-    """
+def build_kml_links(document_name: str, links: Iterable[KmlLink], style: Optional[KmlLineStyle] = None) -> str:
+    return b"".join(iter_kml_links(document_name, links, style)).decode("utf-8")
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from typing import Iterable, Iterator, Union
+
+# Size of the byte chunks handed to the ASGI server. Small enough to keep
+# memory flat, large enough to avoid one send() per placemark.
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(parts: Iterable[Union[str, bytes]], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Groups small text fragments into UTF-8 encoded chunks of ~chunk_size bytes.
+    Parts already encoded (chunks of app.kml.writer) are passed through.
+    """
+    buf: list[str] = []
+    size = 0
+    for part in parts:
+        if isinstance(part, bytes):
+            if buf:
+                yield "".join(buf).encode("utf-8")
+                buf.clear()
+                size = 0
+            yield part
+            continue
+        buf.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(buf).encode("utf-8")
+            buf.clear()
+            size = 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def encode_output(parts: Iterable[Union[str, bytes]], output: str = "kml") -> Iterator[bytes]:
+    """
+    Encodes KML fragments as the byte stream of the requested output format:
+    "kml", "kmz", or "tiled" (a Region/Lod tiled KMZ, see app.kml.tiles;
+    `parts` must then be a TileableDocument, anything else is written as a
+    plain KMZ).
+    """
+    # local imports: kmz and tiles build on the chunk stream above
+    from app.kml.kmz import iter_kmz
+    from app.kml.tiles import TileableDocument, iter_tiled_kmz
+
+    if output == "tiled" and isinstance(parts, TileableDocument):
+        return iter_tiled_kmz(parts)
+
+    chunks = iter_chunks(parts)
+    if output in ("kmz", "tiled"):
+        return iter_kmz(chunks)
+    return chunks
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass, field
+from html import escape
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence
+
+from app.kml.kmz import KMZ_DOC_NAME, iter_kmz_entries
+from app.kml.stream import iter_chunks
+from app.kml.writer import XML_HEADER
+
+# Features written to one tile before the rest go down to its four children.
+TILE_MAX_FEATURES = 2000
+
+# Deeper than this a tile keeps everything left (e.g. many identical points).
+TILE_MAX_DEPTH = 16
+
+# A child tile loads once its region covers this many pixels on screen.
+TILE_MIN_LOD_PIXELS = 128
+
+# Where the tile documents go inside the KMZ.
+TILE_DIR = "tiles"
+
+
+@dataclass
+class TileableDocument:
+    """
+    A converted document: its features plus how to write any subset of them
+    as a KML document.
+
+    Iterating it yields the whole document, like the plain builder
+    generators; iter_tiled_kmz() writes it as a tiled KMZ instead.
+
+    - position: the (lat, lon) a feature is tiled by
+    - render: (document name, features, extra fragments) -> KML chunks
+    - overview: fragments for the whole data set (e.g. cluster folders),
+      written once: in the document, or in the root of a tiled KMZ
+    """
+
+    document_name: str
+    features: Sequence[Any]
+    position: Callable[[Any], tuple[float, float]]
+    render: Callable[[str, Sequence[Any], Iterable[str]], Iterator[bytes]]
+    overview: Sequence[str] = ()
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.render(self.document_name, self.features, self.overview)
+
+
+def _take(features: Sequence[Any], indices: Sequence[int]) -> Sequence[Any]:
+    # feature tables (app.kml.features) stay tables, for the builders
+    take = getattr(features, "take", None)
+    return take(indices) if take is not None else [features[i] for i in indices]
+
+
+def _positions(features: Sequence[Any], position: Callable[[Any], tuple[float, float]]) -> tuple[array, array]:
+    # feature tables give their coordinate columns: no view per feature
+    positions = getattr(features, "positions", None)
+    if positions is not None:
+        return positions()
+    lats, lons = array("d"), array("d")
+    for f in features:
+        lat, lon = position(f)
+        lats.append(lat)
+        lons.append(lon)
+    return lats, lons
+
+
+def point_position(point: Any) -> tuple[float, float]:
+    return point.lat, point.lon
+
+
+def link_position(link: Any) -> tuple[float, float]:
+    """Links are tiled by their midpoint."""
+    return (link.a_lat + link.b_lat) / 2, (link.a_lon + link.b_lon) / 2
+
+
+@dataclass
+class Tile:
+    level: int
+    x: int
+    y: int
+    north: float
+    south: float
+    east: float
+    west: float
+    features: Sequence[Any] = field(default_factory=list)
+    children: list["Tile"] = field(default_factory=list)
+
+    @property
+    def filename(self) -> str:
+        return f"{self.level}_{self.x}_{self.y}.kml"
+
+
+def build_quadtree(
+    features: Sequence[Any],
+    position: Callable[[Any], tuple[float, float]],
+    max_features: int = TILE_MAX_FEATURES,
+    max_depth: int = TILE_MAX_DEPTH,
+) -> Tile:
+    """
+    Partitions features into a quadtree over their bounding box.
+
+    Every tile keeps `max_features` of its features, spread evenly over the
+    input order (so coarse tiles show a sample of the whole data), and hands
+    the rest to its four quadrants.
+    """
+    lats, lons = _positions(features, position)
+    if lats:
+        south, north, west, east = min(lats), max(lats), min(lons), max(lons)
+    else:
+        south = north = west = east = 0.0
+    # degenerate boxes (a single point, a line) still need an area to split
+    pad = 1e-6
+    root = Tile(0, 0, 0, north + pad, south - pad, east + pad, west - pad)
+
+    # feature indices per tile, as array('I') (4 bytes per feature)
+    stack = [(root, array("I", range(len(lats))))]
+    while stack:
+        tile, indices = stack.pop()
+        if len(indices) <= max_features or tile.level >= max_depth:
+            tile.features = _take(features, indices)
+            continue
+
+        step = len(indices) / max_features
+        keep = {int(k * step) for k in range(max_features)}
+        tile.features = _take(features, [indices[j] for j in sorted(keep)])
+
+        mid_lat = (tile.north + tile.south) / 2
+        mid_lon = (tile.east + tile.west) / 2
+        quadrants: dict[tuple[int, int], array] = {}
+        for j, i in enumerate(indices):
+            if j in keep:
+                continue
+            quadrant = (int(lons[i] >= mid_lon), int(lats[i] < mid_lat))
+            sub = quadrants.get(quadrant)
+            if sub is None:
+                sub = quadrants[quadrant] = array("I")
+            sub.append(i)
+
+        for (dx, dy), sub in sorted(quadrants.items(), key=lambda q: (q[0][1], q[0][0])):
+            child = Tile(
+                level=tile.level + 1,
+                x=2 * tile.x + dx,
+                y=2 * tile.y + dy,
+                north=mid_lat if dy else tile.north,
+                south=tile.south if dy else mid_lat,
+                east=tile.east if dx else mid_lon,
+                west=mid_lon if dx else tile.west,
+            )
+            tile.children.append(child)
+            stack.append((child, sub))
+
+    return root
+
+
+def _network_link(tile: Tile, href: str, min_lod_pixels: int) -> str:
+    return (
+        f"<NetworkLink><name>{tile.level}/{tile.x}/{tile.y}</name>"
+        f"<Region><LatLonAltBox><north>{tile.north}</north><south>{tile.south}</south>"
+        f"<east>{tile.east}</east><west>{tile.west}</west></LatLonAltBox>"
+        f"<Lod><minLodPixels>{min_lod_pixels}</minLodPixels><maxLodPixels>-1</maxLodPixels></Lod></Region>"
+        f"<Link><href>{escape(href)}</href><viewRefreshMode>onRegion</viewRefreshMode></Link></NetworkLink>\n"
+    )
+
+
+def _iter_tiles(root: Tile) -> Iterator[Tile]:
+    stack = [root]
+    while stack:
+        tile = stack.pop()
+        yield tile
+        stack.extend(reversed(tile.children))
+
+
+def iter_tiled_kmz(
+    doc: TileableDocument,
+    max_features: Optional[int] = None,
+    compresslevel: int = 6,
+) -> Iterator[bytes]:
+    """
+    Writes a document as a Region/Lod "super-overlay" KMZ stream:
+
+    - doc.kml: a root document with a NetworkLink to the top tile
+    - tiles/<level>_<x>_<y>.kml: one document per quadtree tile holding
+      its features and NetworkLinks (with Regions) to its child tiles
+
+    Clients load a child tile only once its region is large enough on
+    screen, so only the visible part of a large dataset is drawn.
+    """
+    root = build_quadtree(doc.features, doc.position, max_features or TILE_MAX_FEATURES)
+
+    root_doc = (
+        f"{XML_HEADER}<Document><name>{escape(doc.document_name)}</name>\n"
+        f"{_network_link(root, f'{TILE_DIR}/{root.filename}', 0)}{''.join(doc.overview)}</Document>\n</kml>\n"
+    )
+
+    def entries() -> Iterator[tuple[str, Iterable[bytes]]]:
+        yield KMZ_DOC_NAME, [root_doc.encode("utf-8")]
+        for tile in _iter_tiles(root):
+            links = [_network_link(c, c.filename, TILE_MIN_LOD_PIXELS) for c in tile.children]
+            name = f"{doc.document_name} ({tile.level}/{tile.x}/{tile.y})"
+            yield f"{TILE_DIR}/{tile.filename}", iter_chunks(doc.render(name, tile.features, links))
+
+    return iter_kmz_entries(entries(), compresslevel)
@@ -0,0 +1,209 @@
+"""
+The KML writer shared by the points, links and graph builders.
+
+Everything constant in a document (header, styles, the markup around a
+placemark's values) is formatted once per document; each placemark is then
+one f-string of its values, appended to a block of placemarks that is
+encoded to UTF-8 as a whole (app.kml.stream). Strings with nothing to
+escape skip html.escape.
+
+A placemark with a style id of its own (data-driven styling, see
+app.api.styling) points to that shared <Style>; the others to the
+document's default style. Style references are formatted once per distinct
+id.
+
+The output is compact: no indentation, one placemark per line. Minified
+output (MinifyOptions) also rounds coordinates, drops their altitude and
+leaves out empty descriptions.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from html import escape
+from itertools import chain
+from typing import Iterable, Iterator, Optional, Sequence
+
+from app.kml.features import KmlLink, KmlPoint, link_rows, point_rows
+from app.kml.stream import iter_chunks
+
+# Placemarks joined into one block of text (some 50 KB) before encoding.
+PLACEMARKS_PER_BLOCK = 256
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+
+
+def escape_text(value: str) -> str:
+    """html.escape (quotes included), skipping strings with nothing to escape."""
+    # "<" first: generated descriptions always contain <br/>
+    if "<" in value or "&" in value or ">" in value or '"' in value or "'" in value:
+        return escape(value)
+    return value
+
+
+@dataclass(frozen=True)
+class MinifyOptions:
+    """
+    The minified output profile: coordinates rounded to `coord_decimals`
+    (None: written as parsed), without the ",0" altitude unless `altitude`,
+    and no empty <description> unless `empty_descriptions`.
+    """
+
+    coord_decimals: Optional[int] = 6
+    altitude: bool = False
+    empty_descriptions: bool = False
+
+
+def _fixed_format(decimals: int) -> tuple[str, str]:
+    # format spec, and the trailing zeros to strip (none without decimals: "40")
+    return f".{decimals}f", "0" if decimals else ""
+
+
+def fixed_coordinate(value: float, decimals: int) -> str:
+    """
+    `value` rounded to `decimals`, without trailing zeros and never in
+    exponent notation (which repr() uses below 1e-4).
+    """
+    spec, zeros = _fixed_format(decimals)
+    return format(value, spec).rstrip(zeros).rstrip(".")
+
+
+def _coordinate_format(minify: Optional[MinifyOptions]) -> tuple[Optional[int], str, bool]:
+    """(decimals or None, altitude suffix, omit empty descriptions) of an output profile."""
+    if minify is None:
+        return None, ",0", False
+    return minify.coord_decimals, ",0" if minify.altitude else "", not minify.empty_descriptions
+
+
+def coordinates_text(lon: float, lat: float, minify: Optional[MinifyOptions] = None) -> str:
+    """A "lon,lat,0" coordinate in the given output profile."""
+    decimals, alt, _ = _coordinate_format(minify)
+    if decimals is None:
+        return f"{lon},{lat}{alt}"
+    return f"{fixed_coordinate(lon, decimals)},{fixed_coordinate(lat, decimals)}{alt}"
+
+
+def point_style_xml(style_id: str, icon_url: Optional[str], icon_scale: float, icon_color: Optional[str]) -> str:
+    color = f"<color>{escape_text(icon_color)}</color>" if icon_color else ""
+    icon = f"<Icon><href>{escape_text(icon_url)}</href></Icon>" if icon_url else ""
+    return f'<Style id="{escape_text(style_id)}"><IconStyle>{color}<scale>{icon_scale}</scale>{icon}</IconStyle></Style>\n'
+
+
+def line_style_xml(style_id: str, color: Optional[str], width: float) -> str:
+    color_tag = f"<color>{escape_text(color)}</color>" if color else ""
+    return f'<Style id="{escape_text(style_id)}"><LineStyle>{color_tag}<width>{width}</width></LineStyle></Style>\n'
+
+
+def _style_url(style_id: Optional[str]) -> str:
+    return f"<styleUrl>#{escape_text(style_id)}</styleUrl>" if style_id else ""
+
+
+class _StyleUrls(dict):
+    """style id -> <styleUrl>; "" (no style of its own) -> the default style's."""
+
+    def __init__(self, default_style_id: Optional[str]) -> None:
+        super().__init__({"": _style_url(default_style_id)})
+
+    def __missing__(self, style_id: str) -> str:
+        url = self[style_id] = _style_url(style_id)
+        return url
+
+
+def iter_point_placemarks(
+    points: Iterable[KmlPoint],
+    style_id: Optional[str] = None,
+    minify: Optional[MinifyOptions] = None,
+) -> Iterator[str]:
+    """
+    Point Placemarks, one per line, in blocks of PLACEMARKS_PER_BLOCK (a
+    PointTable is read column-wise). style_id: the default style.
+    """
+    style_urls = _StyleUrls(style_id)
+    decimals, alt, omit_empty = _coordinate_format(minify)
+    spec, zeros = _fixed_format(decimals or 0)
+    esc = escape_text
+    block: list[str] = []
+    for name, lat, lon, desc, row_style_id in point_rows(points):
+        if decimals is not None:
+            # fixed_coordinate, inlined
+            lat = format(lat, spec).rstrip(zeros).rstrip(".")
+            lon = format(lon, spec).rstrip(zeros).rstrip(".")
+        description = f"<description><![CDATA[{esc(desc)}]]></description>" if desc or not omit_empty else ""
+        # KML coordinates are lon,lat,alt
+        block.append(
+            f"<Placemark><name>{esc(name)}</name>{style_urls[row_style_id]}{description}"
+            f"<Point><coordinates>{lon},{lat}{alt}</coordinates></Point></Placemark>\n"
+        )
+        if len(block) == PLACEMARKS_PER_BLOCK:
+            yield "".join(block)
+            block.clear()
+    if block:
+        yield "".join(block)
+
+
+def iter_link_placemarks(
+    links: Iterable[KmlLink],
+    style_id: Optional[str] = None,
+    minify: Optional[MinifyOptions] = None,
+) -> Iterator[str]:
+    """
+    LineString Placemarks, one per line, in blocks of PLACEMARKS_PER_BLOCK.
+    Merged links (count > 1) carry their count as ExtendedData.
+    """
+    style_urls = _StyleUrls(style_id)
+    decimals, alt, omit_empty = _coordinate_format(minify)
+    spec, zeros = _fixed_format(decimals or 0)
+    esc = escape_text
+    block: list[str] = []
+    for name, a_lat, a_lon, b_lat, b_lon, desc, count, row_style_id in link_rows(links):
+        if decimals is not None:
+            # fixed_coordinate, inlined
+            a_lat = format(a_lat, spec).rstrip(zeros).rstrip(".")
+            a_lon = format(a_lon, spec).rstrip(zeros).rstrip(".")
+            b_lat = format(b_lat, spec).rstrip(zeros).rstrip(".")
+            b_lon = format(b_lon, spec).rstrip(zeros).rstrip(".")
+        description = f"<description><![CDATA[{esc(desc)}]]></description>" if desc or not omit_empty else ""
+        extended = f'<ExtendedData><Data name="count"><value>{count}</value></Data></ExtendedData>' if count > 1 else ""
+        block.append(
+            f"<Placemark><name>{esc(name)}</name>{style_urls[row_style_id]}{description}"
+            f"{extended}<LineString><tessellate>1</tessellate>"
+            f"<coordinates>{a_lon},{a_lat}{alt} {b_lon},{b_lat}{alt}</coordinates></LineString></Placemark>\n"
+        )
+        if len(block) == PLACEMARKS_PER_BLOCK:
+            yield "".join(block)
+            block.clear()
+    if block:
+        yield "".join(block)
+
+
+def folder(name: str, placemarks: Iterable[str], region: str = "") -> Iterator[str]:
+    """A Folder around placemarks, with an optional <Region>."""
+    return chain((f"<Folder><name>{escape_text(name)}</name>{region}\n",), placemarks, ("</Folder>\n",))
+
+
+def extended_data(data: Sequence[tuple[str, object]]) -> str:
+    """<ExtendedData> of (name, value) pairs ("" when there are none)."""
+    if not data:
+        return ""
+    values = "".join(
+        f'<Data name="{escape_text(name)}"><value>{escape_text(str(value))}</value></Data>' for name, value in data
+    )
+    return f"<ExtendedData>{values}</ExtendedData>\n"
+
+
+def write_document(
+    document_name: str,
+    styles: Sequence[str],
+    body: Iterable[str],
+    extra: Iterable[str] = (),
+    document_data: Sequence[tuple[str, object]] = (),
+) -> Iterator[bytes]:
+    """
+    A KML document as UTF-8 chunks: its name, ExtendedData (document_data:
+    (name, value) pairs) and shared styles, the body (placemarks, folders)
+    and the extra fragments (e.g. tile NetworkLinks).
+    """
+    head = (
+        f"{XML_HEADER}<Document><name>{escape_text(document_name)}</name>\n"
+        f"{extended_data(document_data)}{''.join(styles)}"
+    )
+    return iter_chunks(chain((head,), body, extra, ("</Document>\n</kml>\n",)))
@@ -1,8 +1,23 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.api.router import router as api_router
+from app.ingest.upload import CsvInputError
+from app.jobs import shutdown_jobs
+from app.metrics import MetricsMiddleware
+from app.workers import shutdown_workers
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    shutdown_jobs()
+    shutdown_workers()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,6 +29,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(api_router)
 
+
+@app.exception_handler(CsvInputError)
+async def csv_input_error_handler(request: Request, exc: CsvInputError) -> JSONResponse:
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
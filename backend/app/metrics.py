@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+# Latency buckets (seconds): from small previews to large graph exports.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Size buckets (bytes): 1 KB to 1 GB.
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, labels: tuple[str, ...] = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: tuple[str, ...] = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = SECONDS_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: dict[tuple[str, ...], list[Any]] = {}
+
+    def observe(self, labels: tuple[str, ...], value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        lines = self._header()
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def sample_family(name: str, kind: str, help: str, samples: Sequence[tuple[dict[str, str], float]]) -> list[str]:
+    """Lines of a metric whose values are read at scrape time (for Registry.collectors)."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+    return lines
+
+
+class Registry:
+    """
+    Metrics rendered in the Prometheus text format. Collectors add lines
+    computed at scrape time (e.g. from the result cache's own counters).
+    """
+
+    def __init__(self) -> None:
+        self.metrics: list[_Metric] = []
+        self.collectors: list[Callable[[], list[str]]] = []
+
+    def add(self, metric: Any) -> Any:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collect in self.collectors:
+            lines += collect()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.add(Counter("csv2kml_requests_total", "HTTP requests", ("endpoint", "method", "status")))
+REQUEST_SECONDS = registry.add(Histogram("csv2kml_request_seconds", "HTTP request latency", ("endpoint",)))
+IN_FLIGHT = registry.add(Gauge("csv2kml_requests_in_flight", "HTTP requests being served"))
+STAGE_SECONDS = registry.add(
+    Histogram("csv2kml_stage_seconds", "Time spent per conversion pipeline stage", ("endpoint", "stage"))
+)
+ROWS = registry.add(Counter("csv2kml_rows_total", "CSV rows converted", ("endpoint",)))
+INPUT_BYTES = registry.add(Counter("csv2kml_input_bytes_total", "Bytes of uploaded CSV", ("endpoint",)))
+RESPONSE_BYTES = registry.add(
+    Histogram("csv2kml_response_bytes", "Response body size", ("endpoint",), buckets=BYTES_BUCKETS)
+)
+
+
+@dataclass
+class RequestMetrics:
+    """
+    Stage timings and counts of one request, collected wherever the request
+    is handled (including worker threads) and recorded when it ends, under
+    its route's path.
+    """
+
+    started: float
+    stages: list[tuple[str, float]] = field(default_factory=list)
+    rows: int = 0
+    input_bytes: int = 0
+    upload_seen: bool = False
+
+    def add_rows(self, n: int) -> None:
+        self.rows += n
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("csv2kml_request_metrics", default=None)
+
+
+def current() -> Optional[RequestMetrics]:
+    """Metrics of the request being handled (None outside a request)."""
+    return _current.get()
+
+
+def record_stage(stage: str, seconds: float, m: Optional[RequestMetrics] = None) -> None:
+    m = m or _current.get()
+    if m is not None:
+        m.stages.append((stage, seconds))
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Times the block as a pipeline stage of the current request."""
+    m = _current.get()
+    if m is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        m.stages.append((stage, time.perf_counter() - t0))
+
+
+def mark_upload_received(input_bytes: int = 0) -> None:
+    """
+    Called when an endpoint starts handling its (already received) upload:
+    the time since the request started is its upload stage.
+    """
+    m = _current.get()
+    if m is not None and not m.upload_seen:
+        m.upload_seen = True
+        m.stages.append(("upload", time.perf_counter() - m.started))
+    if m is not None:
+        m.input_bytes += input_bytes
+
+
+def _endpoint_label(scope: dict[str, Any]) -> str:
+    # the route's path template, so ids in URLs do not multiply the series
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request count, latency, in-flight requests,
+    response size and the time spent sending the body (the "send" stage),
+    plus the stages collected by the request's handlers.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        m = RequestMetrics(started=time.perf_counter())
+        token = _current.set(m)
+        status = 500
+        body_bytes = 0
+        send_seconds = 0.0
+
+        async def send_with_metrics(message: dict[str, Any]) -> None:
+            nonlocal status, body_bytes, send_seconds
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                await send(message)
+                return
+            t0 = time.perf_counter()
+            await send(message)
+            send_seconds += time.perf_counter() - t0
+            body_bytes += len(message.get("body", b""))
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            IN_FLIGHT.dec()
+            _current.reset(token)
+            endpoint = _endpoint_label(scope)
+            REQUESTS.inc((endpoint, scope["method"], str(status)))
+            REQUEST_SECONDS.observe((endpoint,), time.perf_counter() - m.started)
+            RESPONSE_BYTES.observe((endpoint,), body_bytes)
+            if m.stages:
+                for stage, seconds in m.stages:
+                    STAGE_SECONDS.observe((endpoint, stage), seconds)
+                STAGE_SECONDS.observe((endpoint, "send"), send_seconds)
+            if m.rows:
+                ROWS.inc((endpoint,), m.rows)
+            if m.input_bytes:
+                INPUT_BYTES.inc((endpoint,), m.input_bytes)
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+# One profiled conversion at a time: cProfile (since Python 3.12) can only be
+# enabled once per process, and a second one would skew the first anyway.
+_lock = threading.Lock()
+
+# Since Python 3.12 cProfile hooks sys.monitoring, which is process-wide:
+# while enabled, it also records whatever other requests run meanwhile.
+PROCESS_WIDE = sys.version_info >= (3, 12)
+
+
+class ConversionProfiler:
+    """
+    Deterministic profile (cProfile) enabled around the calls of one
+    conversion, which runs in several worker threads (parse, then each build
+    step). Before Python 3.12 it only records those threads; since then it
+    records the whole process while enabled (see PROCESS_WIDE), so other
+    conversions running at the same time show up in it too.
+    """
+
+    def __init__(self) -> None:
+        self.profile = cProfile.Profile()
+
+    @contextmanager
+    def running(self) -> Iterator[None]:
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    def hot_functions(self, limit: int = 25) -> list[dict[str, Any]]:
+        """The functions with the most own time, slowest first."""
+        stats = pstats.Stats(self.profile).stats  # type: ignore[attr-defined]
+        top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        return [
+            {
+                "function": func if line == 0 else f"{func} ({os.path.basename(path)}:{line})",
+                "calls": calls,
+                "own_seconds": round(own, 6),
+                "cumulative_seconds": round(cumulative, 6),
+            }
+            for (path, line, func), (_, calls, own, cumulative, _) in top
+        ]
+
+    def dump(self, directory: str, kind: str) -> str:
+        """Writes the profile as a pstats file in `directory` and returns its path."""
+        os.makedirs(directory, exist_ok=True)
+        name = f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.pstats"
+        path = os.path.join(directory, name)
+        self.profile.dump_stats(path)
+        return path
+
+
+def acquire() -> Optional[ConversionProfiler]:
+    """A profiler, or None while another profiled conversion is running."""
+    if not _lock.acquire(blocking=False):
+        return None
+    return ConversionProfiler()
+
+
+def release() -> None:
+    _lock.release()
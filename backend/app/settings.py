@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Literal, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw.strip() == "":
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"{name} must be an integer, got {raw!r}")
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Where CSV parsing + KML building runs: a thread pool, or a process pool
+    # (true CPU parallelism, at the cost of copying the upload to a temp file).
+    worker_mode: Literal["thread", "process"] = "thread"
+    # Max conversions running at the same time, per uvicorn worker.
+    max_workers: int = 4
+
+    # Result cache (see app.cache). 0 bytes disables the memory tier,
+    # no directory disables the disk tier.
+    cache_max_bytes: int = 256 * 1024 * 1024
+    cache_max_entry_bytes: int = 64 * 1024 * 1024
+    cache_dir: Optional[str] = None
+    cache_disk_max_bytes: int = 2 * 1024 * 1024 * 1024
+
+    # Uploaded datasets (see app.datasets): total memory budget and idle TTL.
+    dataset_max_bytes: int = 1024 * 1024 * 1024
+    dataset_ttl_seconds: int = 3600
+
+    # /kml/batch limits: number of CSVs, and total uncompressed size of a zip.
+    batch_max_files: int = 500
+    batch_max_bytes: int = 2 * 1024 * 1024 * 1024
+
+    # Background jobs (see app.jobs): worker threads, max jobs waiting,
+    # result directory (a temp dir when unset) and result lifetime.
+    jobs_max_workers: int = 2
+    jobs_max_queued: int = 100
+    jobs_dir: Optional[str] = None
+    jobs_ttl_seconds: int = 3600
+
+    # Profiled conversions (profile=true, see app.profiling): disabled unless
+    # a token is set, which requests must send in X-Profile-Token; pstats
+    # files are written to the directory when set.
+    profile_token: Optional[str] = None
+    profile_dir: Optional[str] = None
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """
+    Settings from CSV2KML_* environment variables (read once).
+    """
+    mode = os.environ.get("CSV2KML_WORKER_MODE", "thread").strip().lower()
+    if mode not in ("thread", "process"):
+        raise RuntimeError(f"CSV2KML_WORKER_MODE must be 'thread' or 'process', got {mode!r}")
+
+    max_workers = _env_int("CSV2KML_MAX_WORKERS", min(4, os.cpu_count() or 1))
+    if max_workers < 1:
+        raise RuntimeError("CSV2KML_MAX_WORKERS must be >= 1")
+
+    defaults = Settings()
+    return Settings(
+        worker_mode=mode,
+        max_workers=max_workers,
+        cache_max_bytes=_env_int("CSV2KML_CACHE_MAX_BYTES", defaults.cache_max_bytes),
+        cache_max_entry_bytes=_env_int("CSV2KML_CACHE_MAX_ENTRY_BYTES", defaults.cache_max_entry_bytes),
+        cache_dir=os.environ.get("CSV2KML_CACHE_DIR") or None,
+        cache_disk_max_bytes=_env_int("CSV2KML_CACHE_DISK_MAX_BYTES", defaults.cache_disk_max_bytes),
+        dataset_max_bytes=_env_int("CSV2KML_DATASET_MAX_BYTES", defaults.dataset_max_bytes),
+        dataset_ttl_seconds=_env_int("CSV2KML_DATASET_TTL_SECONDS", defaults.dataset_ttl_seconds),
+        batch_max_files=_env_int("CSV2KML_BATCH_MAX_FILES", defaults.batch_max_files),
+        batch_max_bytes=_env_int("CSV2KML_BATCH_MAX_BYTES", defaults.batch_max_bytes),
+        jobs_max_workers=max(1, _env_int("CSV2KML_JOBS_MAX_WORKERS", defaults.jobs_max_workers)),
+        jobs_max_queued=_env_int("CSV2KML_JOBS_MAX_QUEUED", defaults.jobs_max_queued),
+        jobs_dir=os.environ.get("CSV2KML_JOBS_DIR") or None,
+        jobs_ttl_seconds=_env_int("CSV2KML_JOBS_TTL_SECONDS", defaults.jobs_ttl_seconds),
+        profile_token=os.environ.get("CSV2KML_PROFILE_TOKEN") or None,
+        profile_dir=os.environ.get("CSV2KML_PROFILE_DIR") or None,
+    )
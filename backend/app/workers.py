@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, BinaryIO, Callable, Iterable, Iterator, Optional, Union
+
+import anyio
+import anyio.to_thread
+from fastapi import HTTPException
+
+from app.ingest.rows import ColumnTable, TableSource, count_rows
+from app.kml.stream import encode_output
+from app.metrics import RequestMetrics, current, record_stage
+from app.profiling import ConversionProfiler
+from app.settings import get_settings
+
+# A conversion function: reads its source (uploaded file or stored dataset)
+# eagerly, raising HTTPException / CsvInputError on bad input, and returns
+# the lazy KML chunks (a TileableDocument, for output="tiled").
+Converter = Callable[..., Iterable[bytes]]
+
+_READ_SIZE = 64 * 1024
+
+_limiter: Optional[anyio.CapacityLimiter] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+class WorkerError(Exception):
+    """
+    HTTPException raised inside a worker process, in picklable form.
+    """
+
+    def __init__(self, status_code: int, detail: Any) -> None:
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(get_settings().max_workers)
+    return _limiter
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=get_settings().max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def shutdown_workers() -> None:
+    """Stops the process pool (if any). Called on application shutdown."""
+    global _limiter, _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _process_pool = None
+    _limiter = None
+
+
+async def run_conversion(
+    convert: Converter,
+    source: TableSource,
+    *args: Any,
+    output: str = "kml",
+    profiler: Optional[ConversionProfiler] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Runs `convert(source, *args)` off the event loop and returns the encoded
+    output (KML or KMZ bytes) as an async iterator for StreamingResponse.
+
+    At most `max_workers` conversions use the CPU at a time. In thread mode
+    both the parse stage and every chunk of the build stage run in the
+    thread pool under that limit. In process mode the whole conversion runs
+    in a worker process that writes its output to a temp file, which is then
+    streamed back (uploads are copied to a temp file for it, datasets are
+    pickled).
+
+    With a `profiler`, the conversion always runs in threads of this process,
+    under the profiler.
+    """
+    limiter = _get_limiter()
+    m = current()
+    submitted = time.perf_counter()
+
+    if get_settings().worker_mode == "process" and profiler is None:
+        async with limiter:
+            record_stage("queue", time.perf_counter() - submitted, m)
+            out_path = await _run_in_process(convert, source, args, output, m)
+        return _iter_file(out_path)
+
+    def parse() -> Iterable[bytes]:
+        started = time.perf_counter()
+        record_stage("queue", started - submitted, m)
+        with count_rows(m.add_rows) if m else nullcontext(), profiler.running() if profiler else nullcontext():
+            parts = convert(source, *args)
+        record_stage("parse", time.perf_counter() - started, m)
+        return parts
+
+    parts = await anyio.to_thread.run_sync(parse, limiter=limiter)
+    return _iterate_in_threads(encode_output(parts, output), limiter, m, profiler)
+
+
+async def _iterate_in_threads(
+    chunks: Iterator[bytes],
+    limiter: anyio.CapacityLimiter,
+    m: Optional[RequestMetrics] = None,
+    profiler: Optional[ConversionProfiler] = None,
+) -> AsyncIterator[bytes]:
+    done = object()
+    build_seconds = 0.0
+
+    def step() -> Any:
+        nonlocal build_seconds
+        t0 = time.perf_counter()
+        try:
+            with profiler.running() if profiler else nullcontext():
+                return next(chunks, done)
+        finally:
+            build_seconds += time.perf_counter() - t0
+
+    try:
+        while True:
+            chunk = await anyio.to_thread.run_sync(step, limiter=limiter)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        record_stage("build", build_seconds, m)
+
+
+async def run_in_thread(fn: Callable[..., Any], *args: Any) -> Any:
+    """Runs a blocking call in the worker threads, under the same concurrency limit."""
+    return await anyio.to_thread.run_sync(lambda: fn(*args), limiter=_get_limiter())
+
+
+async def _run_in_process(
+    convert: Converter,
+    source: TableSource,
+    args: tuple,
+    output: str,
+    m: Optional[RequestMetrics] = None,
+) -> str:
+    if isinstance(source, ColumnTable):
+        src: Any = source
+        src_path = None
+    else:
+        # Uploads may live in memory (SpooledTemporaryFile): hand the child a real file.
+        src = src_path = await anyio.to_thread.run_sync(_spool_to_disk, source)
+    try:
+        future = _get_process_pool().submit(_convert_to_file, convert, src, args, output)
+        result = await asyncio.wrap_future(future)
+    finally:
+        if src_path:
+            os.remove(src_path)
+
+    if isinstance(result, WorkerError):
+        raise HTTPException(status_code=result.status_code, detail=result.detail)
+    out_path, rows, parse_seconds, build_seconds = result
+    if m is not None:
+        m.add_rows(rows)
+        record_stage("parse", parse_seconds, m)
+        record_stage("build", build_seconds, m)
+    return out_path
+
+
+def convert_to_path(
+    convert: Converter,
+    src: Union[str, ColumnTable],
+    args: tuple,
+    output: str,
+    path: str,
+    progress: Callable[[int], None],
+) -> None:
+    """
+    Blocking counterpart of run_conversion for background jobs (see
+    app.jobs): converts `src` (a CSV file path or a dataset table) and
+    writes the encoded output to `path`, reporting rows read to `progress`.
+
+    Thread mode converts in the calling thread; process mode in the worker
+    process pool, whose row count is reported when it is done.
+    """
+    if get_settings().worker_mode == "process":
+        result = _get_process_pool().submit(_convert_to_file, convert, src, args, output).result()
+        if isinstance(result, WorkerError):
+            raise HTTPException(status_code=result.status_code, detail=result.detail)
+        out_path, rows, _, _ = result
+        shutil.move(out_path, path)
+        progress(rows)
+        return
+
+    with count_rows(progress), open(path, "wb") as out:
+        _write_output(convert, src, args, output, out)
+
+
+def _spool_to_disk(fileobj: BinaryIO) -> str:
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="csv2kml-in-", suffix=".csv", delete=False) as tmp:
+        shutil.copyfileobj(fileobj, tmp, _READ_SIZE)
+        return tmp.name
+
+
+def _write_output(
+    convert: Converter,
+    src: Union[str, ColumnTable],
+    args: tuple,
+    output: str,
+    out: BinaryIO,
+) -> tuple[float, float]:
+    """Converts and writes `src`. Returns the parse and build durations."""
+    t0 = time.perf_counter()
+    with open(src, "rb") if isinstance(src, str) else nullcontext(src) as source:
+        parts = convert(source, *args)
+        t1 = time.perf_counter()
+        for chunk in encode_output(parts, output):
+            out.write(chunk)
+    return t1 - t0, time.perf_counter() - t1
+
+
+def _convert_to_file(convert: Converter, src: Union[str, ColumnTable], args: tuple, output: str) -> Any:
+    """
+    Worker process entry point. Returns (output path, rows read, parse
+    seconds, build seconds), or a WorkerError.
+    """
+    rows = 0
+
+    def count(n: int) -> None:
+        nonlocal rows
+        rows += n
+
+    with tempfile.NamedTemporaryFile(prefix="csv2kml-out-", delete=False) as out:
+        try:
+            with count_rows(count):
+                parse_seconds, build_seconds = _write_output(convert, src, args, output, out)
+        except HTTPException as e:
+            out.close()
+            os.remove(out.name)
+            return WorkerError(e.status_code, e.detail)
+        except BaseException:
+            out.close()
+            os.remove(out.name)
+            raise
+        return out.name, rows, parse_seconds, build_seconds
+
+
+async def _iter_file(path: str) -> AsyncIterator[bytes]:
+    try:
+        async with await anyio.open_file(path, "rb") as f:
+            while True:
+                chunk = await f.read(_READ_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+    finally:
+        os.remove(path)
@@ -0,0 +1,65 @@
+"""
+Dialect detection benchmark: csv.Sniffer().sniff (the previous detector)
+against app.ingest.dialect.detect_dialect, on the 4 KB sample the endpoints
+read.
+
+Run from backend/:
+
+    python -m benchmarks.bench_dialect --cols 8 80
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import random
+import time
+
+from app.ingest.dialect import detect_dialect
+from app.ingest.upload import SAMPLE_SIZE
+
+
+def make_sample(cols: int, delimiter: str) -> str:
+    rnd = random.Random(42)
+    out = io.StringIO()
+    w = csv.writer(out, delimiter=delimiter, lineterminator="\n")
+    w.writerow([f"col_{i}" for i in range(cols)])
+    while out.tell() < SAMPLE_SIZE:
+        w.writerow([f"{rnd.uniform(-90, 90):.6f}" if i % 3 else f"name {rnd.randint(0, 999)}" for i in range(cols)])
+    return out.getvalue()[:SAMPLE_SIZE]
+
+
+def sniff(sample: str) -> str:
+    try:
+        return csv.Sniffer().sniff(sample).delimiter
+    except csv.Error:
+        return ","
+
+
+def detect(sample: str) -> str:
+    return detect_dialect(sample).delimiter
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cols", type=int, nargs="+", default=[8, 80])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for cols in args.cols:
+        for delimiter in ",;\t":
+            sample = make_sample(cols, delimiter)
+            line = []
+            for label, fn in [("Sniffer", sniff), ("detect_dialect", detect)]:
+                best = float("inf")
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    found = fn(sample)
+                    best = min(best, time.perf_counter() - t0)
+                ok = "ok" if found == delimiter else f"wrong: {found!r}"
+                line.append(f"{label} {best * 1e3:7.2f} ms ({ok})")
+            print(f"{cols:>4} cols, {delimiter!r:>4}: " + " | ".join(line))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Row extraction benchmark: csv.DictReader + row.get(col).strip() (the
+endpoints' previous per-row path) against CsvTable.select().
+
+Run from backend/:
+
+    python -m benchmarks.bench_rows --rows 200000 --extra-cols 20
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import random
+import time
+
+from app.ingest.rows import CsvTable
+
+MAPPED = ["name", "lat", "lon", "site"]
+
+
+def make_csv(rows: int, extra_cols: int) -> bytes:
+    rnd = random.Random(42)
+    header = MAPPED + [f"extra_{i}" for i in range(extra_cols)]
+    out = io.StringIO()
+    w = csv.writer(out, lineterminator="\n")
+    w.writerow(header)
+    for i in range(rows):
+        w.writerow(
+            [f"P{i}", f"{rnd.uniform(-90, 90):.6f}", f"{rnd.uniform(-180, 180):.6f}", f"S{i % 97}"]
+            + [f"value {i} {j}" for j in range(extra_cols)]
+        )
+    return out.getvalue().encode("utf-8")
+
+
+def run_dictreader(data: bytes) -> int:
+    text = data.decode("utf-8-sig")
+    reader = csv.DictReader(io.StringIO(text), dialect=csv.excel)
+    n = 0
+    for row in reader:
+        values = [(row.get(c) or "").strip() for c in MAPPED]
+        float(values[1])
+        float(values[2])
+        n += 1
+    return n
+
+
+def run_select(data: bytes) -> int:
+    table = CsvTable(io.BytesIO(data))
+    n = 0
+    for values in table.select(MAPPED):
+        float(values[1])
+        float(values[2])
+        n += 1
+    return n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--extra-cols", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_csv(args.rows, args.extra_cols)
+    print(f"{args.rows} rows, {len(MAPPED) + args.extra_cols} columns ({len(MAPPED)} mapped), {len(data) / 1e6:.1f} MB")
+
+    results = {}
+    for label, fn in [("DictReader", run_dictreader), ("CsvTable.select", run_select)]:
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            assert fn(data) == args.rows
+            best = min(best, time.perf_counter() - t0)
+        results[label] = args.rows / best
+        print(f"{label:>16}: {results[label]:>12,.0f} rows/s")
+
+    print(f"{'speedup':>16}: {results['CsvTable.select'] / results['DictReader']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Conversion benchmark suite: rows/s, latency and peak RSS per kind (points,
+links, graph), data size and stage, on synthetic CSVs (benchmarks.synthetic).
+
+Stages:
+
+- parse: the converter reading the CSV into features (convert_*)
+- builder: the KML builder writing those features (build_kml_*)
+- endpoint: POST /kml/<kind> through the ASGI app, upload to last byte
+
+Every case runs in a fresh process, so its peak RSS is its own. The result
+cache is disabled. Results are written as JSON (default:
+benchmarks/results/<timestamp>.json); --compare prints the change against
+an earlier results file.
+
+Run from backend/:
+
+    python -m benchmarks.bench_suite --sizes 1e3 1e4 1e5
+    python -m benchmarks.bench_suite --kinds graph --sizes 1e6 --stages endpoint
+    python -m benchmarks.bench_suite --compare benchmarks/results/before.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, Callable, Optional
+
+import anyio
+import httpx
+
+from app.api.conversions import CONVERSIONS
+from app.kml.builder import build_kml_points
+from app.kml.graph_builder import build_kml_graph
+from app.kml.links_builder import build_kml_links
+from app.main import app
+from benchmarks.synthetic import KINDS, MAPPINGS, dataset_path
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+STAGES = ("parse", "builder", "endpoint")
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _parse(kind: str, path: str) -> Any:
+    model, convert, _ = CONVERSIONS[kind]
+    m = model.model_validate(MAPPINGS[kind])
+    with open(path, "rb") as f:
+        return convert(f, m, os.path.basename(path))
+
+
+def _builder(kind: str, doc: Any) -> Callable[[], int]:
+    features = doc.features
+    if kind == "points":
+        return lambda: len(build_kml_points("bench", features))
+    if kind == "links":
+        return lambda: len(build_kml_links("bench", features))
+    return lambda: len(build_kml_graph("bench", features.points, features.links))
+
+
+def _endpoint(kind: str, path: str) -> Callable[[], int]:
+    with open(path, "rb") as f:
+        data = f.read()
+    url = "/kml/points" if kind == "points" else f"/kml/{kind}"
+    mapping = json.dumps(MAPPINGS[kind])
+
+    async def request() -> int:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            files = {"file": (os.path.basename(path), data, "text/csv")}
+            async with client.stream("POST", url, files=files, data={"mapping": mapping}) as r:
+                if r.status_code != 200:
+                    raise RuntimeError(f"{url} answered {r.status_code}: {(await r.aread())[:200]!r}")
+                size = 0
+                async for chunk in r.aiter_bytes():
+                    size += len(chunk)
+                return size
+
+    return lambda: anyio.run(request)
+
+
+def run_case(kind: str, rows: int, stage: str, path: str, repeat: int) -> dict[str, Any]:
+    """Runs one case (in its own process, see main) and returns its result."""
+    base_rss = _peak_rss_mb()
+
+    if stage == "parse":
+        fn: Callable[[], Any] = partial(_parse, kind, path)
+    elif stage == "builder":
+        fn = _builder(kind, _parse(kind, path))
+    else:
+        fn = _endpoint(kind, path)
+
+    times = []
+    output_bytes = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+        if isinstance(result, int):
+            output_bytes = result
+
+    best = min(times)
+    return {
+        "kind": kind,
+        "stage": stage,
+        "rows": rows,
+        "input_bytes": os.path.getsize(path),
+        "output_bytes": output_bytes,
+        "seconds": round(best, 6),
+        "median_seconds": round(statistics.median(times), 6),
+        "rows_per_second": round(rows / best, 1) if best > 0 else None,
+        "base_rss_mb": base_rss,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _case_key(r: dict[str, Any]) -> tuple[str, str, int]:
+    return r["kind"], r["stage"], r["rows"]
+
+
+def compare(results: list[dict[str, Any]], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {_case_key(r): r for r in json.load(f)["results"]}
+
+    print(f"\nrows/s against {baseline_path}:")
+    for r in results:
+        old = baseline.get(_case_key(r))
+        if not old or not old.get("rows_per_second") or not r["rows_per_second"]:
+            continue
+        ratio = r["rows_per_second"] / old["rows_per_second"]
+        flag = "  <-- slower" if ratio < 0.9 else ""
+        print(f"  {r['kind']:>6} {r['stage']:>8} {r['rows']:>9}: {ratio:6.2f}x{flag}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--sizes", nargs="+", default=["1e3", "1e4", "1e5"], help="row counts, e.g. 1e3 1e6")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "csv2kml-bench"))
+    parser.add_argument("--out", help="results JSON file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to compare rows/s against")
+    args = parser.parse_args()
+
+    sizes = [int(float(s)) for s in args.sizes]
+    # every conversion must run, not come from the result cache
+    os.environ["CSV2KML_CACHE_MAX_BYTES"] = "0"
+    os.environ.pop("CSV2KML_CACHE_DIR", None)
+
+    started = datetime.now(timezone.utc)
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for kind in args.kinds:
+        for rows in sizes:
+            path = dataset_path(kind, rows, args.data_dir)
+            for stage in args.stages:
+                # a fresh process per case: peak RSS is the case's own
+                with ctx.Pool(1) as pool:
+                    r = pool.apply(run_case, (kind, rows, stage, path, args.repeat))
+                results.append(r)
+                print(
+                    f"{kind:>6} {stage:>8} {rows:>9} rows: {r['seconds'] * 1000:10.1f} ms"
+                    f" {r['rows_per_second']:>12,.0f} rows/s  peak RSS {r['peak_rss_mb']} MB",
+                    flush=True,
+                )
+
+    report = {
+        "meta": {
+            "timestamp": started.isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "worker_mode": os.environ.get("CSV2KML_WORKER_MODE", "thread"),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, started.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
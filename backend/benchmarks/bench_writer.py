@@ -0,0 +1,132 @@
+"""
+KML writer benchmark: per-row cost of the previous points and links
+builders (a multi-line f-string per placemark, html.escape on every value,
+textwrap.dedent per link) against the shared writer (app.kml.writer), with
+and without the minified profile, on the features of a synthetic CSV
+(benchmarks.synthetic).
+
+Both are timed to encoded bytes, as the endpoints stream them.
+
+Run from backend/:
+
+    python -m benchmarks.bench_writer --rows 200000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import textwrap
+import time
+from html import escape
+from typing import Any, Callable, Iterable, Iterator
+
+from app.api.conversions import CONVERSIONS
+from app.kml.builder import iter_kml_points
+from app.kml.features import LinkTable, PointTable
+from app.kml.links_builder import iter_kml_links
+from app.kml.stream import iter_chunks
+from app.kml.writer import MinifyOptions
+from benchmarks.synthetic import MAPPINGS, dataset_path
+
+
+def legacy_points(document_name: str, points: PointTable) -> Iterator[str]:
+    yield f"""<?xml version="1.0" encoding="UTF-8"?>
+            <kml xmlns="http://www.opengis.net/kml/2.2">
+            <Document>
+                <name>{escape(document_name)}</name>
+            """
+    sep = ""
+    for name, lat, lon, desc, _ in points.rows():
+        name = escape(name)
+        desc = escape(desc)
+        yield f"""{sep}
+            <Placemark>
+            <name>{name}</name>
+            <description><![CDATA[{desc}]]></description>
+            <Point>
+                <coordinates>{lon},{lat},0</coordinates>
+            </Point>
+            </Placemark>"""
+        sep = "\n"
+    yield """
+            </Document>
+            </kml>
+            """
+
+
+def legacy_links(document_name: str, links: LinkTable) -> Iterator[str]:
+    yield f"""<?xml version="1.0" encoding="UTF-8"?>
+    <kml xmlns="http://www.opengis.net/kml/2.2">
+        <Document>
+            <name>{escape(document_name)}</name>
+            """
+    sep = ""
+    for name, a_lat, a_lon, b_lat, b_lon, desc, count, _ in links.rows():
+        name = escape(name)
+        desc = escape(desc)
+        coords = f"{a_lon},{a_lat},0 {b_lon},{b_lat},0"
+        extended = ""
+        if count > 1:
+            extended = f'\n                    <ExtendedData><Data name="count"><value>{count}</value></Data></ExtendedData>'
+        yield sep + textwrap.dedent(f"""\
+                <Placemark>
+                    <name>{escape(name)}</name>
+                    <description><![CDATA[{desc}]]></description>{extended}
+                    <LineString>
+                        <tessellate>1</tessellate>
+                        <coordinates>{coords}</coordinates>
+                    </LineString>
+                </Placemark>
+            """).rstrip()
+        sep = "\n"
+    yield """
+        </Document>
+    </kml>
+    """
+
+
+def _features(kind: str, rows: int, data_dir: str) -> Any:
+    model, convert, _ = CONVERSIONS[kind]
+    path = dataset_path(kind, rows, data_dir)
+    with open(path, "rb") as f:
+        return convert(f, model.model_validate(MAPPINGS[kind]), os.path.basename(path)).features
+
+
+def _time(fn: Callable[[], Iterable[bytes]], repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = sum(len(chunk) for chunk in fn())
+        best = min(best, time.perf_counter() - t0)
+    return best, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "csv2kml-bench"))
+    args = parser.parse_args()
+
+    points = _features("points", args.rows, args.data_dir)
+    links = _features("links", args.rows, args.data_dir)
+    cases = [
+        ("points", "legacy", lambda: iter_chunks(legacy_points("bench", points))),
+        ("points", "writer", lambda: iter_kml_points("bench", points)),
+        ("points", "minify", lambda: iter_kml_points("bench", points, minify=MinifyOptions())),
+        ("links", "legacy", lambda: iter_chunks(legacy_links("bench", links))),
+        ("links", "writer", lambda: iter_kml_links("bench", links)),
+        ("links", "minify", lambda: iter_kml_links("bench", links, minify=MinifyOptions())),
+    ]
+    for kind, name, fn in cases:
+        seconds, size = _time(fn, args.repeat)
+        print(
+            f"{kind:>6} {name:>6}: {seconds * 1e9 / args.rows:8.0f} ns/row"
+            f" {seconds * 1000:9.1f} ms  {size / args.rows:6.1f} bytes/row"
+        )
+
+
+if __name__ == "__main__":
+    main()
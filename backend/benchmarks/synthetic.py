@@ -0,0 +1,120 @@
+"""
+Synthetic points, links and graph CSVs for the benchmarks, with the
+mapping JSON of each kind. Deterministic for a given row count and seed.
+
+Run from backend/ to write a file:
+
+    python -m benchmarks.synthetic graph 1000000 graph_1e6.csv
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import random
+from typing import Any, Callable, TextIO
+
+KINDS = ("points", "links", "graph")
+
+MAPPINGS: dict[str, dict[str, Any]] = {
+    "points": {
+        "name_col": "name",
+        "lat_col": "lat",
+        "lon_col": "lon",
+        "description_cols": ["category", "value"],
+    },
+    "links": {
+        "a_lat_col": "a_lat",
+        "a_lon_col": "a_lon",
+        "b_lat_col": "b_lat",
+        "b_lon_col": "b_lon",
+        "link_name_col": "name",
+        "description_cols": ["kind"],
+    },
+    "graph": {
+        "points": {
+            "nodes": [
+                {"name_col": "a_name", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "b_name", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+        },
+        "links": {
+            "a_lat_col": "a_lat",
+            "a_lon_col": "a_lon",
+            "b_lat_col": "b_lat",
+            "b_lon_col": "b_lon",
+            "link_name_col": "link",
+            "description_cols": ["capacity"],
+        },
+    },
+}
+
+_CATEGORIES = ["tower", "cabinet", "pole", "manhole", "exchange"]
+
+
+def _coord(rnd: random.Random) -> tuple[str, str]:
+    # a European-sized box, 6 decimals like real exports
+    return f"{rnd.uniform(36.0, 60.0):.6f}", f"{rnd.uniform(-9.0, 30.0):.6f}"
+
+
+def _write_points(w: Any, rows: int, rnd: random.Random) -> None:
+    w.writerow(["name", "lat", "lon", "category", "value"])
+    for i in range(rows):
+        lat, lon = _coord(rnd)
+        w.writerow([f"P{i}", lat, lon, _CATEGORIES[i % len(_CATEGORIES)], f"{rnd.random() * 100:.2f}"])
+
+
+def _write_links(w: Any, rows: int, rnd: random.Random) -> None:
+    w.writerow(["name", "a_lat", "a_lon", "b_lat", "b_lon", "kind"])
+    for i in range(rows):
+        w.writerow([f"L{i}", *_coord(rnd), *_coord(rnd), "fiber" if i % 3 else "radio"])
+
+
+def _write_graph(w: Any, rows: int, rnd: random.Random) -> None:
+    # edges between a node pool a quarter of the row count: nodes repeat, as
+    # in network exports, so deduplication has work to do
+    nodes = [(f"N{i}", *_coord(rnd)) for i in range(max(10, rows // 4))]
+    w.writerow(["a_name", "a_lat", "a_lon", "b_name", "b_lat", "b_lon", "link", "capacity"])
+    for i in range(rows):
+        a = nodes[rnd.randrange(len(nodes))]
+        b = nodes[rnd.randrange(len(nodes))]
+        w.writerow([*a, *b, f"E{i}", str(rnd.choice((1, 10, 100)))])
+
+
+_WRITERS: dict[str, Callable[[Any, int, random.Random], None]] = {
+    "points": _write_points,
+    "links": _write_links,
+    "graph": _write_graph,
+}
+
+
+def write_csv(kind: str, rows: int, out: TextIO, seed: int = 42) -> None:
+    _WRITERS[kind](csv.writer(out, lineterminator="\n"), rows, random.Random(seed))
+
+
+def dataset_path(kind: str, rows: int, directory: str, seed: int = 42) -> str:
+    """A generated CSV in `directory`, created on first use and reused after."""
+    path = os.path.join(directory, f"{kind}_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp = path + ".part"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            write_csv(kind, rows, f, seed)
+        os.replace(tmp, path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("rows", type=int)
+    parser.add_argument("out")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.out, "w", newline="", encoding="utf-8") as f:
+        write_csv(args.kind, args.rows, f, args.seed)
+
+
+if __name__ == "__main__":
+    main()
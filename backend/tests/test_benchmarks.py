@@ -0,0 +1,16 @@
+import pytest
+
+from benchmarks.bench_suite import STAGES, run_case
+from benchmarks.synthetic import KINDS, dataset_path
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_bench_suite_cases_run_on_synthetic_data(kind, tmp_path):
+    path = dataset_path(kind, 50, str(tmp_path))
+    assert dataset_path(kind, 50, str(tmp_path)) == path  # generated once, then reused
+
+    for stage in STAGES:
+        r = run_case(kind, 50, stage, path, repeat=1)
+        assert r["rows_per_second"] > 0
+        if stage != "parse":
+            assert r["output_bytes"] > 0
@@ -0,0 +1,154 @@
+import hashlib
+import io
+import json
+import os
+import random
+import zipfile
+
+import sniffio
+from fastapi.testclient import TestClient
+
+import app.api.responses as responses
+import app.cache as cache_module
+import app.kml.tiles as tiles
+from app.cache import CACHE_VERSION, ResultCache
+from app.main import app
+
+client = TestClient(app)
+
+# Digest of the sample conversions below, per CACHE_VERSION. Cached results
+# and ETags are keyed on CACHE_VERSION, not on the output: when the output
+# changes, bump CACHE_VERSION and record the new digest here.
+OUTPUT_DIGESTS = {
+    "4": "aca8c0972c9bef1f34c03a6525fa1d4fbf179aae1b976b1df9ad37569106d120",
+}
+
+
+def test_disk_tier_is_read_outside_the_lock(tmp_path, monkeypatch):
+    ResultCache(max_bytes=0, max_entry_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096).put("k", b"kml")
+    # a fresh cache (another worker, a restart) finds the entry on disk only
+    cache = ResultCache(max_bytes=1024, max_entry_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096)
+
+    def unlocked_open(*args, **kwargs):
+        assert not cache._lock.locked()
+        return open(*args, **kwargs)
+
+    monkeypatch.setattr(cache_module, "open", unlocked_open, raising=False)
+    assert cache.get("k") == b"kml"
+    assert cache.stats()["memory_entries"] == 1
+
+    # an entry whose file went away is a miss and leaves the index
+    disk_only = ResultCache(max_bytes=0, max_entry_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096)
+    disk_only.put("gone", b"x")
+    os.remove(tmp_path / "gone.bin")
+    assert disk_only.get("gone") is None
+    assert disk_only.stats()["disk_entries"] == 1
+
+
+def _sample_output_digest() -> str:
+    rnd = random.Random(7)
+    points = "name,lat,lon,site\n" + "".join(
+        f"P{i},{rnd.uniform(40, 42):.5f},{rnd.uniform(12, 14):.5f},A & B <{i % 3}>\n" for i in range(60)
+    )
+    links = "a_lat,a_lon,b_lat,b_lon,name\n" + "".join(
+        f"{rnd.uniform(40, 42):.5f},{rnd.uniform(12, 14):.5f},{rnd.uniform(40, 42):.5f},{rnd.uniform(12, 14):.5f},L{i}\n"
+        for i in range(30)
+    )
+    graph = "name_a,a_lat,a_lon,name_b,b_lat,b_lon\nA,41.9,12.5,B,40.8,14.3\nA,41.9,12.5,C,45.4,9.2\n"
+    point_mapping = {
+        "name_col": "name", "lat_col": "lat", "lon_col": "lon", "description_cols": ["site"],
+        "icon_color": "#FF0000", "cluster": {"zoom_levels": [4, 8]},
+        "style_rule": {"column": "site", "categories": {"A & B <1>": {"color": "#00FF00"}}},
+    }
+    link_mapping = {
+        "a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon",
+        "link_name_col": "name", "line_color": "#00AAFF", "line_width": 3.5,
+    }
+    graph_mapping = {
+        "points": {"nodes": [
+            {"name_col": "name_a", "lat_col": "a_lat", "lon_col": "a_lon"},
+            {"name_col": "name_b", "lat_col": "b_lat", "lon_col": "b_lon"},
+        ]},
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+    }
+    requests = [
+        ("points", "kml", points, point_mapping),
+        ("points", "tiled", points, {**point_mapping, "cluster": {}}),
+        ("links", "kml", links, link_mapping),
+        ("links", "kml", links, {**link_mapping, "minify": {"coord_decimals": 3}}),
+        ("graph", "kmz", graph, graph_mapping),
+    ]
+
+    digest = hashlib.sha256()
+    for kind, output, csv, mapping in requests:
+        r = client.post(
+            f"/kml/{kind}?output={output}",
+            files={"file": (f"{kind}.csv", csv, "text/csv")},
+            data={"mapping": json.dumps(mapping)},
+        )
+        assert r.status_code == 200, r.text
+        if output == "kml":
+            digest.update(r.content)
+            continue
+        # archive entries only: zip headers carry timestamps
+        with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+            for name in zf.namelist():
+                digest.update(name.encode() + b"\0" + zf.read(name))
+    return digest.hexdigest()
+
+
+def test_output_changes_bump_the_cache_version(monkeypatch):
+    monkeypatch.setattr(tiles, "TILE_MAX_FEATURES", 10)
+    # convert every time: a cached result would hide the change
+    uncached = ResultCache(max_bytes=0, max_entry_bytes=0, directory=None, disk_max_bytes=0)
+    monkeypatch.setattr(responses, "get_result_cache", lambda: uncached)
+    assert _sample_output_digest() == OUTPUT_DIGESTS.get(CACHE_VERSION), (
+        "the KML output changed: bump CACHE_VERSION in app/cache.py and record the new digest"
+    )
+
+
+def test_disk_tier_is_written_outside_the_lock(tmp_path, monkeypatch):
+    cache = ResultCache(max_bytes=0, max_entry_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096)
+    fdopen = os.fdopen
+
+    def unlocked_fdopen(*args, **kwargs):
+        assert not cache._lock.locked()
+        return fdopen(*args, **kwargs)
+
+    monkeypatch.setattr(os, "fdopen", unlocked_fdopen)
+    cache.put("k", b"kml")
+    cache.put("k", b"kml")
+    assert cache.stats()["disk_entries"] == 1 and cache.stats()["disk_bytes"] == 3
+    assert cache.get("k") == b"kml"
+
+
+def test_cache_is_used_off_the_event_loop(tmp_path, monkeypatch):
+    calls = []
+
+    class RecordingCache(ResultCache):
+        def get(self, key):
+            calls.append(("get", _on_event_loop()))
+            return super().get(key)
+
+        def put(self, key, data):
+            calls.append(("put", _on_event_loop()))
+            super().put(key, data)
+
+    cache = RecordingCache(max_bytes=0, max_entry_bytes=1 << 20, directory=str(tmp_path), disk_max_bytes=1 << 20)
+    monkeypatch.setattr(responses, "get_result_cache", lambda: cache)
+    for _ in range(2):
+        r = client.post(
+            "/kml/points",
+            files={"file": ("p.csv", "name,lat,lon\nA,41.9,12.5\n", "text/csv")},
+            data={"mapping": json.dumps({"name_col": "name", "lat_col": "lat", "lon_col": "lon"})},
+        )
+        assert r.status_code == 200
+    assert calls == [("get", False), ("put", False), ("get", False)]
+
+
+def _on_event_loop() -> bool:
+    try:
+        sniffio.current_async_library()
+    except sniffio.AsyncLibraryNotFoundError:
+        return False
+    return True
@@ -0,0 +1,112 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi.testclient import TestClient
+
+from app.api.kml import PointsMapping
+from app.cli import chunk_ranges, convert_file, convert_file_chunked, main
+from app.main import app
+
+client = TestClient(app)
+
+POINTS_MAPPING = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "description_cols": ["site"]}
+
+
+def _points_csv(n: int, blank_every: int = 0) -> str:
+    lines = ["name,lat,lon,site"]
+    for i in range(n):
+        # unnamed points get "Point <row>" names, which chunks must keep
+        lines.append(f"{'' if i % 3 else f'P{i}'},{40 + i / 1000:.4f},{9 + i / 1000:.4f},S{i % 7}")
+        if blank_every and i % blank_every == 0:
+            lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def test_cli_converts_files_and_directories_like_the_endpoint(tmp_path, capsys):
+    src = tmp_path / "in"
+    src.mkdir()
+    (src / "north.csv").write_text(_points_csv(20))
+    (src / "broken.csv").write_text("name,lat,lon,site\nA,not-a-lat,9.2,x\n")
+    (src / "notes.txt").write_text("not a csv")
+    mapping = tmp_path / "mapping.json"
+    mapping.write_text(json.dumps(POINTS_MAPPING))
+    out = tmp_path / "out"
+
+    code = main(["points", str(src), "--mapping", str(mapping), "-o", str(out), "--workers", "1"])
+    assert code == 1
+    assert sorted(p.name for p in out.iterdir()) == ["north.kml"]
+    assert "broken.csv: error: Invalid coordinates at row 1" in capsys.readouterr().err
+
+    r = client.post(
+        "/kml/points",
+        files={"file": ("north.csv", _points_csv(20), "text/csv")},
+        data={"mapping": json.dumps(POINTS_MAPPING)},
+    )
+    assert (out / "north.kml").read_bytes() == r.content
+
+
+def test_chunk_ranges_split_on_lines_and_number_rows(tmp_path):
+    path = tmp_path / "big.csv"
+    path.write_text(_points_csv(100, blank_every=10))
+    header, ranges = chunk_ranges(str(path), 4)
+
+    data = path.read_bytes()
+    assert header == b"name,lat,lon,site\n"
+    assert len(ranges) == 4
+    assert ranges[0][0] == len(header) and ranges[-1][1] == len(data)
+    for (_, end, _), (start, _, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[start - 1:start] == b"\n"
+
+    # first row numbers skip the blank lines, as the CSV reader does
+    for start, _, first_row in ranges:
+        assert first_row == data[len(header):start].count(b"\n") - data[len(header):start].count(b"\n\n") + 1
+
+
+def test_chunked_conversion_matches_whole_file(tmp_path):
+    path = tmp_path / "big.csv"
+    path.write_text(_points_csv(500, blank_every=37))
+    m = PointsMapping.model_validate(POINTS_MAPPING)
+
+    whole = tmp_path / "whole.kml"
+    chunked = tmp_path / "chunked.kml"
+    assert convert_file("points", m, str(path), str(whole), "kml") is None
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        assert convert_file_chunked(pool, "points", m, str(path), str(chunked), "kml", 4) is None
+        assert chunked.read_bytes() == whole.read_bytes()
+
+        # errors in a later chunk carry the row number in the whole file
+        bad = tmp_path / "bad.csv"
+        bad.write_text(_points_csv(400) + "Z,95.0,9.0,x\n")
+        error = convert_file_chunked(pool, "points", m, str(bad), str(tmp_path / "bad.kml"), "kml", 4)
+        assert error == "Latitude out of range at row 401: 95.0"
+        assert not (tmp_path / "bad.kml").exists()
+
+
+def test_cli_chunks_fall_back_to_one_process_per_file(tmp_path, capsys):
+    # clusters depend on the whole file: --chunks converts each file in one process
+    for name in ("a.csv", "b.csv"):
+        (tmp_path / name).write_text(_points_csv(50))
+    mapping = tmp_path / "mapping.json"
+    mapping.write_text(json.dumps({**POINTS_MAPPING, "cluster": {"zoom_levels": [4, 8]}}))
+
+    code = main(["points", str(tmp_path), "--mapping", str(mapping), "--workers", "2", "--chunks", "4"])
+    assert code == 0
+    assert (tmp_path / "a.kml").exists() and (tmp_path / "b.kml").exists()
+    assert "2/2 files converted" in capsys.readouterr().err
+
+
+def test_chunked_conversion_keeps_records_spanning_lines(tmp_path):
+    # a quoted line break near the chunk boundary: split on lines, the record would be cut
+    lines = _points_csv(200).splitlines()
+    lines[100] = 'Multi,41.0000,9.5000,"first line\nsecond ""line"""'
+    path = tmp_path / "quoted.csv"
+    path.write_text("\n".join(lines) + "\n")
+    m = PointsMapping.model_validate(POINTS_MAPPING)
+
+    whole = tmp_path / "whole.kml"
+    chunked = tmp_path / "chunked.kml"
+    assert convert_file("points", m, str(path), str(whole), "kml") is None
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        assert convert_file_chunked(pool, "points", m, str(path), str(chunked), "kml", 2) is None
+    assert chunked.read_bytes() == whole.read_bytes()
+    assert b"first line\nsecond &quot;line&quot;" in whole.read_bytes()
@@ -0,0 +1,130 @@
+import json
+
+import anyio
+from fastapi.testclient import TestClient
+
+from app.api.csv import resolve_input
+from app.ingest.dialect import CsvDialect
+from app.main import app
+
+client = TestClient(app)
+
+
+def _upload(content: str, filename: str = "sites.csv") -> dict:
+    r = client.post("/csv/upload", files={"file": (filename, content, "text/csv")})
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_upload_then_preview_and_convert_by_dataset_id():
+    ds = _upload("name;lat;lon;site\nA;41.9;12.5;S1\n\nB;40.8;14.3;S2\n")
+    assert ds["headers"] == ["name", "lat", "lon", "site"]
+    assert ds["row_count"] == 2
+    assert ds["detected_delimiter"] == ";"
+
+    r = client.post("/csv/preview?max_rows=1", data={"dataset_id": ds["dataset_id"]})
+    assert r.status_code == 200
+    assert r.json()["rows"] == [["A", "41.9", "12.5", "S1"]]
+
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "description_cols": ["site"]}
+    for color, kml_color in [("#FF0000", "ff0000ff"), ("#00FF00", "ff00ff00")]:
+        mapping["icon_color"] = color
+        r = client.post("/kml/points", data={"dataset_id": ds["dataset_id"], "mapping": json.dumps(mapping)})
+        assert r.status_code == 200
+        assert 'filename="sites.kml"' in r.headers["content-disposition"]
+        assert f"<color>{kml_color}</color>" in r.text
+        assert "<coordinates>14.3,40.8,0</coordinates>" in r.text
+
+
+def test_dataset_and_upload_give_the_same_result():
+    content = "a_lat,a_lon,b_lat,b_lon\n41.9,12.5,40.8,14.3\n"
+    mapping = json.dumps({"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"})
+    ds = _upload(content, "links.csv")
+
+    by_file = client.post("/kml/links", files={"file": ("links.csv", content, "text/csv")}, data={"mapping": mapping})
+    by_id = client.post("/kml/links", data={"dataset_id": ds["dataset_id"], "mapping": mapping})
+
+    assert by_file.status_code == by_id.status_code == 200
+    assert by_file.content == by_id.content
+    assert by_file.headers["etag"] == by_id.headers["etag"]
+
+
+def test_unknown_deleted_or_ambiguous_dataset():
+    mapping = json.dumps({"name_col": "name", "lat_col": "lat", "lon_col": "lon"})
+
+    r = client.post("/kml/points", data={"dataset_id": "nope", "mapping": mapping})
+    assert r.status_code == 404
+
+    ds = _upload("name,lat,lon\nA,41.9,12.5\n")
+    r = client.post(
+        "/kml/points",
+        files={"file": ("points.csv", "name,lat,lon\n", "text/csv")},
+        data={"dataset_id": ds["dataset_id"], "mapping": mapping},
+    )
+    assert r.status_code == 400
+
+    assert client.delete(f"/csv/datasets/{ds['dataset_id']}").status_code == 200
+    r = client.post("/csv/preview", data={"dataset_id": ds["dataset_id"]})
+    assert r.status_code == 404
+
+
+def test_dataset_store_ttl_and_budget(monkeypatch):
+    from app import datasets
+    from app.ingest.rows import ColumnTable
+
+    now = [1000.0]
+    monkeypatch.setattr(datasets.time, "monotonic", lambda: now[0])
+
+    table = ColumnTable(["a"], [["x" * 10] * 10])
+    store = datasets.DatasetStore(max_bytes=2 * table.estimate_bytes(), ttl_seconds=60)
+
+    first = store.add("a.csv", "h1", table)
+    second = store.add("b.csv", "h2", table)
+    store.get(first.dataset_id)  # first is now the most recently used
+    third = store.add("c.csv", "h3", table)
+
+    assert store.get(second.dataset_id) is None
+    assert store.get(first.dataset_id) is not None
+
+    now[0] += 61
+    assert store.get(first.dataset_id) is None
+    assert store.get(third.dataset_id) is None
+    assert store.stats() == {"datasets": 0, "bytes": 0}
+
+
+def test_dataset_keeps_its_upload_dialect():
+    r = client.post(
+        "/csv/upload",
+        files={"file": ("sites.csv", "name|lat|lon\nA;x|41.9|12.5\n", "text/csv")},
+        data={"delimiter": "|"},
+    )
+    assert r.status_code == 200
+    ds = r.json()
+    assert ds["headers"] == ["name", "lat", "lon"]
+
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "delimiter": "|"}
+    r = client.post("/kml/points", data={"dataset_id": ds["dataset_id"], "mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    assert "<name>A;x</name>" in r.text
+
+    mapping["delimiter"] = ";"
+    r = client.post("/kml/points", data={"dataset_id": ds["dataset_id"], "mapping": json.dumps(mapping)})
+    assert r.status_code == 400
+
+    # conversions of the dataset carry the dialect it was parsed with
+    inp = anyio.run(resolve_input, None, ds["dataset_id"])
+    assert inp.dialect == CsvDialect(delimiter="|") and inp.dialect_source == "explicit"
+
+
+def test_result_key_depends_on_the_dialect():
+    # the same bytes: quotechar " (given to the dataset) vs ' (detected for the upload)
+    content = "name,lat,lon\n'P',1,2\n"
+    mapping = json.dumps({"name_col": "name", "lat_col": "lat", "lon_col": "lon"})
+    r = client.post("/csv/upload", files={"file": ("q.csv", content, "text/csv")}, data={"quotechar": '"'})
+    assert r.status_code == 200
+    by_dataset = client.post("/kml/points", data={"dataset_id": r.json()["dataset_id"], "mapping": mapping})
+    uploaded = client.post("/kml/points", files={"file": ("q.csv", content, "text/csv")}, data={"mapping": mapping})
+
+    assert "<name>&#x27;P&#x27;</name>" in by_dataset.text
+    assert "<name>P</name>" in uploaded.text
+    assert by_dataset.headers["etag"] != uploaded.headers["etag"]
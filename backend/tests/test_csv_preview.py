@@ -20,3 +20,63 @@ def test_csv_preview_rejects_non_csv_extension():
     files = {"file": ("points.txt", "a,b\n1,2\n", "text/plain")}
     r = client.post("/csv/preview", files=files)
     assert r.status_code == 400
+
+
+def test_csv_preview_rejects_non_utf8_upload():
+    files = {"file": ("points.csv", "name,lat\nCittà,41.9\n".encode("latin-1"), "text/csv")}
+    r = client.post("/csv/preview", files=files)
+    assert r.status_code == 400
+    assert "UTF-8" in r.json()["detail"]
+
+
+def test_csv_text_stream_decodes_across_chunk_boundaries():
+    import io
+
+    from app.ingest.upload import CsvTextStream
+
+    text = "name,desc\n" + "".join(f'P{i},"città\nnord"\r\n' for i in range(50))
+    source = CsvTextStream(io.BytesIO(("\ufeff" + text).encode("utf-8")), chunk_size=7, sample_size=16)
+
+    assert source.sample == text[:16]
+    assert "".join(source.lines()) == text
+
+
+def test_csv_preview_header_only():
+    files = {"file": ("points.csv", "name,lat,lon\nA,41.9,12.5\n", "text/csv")}
+    r = client.post("/csv/preview?header_only=true", files=files)
+    assert r.status_code == 200
+    assert r.json()["headers"] == ["name", "lat", "lon"]
+    assert r.json()["rows"] == []
+
+
+def test_csv_preview_partial_upload_drops_cut_tail():
+    # Prefix of a larger file, cut in the middle of a multi-byte character
+    content = "name,city\nA,Roma\nB,Forlì".encode("utf-8")[:-1]
+    files = {"file": ("points.csv", content, "text/csv")}
+    r = client.post("/csv/preview?partial=true", files=files)
+    assert r.status_code == 200
+    assert r.json()["rows"] == [["A", "Roma"]]
+
+
+def test_detect_dialect_counts_delimiters_consistently():
+    from app.ingest.dialect import detect_dialect
+
+    assert detect_dialect("name;lat;lon\nA;41,9;12,5\nB;40,8;14,3\n").delimiter == ";"
+    assert detect_dialect('name,desc\nA,"x;y;z"\nB,"p;q;r"\n').delimiter == ","
+    assert detect_dialect("a\tb\tc\n1\t2\t3\n4\t5\t6\n7\t").delimiter == "\t"
+    assert detect_dialect("name\nA\nB\n").delimiter == ","
+
+    d = detect_dialect('name, desc\nA, "x, y"\n')
+    assert (d.delimiter, d.skipinitialspace) == (",", True)
+
+
+def test_csv_preview_explicit_delimiter():
+    files = {"file": ("points.csv", "name;code|lat\nA;1|41.9\n", "text/csv")}
+
+    r = client.post("/csv/preview", files=files, params={"delimiter": "|"})
+    assert r.status_code == 200
+    assert r.json()["headers"] == ["name;code", "lat"]
+    assert r.json()["detected_delimiter"] == "|"
+
+    r = client.post("/csv/preview", files=files, params={"delimiter": "||"})
+    assert r.status_code == 400
@@ -0,0 +1,102 @@
+import pickle
+
+from app.dedupe import merge_parallel_edges
+from app.kml.builder import build_kml_points
+from app.kml.features import INTERN_MAX_DISTINCT, GraphTable, KmlLink, KmlPoint, LinkTable, PointTable
+from app.kml.links_builder import build_kml_links
+from app.kml.tiles import build_quadtree, link_position, point_position
+
+
+def _points(n: int) -> list[KmlPoint]:
+    return [KmlPoint(f"P{i}", 40 + i / 100, 9 + i / 100, f"kind: {'ab'[i % 2]}") for i in range(n)]
+
+
+def test_tables_yield_the_features_they_store():
+    points = _points(5)
+    table = PointTable.of(points)
+    assert len(table) == 5
+    assert list(table) == points
+    assert table[3] == points[3] and table[-1] == points[-1]
+    assert list(table.take([4, 0])) == [points[4], points[0]]
+
+    links = [KmlLink(f"L{i}", 1.0, 2.0, 3.0 + i, 4.0, "", i + 1) for i in range(3)]
+    link_table = LinkTable.of(links)
+    assert list(link_table) == links
+
+    graph = GraphTable(table, link_table)
+    assert len(graph) == 8
+    assert graph[5] == links[0] and graph[-1] == links[2]
+    sub = graph.take([6, 1])
+    assert list(sub.points) == [points[1]] and list(sub.links) == [links[1]]
+
+
+def test_builders_write_tables_like_feature_lists():
+    points = _points(20)
+    assert build_kml_points("d", PointTable.of(points)) == build_kml_points("d", points)
+
+    links = [KmlLink(f"L{i}", 1.0, 2.0, 3.0, 4.0 + i, "<b>x</b>", 1 + i % 2) for i in range(10)]
+    assert build_kml_links("d", LinkTable.of(links)) == build_kml_links("d", links)
+
+
+def test_string_columns_intern_repeated_values_up_to_a_limit():
+    table = PointTable.of(_points(10))
+    assert table.descriptions[0] is table.descriptions[2]
+
+    many = PointTable()
+    n = INTERN_MAX_DISTINCT + 10
+    for i in range(n):
+        # equal but distinct str objects
+        many.append(f"N{i % (n - 5)}", 0.0, 0.0, "".join(["sa", "me"]))
+    # the name column stopped interning once it saw too many values, the
+    # description column did not
+    assert many.names[0] is not many.names[n - 5]
+    assert many.descriptions[0] is many.descriptions[-1]
+
+
+def test_tables_pickle_and_extend_for_chunked_conversions():
+    a = PointTable.of(_points(3))
+    b = pickle.loads(pickle.dumps(PointTable.of(_points(6)[3:])))
+    b.append("late", 1.0, 2.0, "kind: a")
+    a.extend(b)
+    assert [p.name for p in a] == ["P0", "P1", "P2", "P3", "P4", "P5", "late"]
+
+
+def test_merge_parallel_edges_on_a_link_table():
+    links = LinkTable()
+    links.append("ab", 1.0, 2.0, 3.0, 4.0, "x")
+    links.append("ba", 3.0, 4.0, 1.0, 2.0, "y")
+    links.append("cd", 5.0, 6.0, 7.0, 8.0)
+    links.append("ab2", 1.0, 2.0, 3.0, 4.0, "x")
+
+    merged = list(merge_parallel_edges(links, directed=False, precision=6))
+    assert merged == [KmlLink("ab", 1.0, 2.0, 3.0, 4.0, "x<hr/>y", 3), KmlLink("cd", 5.0, 6.0, 7.0, 8.0, "", 1)]
+    assert len(merge_parallel_edges(links, directed=True, precision=6)) == 3
+
+
+def test_quadtree_tiles_keep_tables():
+    table = PointTable.of(_points(50))
+    root = build_quadtree(table, point_position, max_features=10)
+    assert isinstance(root.features, PointTable) and len(root.features) == 10
+    tiles, stack = [], [root]
+    while stack:
+        tile = stack.pop()
+        tiles.append(tile)
+        stack.extend(tile.children)
+    assert sorted(p.name for t in tiles for p in t.features) == sorted(p.name for p in table)
+
+
+def test_quadtree_reads_table_positions_from_the_columns(monkeypatch):
+    points = PointTable.of(_points(40))
+    links = LinkTable.of(KmlLink(f"L{i}", 40 + i / 50, 9.0, 41.0, 9 + i / 30) for i in range(30))
+    graph = GraphTable(points, links)
+    expected = [point_position(p) for p in points] + [link_position(l) for l in links]
+    assert list(zip(*graph.positions())) == expected
+
+    # tiling a table builds no feature views
+    def no_views(*args):
+        raise AssertionError("feature view built")
+
+    monkeypatch.setattr(PointTable, "__getitem__", no_views)
+    monkeypatch.setattr(LinkTable, "__getitem__", no_views)
+    root = build_quadtree(graph, no_views, max_features=8)
+    assert len(root.features) == 8
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.jobs import JobManager, JobQueueFull
+from app.main import app
+
+client = TestClient(app)
+
+POINTS_MAPPING = {"name_col": "name", "lat_col": "lat", "lon_col": "lon"}
+
+
+def _wait(job_id: str) -> dict:
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job_id}").json()
+        if status["state"] in ("done", "failed"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_converts_upload_like_the_sync_endpoint():
+    csv_content = "name,lat,lon\n" + "".join(f"P{i},45.{i},9.{i}\n" for i in range(50))
+    r = client.post(
+        "/jobs",
+        files={"file": ("sites.csv", csv_content, "text/csv")},
+        data={"kind": "points", "mapping": json.dumps(POINTS_MAPPING)},
+    )
+    assert r.status_code == 202
+    job_id = r.json()["job_id"]
+    assert r.headers["location"] == f"/jobs/{job_id}"
+    assert r.json()["state"] in ("queued", "running", "done")
+
+    status = _wait(job_id)
+    assert status["state"] == "done"
+    assert status["rows"] == 50
+    assert status["result_bytes"] > 0
+
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.headers["content-disposition"] == 'attachment; filename="sites.kml"'
+
+    direct = client.post(
+        "/kml/points",
+        files={"file": ("sites.csv", csv_content, "text/csv")},
+        data={"mapping": json.dumps(POINTS_MAPPING)},
+    )
+    assert result.content == direct.content
+
+
+def test_job_failure_is_reported():
+    r = client.post(
+        "/jobs",
+        files={"file": ("bad.csv", "name,lat,lon\nA,not-a-lat,9.2\n", "text/csv")},
+        data={"kind": "points", "mapping": json.dumps(POINTS_MAPPING)},
+    )
+    assert r.status_code == 202
+    job_id = r.json()["job_id"]
+
+    status = _wait(job_id)
+    assert status["state"] == "failed"
+    assert status["status_code"] == 400
+    assert "row 1" in status["detail"]
+
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 400
+
+    assert client.get("/jobs/does-not-exist").status_code == 404
+    assert client.post("/jobs", data={"kind": "points", "mapping": "{"}).status_code == 400
+
+
+def test_job_manager_queue_bound_and_expiry(tmp_path):
+    manager = JobManager(str(tmp_path), max_workers=1, max_queued=1, ttl_seconds=60)
+    release = threading.Event()
+
+    def blocking(path, progress):
+        release.wait(5)
+        progress(3)
+        with open(path, "wb") as f:
+            f.write(b"<kml/>")
+
+    running = manager.submit("points", "a", "kml", blocking)
+    deadline = time.monotonic() + 5
+    while running.state == "queued" and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    queued = manager.submit("points", "b", "kml", blocking)
+    cleaned = []
+    with pytest.raises(JobQueueFull):
+        manager.submit("points", "c", "kml", blocking, cleanup=lambda: cleaned.append(True))
+    assert cleaned == [True]
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while queued.finished is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    manager.shutdown()
+    assert running.state == queued.state == "done"
+    assert running.rows == 3
+    assert open(running.result_path, "rb").read() == b"<kml/>"
+
+    # past the TTL, jobs and result files are gone
+    running.finished -= 120
+    assert manager.get(running.job_id) is None
+    assert not (tmp_path / f"{running.job_id}.out").exists()
+    assert manager.get(queued.job_id) is queued
@@ -0,0 +1,115 @@
+import io
+import json
+import zipfile
+
+from fastapi.testclient import TestClient
+from app.main import app
+
+client = TestClient(app)
+
+POINTS_MAPPING = {"name_col": "name", "lat_col": "lat", "lon_col": "lon"}
+
+
+def _read_zip(content: bytes) -> tuple[dict, dict[str, bytes]]:
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        names = zf.namelist()
+        assert names[0] == "manifest.json"
+        return json.loads(zf.read("manifest.json")), {n: zf.read(n) for n in names[1:]}
+
+
+def test_kml_batch_files_with_shared_mapping_and_a_failure():
+    files = [
+        ("files", ("north.csv", "name,lat,lon\nA,45.1,9.2\n", "text/csv")),
+        ("files", ("south.csv", "name,lat,lon\nB,38.1,15.6\nC,37.5,15.1\n", "text/csv")),
+        ("files", ("broken.csv", "name,lat,lon\nD,not-a-lat,15.6\n", "text/csv")),
+    ]
+    r = client.post(
+        "/kml/batch", files=files, data={"kind": "points", "mapping": json.dumps(POINTS_MAPPING)}
+    )
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/zip"
+
+    manifest, results = _read_zip(r.content)
+    status = {f["file"]: f for f in manifest["files"]}
+    assert status["north.csv"]["status"] == "ok"
+    assert status["broken.csv"]["status"] == "error"
+    assert status["broken.csv"]["status_code"] == 400
+    assert "row 1" in status["broken.csv"]["detail"]
+
+    assert sorted(results) == ["north.kml", "south.kml"]
+    assert b"<name>C</name>" in results["south.kml"]
+    assert status["south.csv"]["bytes"] == len(results["south.kml"])
+
+
+def test_kml_batch_zip_archive_with_per_file_mappings_and_kmz_output():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("region/a.csv", "name,lat,lon\nA,45.1,9.2\n")
+        zf.writestr("region/b.csv", "id;y;x\nB;38.1;15.6\n")
+        zf.writestr("notes.txt", "ignored")
+        zf.writestr("c.csv", "name,lat,lon\nC,41.9,12.5\n")
+
+    mappings = {
+        "region/b.csv": {"name_col": "id", "lat_col": "y", "lon_col": "x"},
+        "c.csv": {"name_col": "missing", "lat_col": "lat", "lon_col": "lon"},
+    }
+    r = client.post(
+        "/kml/batch?output=kmz",
+        files={"files": ("regions.zip", buf.getvalue(), "application/zip")},
+        data={"kind": "points", "mapping": json.dumps(POINTS_MAPPING), "mappings": json.dumps(mappings)},
+    )
+    assert r.status_code == 200
+
+    manifest, results = _read_zip(r.content)
+    assert [(f["file"], f["status"]) for f in manifest["files"]] == [
+        ("region/a.csv", "ok"),
+        ("region/b.csv", "ok"),
+        ("c.csv", "error"),
+    ]
+    assert sorted(results) == ["region/a.kmz", "region/b.kmz"]
+    with zipfile.ZipFile(io.BytesIO(results["region/b.kmz"])) as kmz:
+        assert b"<name>B</name>" in kmz.read("doc.kml")
+
+
+def test_kml_batch_requires_a_mapping():
+    files = [("files", ("a.csv", "name,lat,lon\n", "text/csv"))]
+    r = client.post("/kml/batch", files=files, data={"kind": "links"})
+    assert r.status_code == 400
+
+
+def test_kml_batch_unexpected_error_fails_only_its_file(monkeypatch):
+    from app.api.conversions import CONVERSIONS
+
+    model, convert, suffix = CONVERSIONS["points"]
+
+    def flaky_convert(source, m, document_name, *args, **kwargs):
+        if document_name == "boom.csv":
+            raise RuntimeError("disk full")
+        return convert(source, m, document_name, *args, **kwargs)
+
+    monkeypatch.setitem(CONVERSIONS, "points", (model, flaky_convert, suffix))
+    files = [
+        ("files", ("ok.csv", "name,lat,lon\nA,45.1,9.2\n", "text/csv")),
+        ("files", ("boom.csv", "name,lat,lon\nB,38.1,15.6\n", "text/csv")),
+    ]
+    r = client.post("/kml/batch", files=files, data={"kind": "points", "mapping": json.dumps(POINTS_MAPPING)})
+
+    assert r.status_code == 200
+    manifest, results = _read_zip(r.content)
+    status = {f["file"]: f for f in manifest["files"]}
+    assert status["ok.csv"]["status"] == "ok"
+    assert status["boom.csv"] == {"file": "boom.csv", "status": "error", "status_code": 500, "detail": "Conversion failed"}
+    assert sorted(results) == ["ok.kml"]
+
+
+def test_kml_batch_streams_entries_past_the_zip64_limit(monkeypatch):
+    # a result larger than the (lowered) 2 GiB limit of plain zip headers
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 1024)
+    rows = "".join(f"P{i},45.{i:04d},9.2\n" for i in range(50))
+    files = [("files", ("big.csv", "name,lat,lon\n" + rows, "text/csv"))]
+    r = client.post("/kml/batch", files=files, data={"kind": "points", "mapping": json.dumps(POINTS_MAPPING)})
+    assert r.status_code == 200
+
+    manifest, results = _read_zip(r.content)
+    assert manifest["files"][0]["status"] == "ok"
+    assert len(results["big.kml"]) > 1024 and b"<name>P49</name>" in results["big.kml"]
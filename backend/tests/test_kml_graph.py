@@ -1,6 +1,7 @@
 import json
 import xml.etree.ElementTree as ET
 
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -59,3 +60,267 @@ def test_kml_graph_happy_path_and_dedupe_coords():
     # Styles referenced
     assert '<Style id="pointStyle">' in body
     assert '<Style id="lineStyle">' in body
+
+
+def test_kml_graph_kmz_output():
+    import io
+    import zipfile
+
+    csv_content = "a_name,a_lat,a_lon,b_name,b_lat,b_lon\n" + "A,41.9,12.5,B,40.8,14.3\n" * 200
+    mapping = {
+        "points": {
+            "nodes": [
+                {"name_col": "a_name", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "b_name", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+        },
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+    }
+
+    files = {"file": ("graph.csv", csv_content, "text/csv")}
+    data = {"mapping": json.dumps(mapping)}
+    r = client.post("/kml/graph?output=kmz", files=files, data=data)
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/vnd.google-earth.kmz")
+    assert 'filename="graph_graph.kmz"' in r.headers["content-disposition"]
+
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        assert zf.namelist() == ["doc.kml"]
+        body = zf.read("doc.kml").decode("utf-8")
+
+    ET.fromstring(body)
+    assert body.count("<LineString>") == 200
+    assert len(r.content) * 10 < len(body)
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_kml_graph_coordinate_errors_report_row(monkeypatch, use_numpy):
+    import app.ingest.coords as coords
+
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(coords, "np", None)
+
+    mapping = {
+        "points": {"nodes": [{"name_col": "name_a", "lat_col": "a_lat", "lon_col": "a_lon"}]},
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+    }
+    header = "name_a,a_lat,a_lon,b_lat,b_lon\n"
+    cases = [
+        ("A,41.9,12.5,40.8,14.3\nB,41.9,12.5,95,14.3\n", "Latitude out of range at row 2 (B): 95.0"),
+        ("A,41.9,12.5,40.8,14.3\nB,41.9,x,40.8,14.3\n", "Invalid a_lon at row 2: x"),
+        ("A,41.9,12.5,40.8,nan\n", "Longitude out of range at row 1 (B): nan"),
+    ]
+
+    for rows, detail in cases:
+        files = {"file": ("graph.csv", header + rows, "text/csv")}
+        r = client.post("/kml/graph", files=files, data={"mapping": json.dumps(mapping)})
+        assert r.status_code == 400
+        assert r.json()["detail"] == detail
+
+    files = {"file": ("graph.csv", header + "A,41.9,12.5,40.8,14.3\n", "text/csv")}
+    r = client.post("/kml/graph", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    assert "<coordinates>12.5,41.9,0 14.3,40.8,0</coordinates>" in r.text
+
+
+def test_kml_graph_dedupe_distance_merges_close_nodes():
+    # B and B2 are ~2 cm apart across a 6-decimal rounding boundary; C is ~11 m from B
+    csv_content = (
+        "name_a,a_lat,a_lon,name_b,b_lat,b_lon\n"
+        "A,41.9,12.5,B,40.8000004,14.3\n"
+        "A,41.9,12.5,B2,40.8000006,14.3\n"
+        "A,41.9,12.5,C,40.8001,14.3\n"
+    )
+    mapping = {
+        "points": {
+            "nodes": [
+                {"name_col": "name_a", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "name_b", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+        },
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+        "dedupe": {"mode": "coords", "precision": 6},
+    }
+    files = {"file": ("graph.csv", csv_content, "text/csv")}
+
+    r = client.post("/kml/graph", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    assert r.text.count("<Point>") == 4
+
+    mapping["dedupe"] = {"mode": "distance", "tolerance_m": 2}
+    r = client.post("/kml/graph", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    assert r.text.count("<Point>") == 3
+    assert "<name>B</name>" in r.text and "<name>B2</name>" not in r.text
+
+    mapping["dedupe"] = {"mode": "distance", "tolerance_m": 0}
+    r = client.post("/kml/graph", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 400
+
+
+@pytest.mark.parametrize("center_lat", [0.0, 45.0, 89.9])
+def test_distance_index_matches_pairwise_search(center_lat):
+    import math
+    import random
+
+    from app.dedupe import METERS_PER_DEGREE, DistanceIndex
+
+    rnd = random.Random(7)
+    tol = 25.0
+    pts = [(center_lat + rnd.uniform(-0.003, 0.003), 10 + rnd.uniform(-0.003, 0.003)) for _ in range(400)]
+
+    index = DistanceIndex(tol)
+    kept: list[tuple[float, float]] = []
+    for lat, lon in pts:
+        expected = next(
+            (
+                i
+                for i, (k_lat, k_lon) in enumerate(kept)
+                if ((lat - k_lat) * METERS_PER_DEGREE) ** 2
+                + ((lon - k_lon) * METERS_PER_DEGREE * math.cos(math.radians(lat))) ** 2
+                <= tol * tol
+            ),
+            None,
+        )
+        key = index.key(lat, lon)
+        if expected is None:
+            assert key == len(kept)
+            kept.append((lat, lon))
+        else:
+            assert key == expected
+
+
+def test_kml_graph_edge_dedupe_undirected():
+    csv_content = (
+        "name_a,a_lat,a_lon,name_b,b_lat,b_lon\n"
+        "A,41.9,12.5,B,40.8,14.3\n"
+        "B,40.8,14.3,A,41.9,12.5\n"
+    )
+    mapping = {
+        "points": {
+            "nodes": [
+                {"name_col": "name_a", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "name_b", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+        },
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+        "edge_dedupe": {"mode": "undirected"},
+    }
+    files = {"file": ("graph.csv", csv_content, "text/csv")}
+
+    r = client.post("/kml/graph", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    ET.fromstring(r.text)
+    assert r.text.count("<LineString>") == 1
+    assert '<Data name="count"><value>2</value></Data>' in r.text
+
+
+def test_kml_graph_tiled_output_keeps_every_feature(monkeypatch):
+    import io
+    import zipfile
+
+    import app.kml.tiles as tiles
+
+    monkeypatch.setattr(tiles, "TILE_MAX_FEATURES", 8)
+
+    rows = "".join(f"N{i},{40 + i / 50},{12 + i / 40},M{i},{41 - i / 60},{13 - i / 70}\n" for i in range(60))
+    mapping = {
+        "points": {
+            "nodes": [
+                {"name_col": "a_name", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "b_name", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+        },
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+    }
+    files = {"file": ("graph.csv", "a_name,a_lat,a_lon,b_name,b_lat,b_lon\n" + rows, "text/csv")}
+
+    r = client.post("/kml/graph?output=tiled", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        bodies = [zf.read(n).decode("utf-8") for n in zf.namelist()]
+    for body in bodies:
+        ET.fromstring(body)
+    assert sum(b.count("<LineString>") for b in bodies) == 60
+    assert sum(b.count("<Point>") for b in bodies) == 120
+
+
+def test_kml_graph_point_clusters():
+    csv_content = (
+        "name_a,a_lat,a_lon,name_b,b_lat,b_lon\n"
+        "A,41.9,12.5,B,41.91,12.51\n"
+        "C,40.85,14.26,D,40.84,14.27\n"
+    )
+    mapping = {
+        "points": {
+            "nodes": [
+                {"name_col": "name_a", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "name_b", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+            "cluster": {"zoom_levels": [5]},
+        },
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+    }
+    files = {"file": ("graph.csv", csv_content, "text/csv")}
+
+    r = client.post("/kml/graph", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+
+    ns = {"k": "http://www.opengis.net/kml/2.2"}
+    folders = ET.fromstring(r.text).findall("k:Document/k:Folder", ns)
+    assert [f.findtext("k:name", namespaces=ns) for f in folders] == ["Points", "Links", "Clusters (zoom 5)"]
+    assert folders[0].find("k:Region", ns) is not None
+    assert folders[1].find("k:Region", ns) is None
+    assert [v.text for v in folders[2].iterfind(".//k:value", ns)] == ["2", "2"]
+
+
+def test_kml_graph_style_rules_in_every_tile(monkeypatch):
+    import io
+    import re
+    import zipfile
+
+    import app.kml.tiles as tiles
+
+    monkeypatch.setattr(tiles, "TILE_MAX_FEATURES", 8)
+
+    rows = "".join(
+        f"N{i},{40 + i / 50},{12 + i / 40},M{i},{41 - i / 60},{13 - i / 70},{'core' if i % 3 else 'edge'},{i}\n"
+        for i in range(30)
+    )
+    mapping = {
+        "points": {
+            "nodes": [
+                {"name_col": "a_name", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "b_name", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+            "style_rule": {"column": "tier", "categories": {"core": {"color": "#0000FF"}, "edge": {"color": "#00FF00"}}},
+        },
+        "links": {
+            "a_lat_col": "a_lat",
+            "a_lon_col": "a_lon",
+            "b_lat_col": "b_lat",
+            "b_lon_col": "b_lon",
+            "style_rule": {"column": "gbps", "type": "graduated", "classes": [{"min": 0, "width": 1}, {"min": 20, "width": 5}]},
+        },
+    }
+    header = "a_name,a_lat,a_lon,b_name,b_lat,b_lon,tier,gbps\n"
+    files = {"file": ("graph.csv", header + rows, "text/csv")}
+
+    r = client.post("/kml/graph?output=tiled", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        bodies = [zf.read(n).decode("utf-8") for n in zf.namelist()]
+    used = {"pointStyle1": 0, "pointStyle2": 0, "lineStyle1": 0, "lineStyle2": 0}
+    for body in bodies:
+        ET.fromstring(body)
+        defined = set(re.findall(r'<Style id="([^"]+)">', body))
+        for style_id in re.findall(r"<styleUrl>#([^<]+)</styleUrl>", body):
+            assert style_id in defined
+            used[style_id] += 1
+    # nodes take the tier of the row they first appear in
+    assert used == {"pointStyle1": 40, "pointStyle2": 20, "lineStyle1": 20, "lineStyle2": 10}
@@ -36,6 +36,53 @@ def test_kml_links_happy_path():
     assert "<coordinates>12.5,41.9,0 14.3,40.8,0</coordinates>" in body
 
 
+def test_kml_links_invalid_line_color():
+    mapping = {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"}
+    files = {"file": ("links.csv", "a_lat,a_lon,b_lat,b_lon\n41.9,12.5,40.8,14.3\n", "text/csv")}
+    r = client.post("/kml/links", files=files, data={"mapping": json.dumps({**mapping, "line_color": "00AAFF"})})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "line_color must be in format #RRGGBB"
+
+
+def test_kml_links_edge_dedupe():
+    csv_content = (
+        "a_lat,a_lon,b_lat,b_lon,circuit\n"
+        "41.9,12.5,40.8,14.3,C1\n"
+        "41.9,12.5,40.8,14.3,C2\n"
+        "40.8,14.3,41.9,12.5,C3\n"
+        "41.9,12.5,45.4,9.2,C4\n"
+    )
+    mapping = {
+        "a_lat_col": "a_lat",
+        "a_lon_col": "a_lon",
+        "b_lat_col": "b_lat",
+        "b_lon_col": "b_lon",
+        "description_cols": ["circuit"],
+    }
+    files = {"file": ("links.csv", csv_content, "text/csv")}
+
+    def placemarks(mode: str) -> list[ET.Element]:
+        mapping["edge_dedupe"] = {"mode": mode}
+        r = client.post("/kml/links", files=files, data={"mapping": json.dumps(mapping)})
+        assert r.status_code == 200
+        ns = {"k": "http://www.opengis.net/kml/2.2"}
+        return ET.fromstring(r.text).findall(".//k:Placemark", ns)
+
+    def count(pm: ET.Element) -> str:
+        value = pm.find(".//{http://www.opengis.net/kml/2.2}Data[@name='count']/{http://www.opengis.net/kml/2.2}value")
+        return value.text if value is not None else "1"
+
+    assert len(placemarks("none")) == 4
+
+    directed = placemarks("directed")
+    assert [count(pm) for pm in directed] == ["2", "1", "1"]
+    desc = directed[0].findtext("{http://www.opengis.net/kml/2.2}description")
+    assert "circuit: C1" in desc and "circuit: C2" in desc and "C3" not in desc
+
+    undirected = placemarks("undirected")
+    assert [count(pm) for pm in undirected] == ["3", "1"]
+
+
 def test_kml_links_missing_column():
     csv_content = "a_lat,a_lon,b_lat\n41.9,12.5,40.8\n"
     mapping = {
@@ -51,3 +98,72 @@ def test_kml_links_missing_column():
 
     assert r.status_code == 400
     assert "Missing required columns" in r.json()["detail"]
+
+
+def test_kml_links_in_process_pool(monkeypatch):
+    from app.settings import get_settings
+    from app.workers import shutdown_workers
+
+    monkeypatch.setenv("CSV2KML_WORKER_MODE", "process")
+    monkeypatch.setenv("CSV2KML_MAX_WORKERS", "1")
+    get_settings.cache_clear()
+    shutdown_workers()
+    try:
+        mapping = {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"}
+
+        files = {"file": ("links.csv", "a_lat,a_lon,b_lat,b_lon\n41.9,12.5,40.8,14.3\n", "text/csv")}
+        r = client.post("/kml/links", files=files, data={"mapping": json.dumps(mapping)})
+        assert r.status_code == 200
+        assert "<coordinates>12.5,41.9,0 14.3,40.8,0</coordinates>" in r.text
+
+        # HTTPException raised in the worker process still becomes a 400
+        files = {"file": ("links.csv", "a_lat,a_lon,b_lat,b_lon\n41.9,12.5,91,14.3\n", "text/csv")}
+        r = client.post("/kml/links", files=files, data={"mapping": json.dumps(mapping)})
+        assert r.status_code == 400
+        assert r.json()["detail"] == "Latitude out of range at row 1 (B): 91.0"
+    finally:
+        shutdown_workers()
+        get_settings.cache_clear()
+
+
+def test_kml_links_graduated_style_rule():
+    csv_content = (
+        "a_lat,a_lon,b_lat,b_lon,capacity\n"
+        "41.9,12.5,40.8,14.3,10\n"
+        "41.9,12.5,45.4,9.2,100\n"
+        "40.8,14.3,45.4,9.2,1000\n"
+        "45.4,9.2,45.0,7.6,n/a\n"
+        "45.0,7.6,41.9,12.5,5\n"
+    )
+    mapping = {
+        "a_lat_col": "a_lat",
+        "a_lon_col": "a_lon",
+        "b_lat_col": "b_lat",
+        "b_lon_col": "b_lon",
+        "line_color": "#FFFFFF",
+        "style_rule": {
+            "column": "capacity",
+            "type": "graduated",
+            "classes": [
+                {"min": 100, "width": 4},
+                {"min": 10, "width": 2},
+                {"min": 1000, "width": 8, "color": "#FF0000"},
+            ],
+            "default": {"width": 1},
+        },
+    }
+
+    files = {"file": ("links.csv", csv_content, "text/csv")}
+    r = client.post("/kml/links", files=files, data={"mapping": json.dumps(mapping)})
+
+    assert r.status_code == 200
+    body = r.text
+    ET.fromstring(body)
+    # ids follow the rule: default first, then classes by min
+    assert '<Style id="lineStyle1"><LineStyle><color>ffffffff</color><width>1.0</width></LineStyle></Style>' in body
+    assert '<Style id="lineStyle2"><LineStyle><color>ffffffff</color><width>2.0</width></LineStyle></Style>' in body
+    assert '<Style id="lineStyle4"><LineStyle><color>ff0000ff</color><width>8.0</width></LineStyle></Style>' in body
+    placemarks = body.split("<Placemark>")[1:]
+    urls = [p.split("<styleUrl>#")[1].split("<")[0] for p in placemarks]
+    # below the first class and non-numeric values take the default
+    assert urls == ["lineStyle2", "lineStyle3", "lineStyle4", "lineStyle1", "lineStyle1"]
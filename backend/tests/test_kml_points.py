@@ -1,5 +1,6 @@
 import json
 
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -79,3 +80,257 @@ def test_kml_points_invalid_color():
 
     assert r.status_code == 400
     assert "icon_color must be in format #RRGGBB" in r.json()["detail"]
+
+
+def test_kml_points_categorical_style_rule_shares_styles():
+    csv_content = "name,lat,lon,status\nA,41.9,12.5,up\nB,40.8,14.3,down\nC,45.4,9.2,up\nD,45.0,7.6,unknown\n"
+    mapping = {
+        "name_col": "name",
+        "lat_col": "lat",
+        "lon_col": "lon",
+        "icon_scale": 1.5,
+        "style_rule": {
+            "column": "status",
+            "categories": {
+                "up": {"color": "#00FF00"},
+                "down": {"color": "#FF0000", "icon_scale": 2},
+                # looks like "up": shares its style
+                "ok": {"color": "#00ff00"},
+            },
+        },
+    }
+
+    files = {"file": ("points.csv", csv_content, "text/csv")}
+    data = {"mapping": json.dumps(mapping)}
+    r = client.post("/kml/points", files=files, data=data)
+
+    assert r.status_code == 200
+    body = r.text
+    # the mapping's style, then one style per distinct look of the rule
+    assert body.count("<Style id=") == 3
+    assert '<Style id="pointStyle1"><IconStyle><color>ff00ff00</color><scale>1.5</scale></IconStyle></Style>' in body
+    assert '<Style id="pointStyle2"><IconStyle><color>ff0000ff</color><scale>2.0</scale></IconStyle></Style>' in body
+    placemarks = body.split("<Placemark>")[1:]
+    urls = [p.split("<styleUrl>#")[1].split("<")[0] for p in placemarks]
+    # values without a category keep the mapping's style
+    assert urls == ["pointStyle1", "pointStyle2", "pointStyle1", "pointStyle"]
+
+
+def test_kml_points_style_rule_errors():
+    csv_content = "name,lat,lon,status\nA,41.9,12.5,up\n"
+    files = {"file": ("points.csv", csv_content, "text/csv")}
+
+    def post(rule):
+        mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "style_rule": rule}
+        return client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)})
+
+    r = post({"column": "state", "categories": {"up": {"color": "#00FF00"}}})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Style column not found: state"
+
+    r = post({"column": "status", "categories": {"up": {"color": "green"}}})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "style_rule: color must be in format #RRGGBB"
+
+    r = post({"column": "status", "type": "graduated"})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "style_rule.classes is required for a graduated rule"
+
+
+def test_kml_points_minified_output():
+    csv_content = "name,lat,lon,site\nA,41.90000001234,12.496400000000001,\nB,40.8,14.3,S2\n"
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "description_cols": ["site"]}
+    files = {"file": ("points.csv", csv_content, "text/csv")}
+
+    full = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)}).text
+    mapping["minify"] = {"coord_decimals": 5}
+    r = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)})
+
+    assert r.status_code == 200
+    body = r.text
+    assert "<Placemark><name>A</name><description><![CDATA[site: ]]></description>" in body
+    assert "<coordinates>12.4964,41.9</coordinates>" in body
+    assert "<coordinates>14.3,40.8</coordinates>" in body
+    assert len(body) < len(full)
+
+    # empty descriptions are left out
+    mapping["description_cols"] = []
+    body = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)}).text
+    assert "<description>" not in body
+
+    mapping["minify"] = {"coord_decimals": 13}
+    r = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "minify.coord_decimals must be between 0 and 12"
+
+
+def test_kml_points_streams_large_document_in_chunks():
+    from app.kml.builder import KmlPoint, build_kml_points, iter_kml_points
+    from app.kml.stream import iter_chunks
+
+    points = [KmlPoint(name=f"P{i}", lat=41.9, lon=12.5) for i in range(2000)]
+    chunks = list(iter_chunks(iter_kml_points("doc", points), chunk_size=4096))
+
+    assert len(chunks) > 1
+    assert b"".join(chunks).decode("utf-8") == build_kml_points("doc", points)
+
+
+def test_kml_points_padded_headers_and_blank_lines():
+    csv_content = "name , lat , lon\nA,41.9,12.5\n\nB,40.8,abc\n"
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon"}
+
+    files = {"file": ("points.csv", csv_content, "text/csv")}
+    data = {"mapping": json.dumps(mapping)}
+    r = client.post("/kml/points", files=files, data=data)
+
+    # blank lines are skipped and do not shift row numbers
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Invalid coordinates at row 2: lat='40.8', lon='abc'"
+
+
+def test_kml_points_etag_cache_and_304():
+    csv_content = "name,lat,lon\nCached,45.1,9.2\n"
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon"}
+
+    files = {"file": ("cached.csv", csv_content, "text/csv")}
+    data = {"mapping": json.dumps(mapping)}
+
+    before = client.get("/cache/stats").json()
+    r1 = client.post("/kml/points", files=files, data=data)
+    r2 = client.post("/kml/points", files=files, data=data)
+    after = client.get("/cache/stats").json()
+
+    assert r1.status_code == r2.status_code == 200
+    assert r1.content == r2.content
+    etag = r1.headers["etag"]
+    assert etag.startswith('"') and r2.headers["etag"] == etag
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    r3 = client.post("/kml/points", files=files, data=data, headers={"If-None-Match": etag})
+    assert r3.status_code == 304
+    assert r3.headers["etag"] == etag
+
+    # a different mapping is a different result
+    mapping["description_cols"] = ["name"]
+    r4 = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)}, headers={"If-None-Match": etag})
+    assert r4.status_code == 200
+    assert r4.headers["etag"] != etag
+
+
+def test_kml_points_explicit_delimiter_in_mapping():
+    # ";" is inside the names, "|" separates the columns
+    csv_content = "name|lat|lon\nA;north|41.9|12.5\nB;south|40.8|14.3\n"
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "delimiter": "|"}
+
+    r = client.post(
+        "/kml/points",
+        files={"file": ("points.csv", csv_content, "text/csv")},
+        data={"mapping": json.dumps(mapping)},
+    )
+    assert r.status_code == 200
+    assert "<name>A;north</name>" in r.text
+
+    mapping["delimiter"] = "|"
+    mapping["quotechar"] = "|"
+    r = client.post(
+        "/kml/points",
+        files={"file": ("points.csv", csv_content, "text/csv")},
+        data={"mapping": json.dumps(mapping)},
+    )
+    assert r.status_code == 400
+
+
+def test_kml_points_tiled_output(monkeypatch):
+    import io
+    import posixpath
+    import random
+    import xml.etree.ElementTree as ET
+    import zipfile
+
+    import app.kml.tiles as tiles
+
+    monkeypatch.setattr(tiles, "TILE_MAX_FEATURES", 10)
+
+    rnd = random.Random(3)
+    rows = "".join(f"P{i},{rnd.uniform(40, 42):.5f},{rnd.uniform(12, 14):.5f}\n" for i in range(100))
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "icon_color": "#FF0000"}
+    r = client.post(
+        "/kml/points?output=tiled",
+        files={"file": ("points.csv", "name,lat,lon\n" + rows, "text/csv")},
+        data={"mapping": json.dumps(mapping)},
+    )
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/vnd.google-earth.kmz")
+    assert 'filename="points.kmz"' in r.headers["content-disposition"]
+
+    ns = {"k": "http://www.opengis.net/kml/2.2"}
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        names = zf.namelist()
+        assert names[0] == "doc.kml"
+        docs = {name: ET.fromstring(zf.read(name)) for name in names}
+
+    # every NetworkLink points at a tile in the archive, every tile is linked once
+    linked = []
+    for name, root in docs.items():
+        for href in root.iterfind(".//k:NetworkLink/k:Link/k:href", ns):
+            linked.append(posixpath.normpath(posixpath.join(posixpath.dirname(name), href.text)))
+    assert sorted(linked) == sorted(n for n in names if n != "doc.kml")
+    assert len(names) > 2
+
+    names_in_tiles = [p.text for root in docs.values() for p in root.iterfind(".//k:Placemark/k:name", ns)]
+    assert sorted(names_in_tiles) == sorted(f"P{i}" for i in range(100))
+    assert all(len(root.findall(".//k:Placemark", ns)) <= 10 for root in docs.values())
+    assert all(root.find(".//k:Style", ns) is not None for n, root in docs.items() if n != "doc.kml")
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_kml_points_cluster_layers(monkeypatch, use_numpy):
+    import xml.etree.ElementTree as ET
+
+    import app.kml.clusters as clusters
+
+    if not use_numpy:
+        monkeypatch.setattr(clusters, "np", None)
+
+    # two tight groups: 3 points near Rome, 2 near Naples
+    csv_content = (
+        "name,lat,lon\n"
+        "R1,41.90,12.50\nR2,41.91,12.51\nN1,40.85,14.26\nR3,41.89,12.49\nN2,40.84,14.27\n"
+    )
+    mapping = {"name_col": "name", "lat_col": "lat", "lon_col": "lon", "cluster": {"zoom_levels": [8, 5]}}
+    files = {"file": ("points.csv", csv_content, "text/csv")}
+
+    r = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+
+    ns = {"k": "http://www.opengis.net/kml/2.2"}
+    doc = ET.fromstring(r.text).find("k:Document", ns)
+    folders = {f.findtext("k:name", namespaces=ns): f for f in doc.findall("k:Folder", ns)}
+    assert list(folders) == ["Points", "Clusters (zoom 5)", "Clusters (zoom 8)"]
+
+    z5 = folders["Clusters (zoom 5)"]
+    counts = [int(v.text) for v in z5.iterfind(".//k:Data[@name='count']/k:value", ns)]
+    assert counts == [3, 2]
+    lon, lat, _ = z5.find(".//k:coordinates", ns).text.split(",")
+    assert abs(float(lat) - 41.9) < 1e-9 and abs(float(lon) - 12.5) < 1e-9
+
+    # zoomed-out level from 0 pixels, points only after the last level
+    lods = {name: f.find("k:Region/k:Lod", ns) for name, f in folders.items()}
+    assert lods["Clusters (zoom 5)"].findtext("k:minLodPixels", namespaces=ns) == "0"
+    assert lods["Clusters (zoom 5)"].findtext("k:maxLodPixels", namespaces=ns) == lods["Clusters (zoom 8)"].findtext(
+        "k:minLodPixels", namespaces=ns
+    )
+    assert lods["Points"].findtext("k:maxLodPixels", namespaces=ns) == "-1"
+    assert len(folders["Points"].findall("k:Placemark", ns)) == 5
+
+    mapping["cluster"] = {"zoom_levels": [5], "include_points": False}
+    r = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    assert "<name>R1</name>" not in r.text
+    assert r.text.count("<Placemark>") == 2
+
+    mapping["cluster"] = {"zoom_levels": [25]}
+    r = client.post("/kml/points", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 400
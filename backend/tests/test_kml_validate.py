@@ -0,0 +1,93 @@
+import json
+import xml.etree.ElementTree as ET
+
+from fastapi.testclient import TestClient
+from app.ingest.validation import RowErrors
+from app.main import app
+
+client = TestClient(app)
+
+NS = {"k": "http://www.opengis.net/kml/2.2"}
+
+POINTS_CSV = "name,lat,lon\nA,41.9,12.5\nB,abc,14.3\nC,45.4,9.2\nD,95.0,7.6\nE,40.8,14.3\n"
+POINTS_MAPPING = {"name_col": "name", "lat_col": "lat", "lon_col": "lon"}
+
+
+def test_validate_reports_every_invalid_row():
+    files = {"file": ("points.csv", POINTS_CSV, "text/csv")}
+    data = {"kind": "points", "mapping": json.dumps(POINTS_MAPPING)}
+    r = client.post("/kml/validate", files=files, data=data)
+
+    assert r.status_code == 200
+    report = r.json()
+    assert report["kind"] == "points"
+    assert report["file"] == "points.csv"
+    assert (report["rows"], report["valid_rows"], report["invalid_rows"]) == (5, 3, 2)
+    assert report["errors"] == [
+        {"row": 2, "error": "Invalid coordinates at row 2: lat='abc', lon='14.3'"},
+        {"row": 4, "error": "Latitude out of range at row 4: 95.0"},
+    ]
+    assert report["errors_truncated"] is False
+
+
+def test_validate_graph_and_structural_errors():
+    csv_content = "a_lat,a_lon,b_lat,b_lon,na,nb\n41.9,12.5,40.8,14.3,A,B\n41.9,x,40.8,14.3,A,B\n"
+    mapping = {
+        "points": {
+            "nodes": [
+                {"name_col": "na", "lat_col": "a_lat", "lon_col": "a_lon"},
+                {"name_col": "nb", "lat_col": "b_lat", "lon_col": "b_lon"},
+            ],
+        },
+        "links": {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"},
+    }
+    files = {"file": ("graph.csv", csv_content, "text/csv")}
+    r = client.post("/kml/validate", files=files, data={"kind": "graph", "mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    assert r.json()["errors"] == [{"row": 2, "error": "Invalid a_lon at row 2: x"}]
+
+    # a missing column still fails the whole file
+    mapping["links"]["a_lat_col"] = "lat"
+    r = client.post("/kml/validate", files=files, data={"kind": "graph", "mapping": json.dumps(mapping)})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Missing required column: lat"
+
+
+def test_row_errors_keep_the_first_rows_and_count_all():
+    errors = RowErrors(limit=2)
+    for row in range(1, 6):
+        errors.add(row, f"bad row {row}")
+    errors.rows = 10
+    summary = errors.summary()
+    assert [e["row"] for e in summary["errors"]] == [1, 2]
+    assert (summary["valid_rows"], summary["invalid_rows"], summary["errors_truncated"]) == (5, 5, True)
+
+
+def test_lenient_conversion_skips_invalid_rows():
+    files = {"file": ("points.csv", POINTS_CSV, "text/csv")}
+    data = {"mapping": json.dumps(POINTS_MAPPING)}
+
+    r = client.post("/kml/points", files=files, data=data)
+    assert r.status_code == 400
+
+    r = client.post("/kml/points?strict=false", files=files, data=data)
+    assert r.status_code == 200
+    doc = ET.fromstring(r.text).find("k:Document", NS)
+    assert [p.findtext("k:name", namespaces=NS) for p in doc.iterfind("k:Placemark", NS)] == ["A", "C", "E"]
+    assert doc.find("k:ExtendedData/k:Data[@name='skipped_rows']/k:value", NS).text == "2"
+
+    # ?strict=false is "strict": false in the mapping (same result, same ETag)
+    lenient_etag = r.headers["etag"]
+    r = client.post("/kml/points", files=files, data={"mapping": json.dumps({**POINTS_MAPPING, "strict": False})})
+    assert r.headers["etag"] == lenient_etag
+
+
+def test_lenient_links_conversion():
+    csv_content = "a_lat,a_lon,b_lat,b_lon\n41.9,12.5,40.8,14.3\n41.9,12.5,40.8,200\n"
+    mapping = {"a_lat_col": "a_lat", "a_lon_col": "a_lon", "b_lat_col": "b_lat", "b_lon_col": "b_lon"}
+    files = {"file": ("links.csv", csv_content, "text/csv")}
+
+    r = client.post("/kml/links?strict=false", files=files, data={"mapping": json.dumps(mapping)})
+    assert r.status_code == 200
+    assert r.text.count("<LineString>") == 1
+    assert '<Data name="skipped_rows"><value>1</value></Data>' in r.text
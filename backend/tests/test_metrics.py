@@ -0,0 +1,71 @@
+import json
+import re
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.metrics import Histogram
+
+client = TestClient(app)
+
+POINTS_MAPPING = {"name_col": "name", "lat_col": "lat", "lon_col": "lon"}
+
+
+def _samples(text: str) -> dict[str, float]:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_metrics_report_stages_rows_and_sizes_per_endpoint():
+    before = _samples(client.get("/metrics").text)
+
+    r = client.post(
+        "/kml/points",
+        files={"file": ("m.csv", "name,lat,lon\nA,45.1,9.2\nB,45.2,9.3\nC,45.3,9.4\n", "text/csv")},
+        # a mapping no other test uses: a cache miss, so every stage runs
+        data={"mapping": json.dumps({**POINTS_MAPPING, "description_cols": ["name"]})},
+    )
+    assert r.status_code == 200
+
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = _samples(metrics.text)
+
+    def delta(name: str) -> float:
+        return after.get(name, 0) - before.get(name, 0)
+
+    assert delta('csv2kml_requests_total{endpoint="/kml/points",method="POST",status="200"}') == 1
+    assert delta('csv2kml_rows_total{endpoint="/kml/points"}') == 3
+    assert delta('csv2kml_input_bytes_total{endpoint="/kml/points"}') > 0
+    assert delta('csv2kml_response_bytes_sum{endpoint="/kml/points"}') == len(r.content)
+    for stage in ("upload", "hash", "detect", "queue", "parse", "build", "send"):
+        assert delta(f'csv2kml_stage_seconds_count{{endpoint="/kml/points",stage="{stage}"}}') == 1, stage
+    assert "csv2kml_cache_misses_total" in after
+    assert after["csv2kml_requests_in_flight"] == 1  # the /metrics request itself
+
+
+def test_metrics_label_routes_by_path_template():
+    client.get("/jobs/0123abcd")
+    text = client.get("/metrics").text
+    assert 'endpoint="/jobs/{job_id}",method="GET",status="404"' in text
+    assert "0123abcd" not in text
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = Histogram("t_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(("parse",), v)
+    lines = h.render()
+    assert lines[:2] == ["# HELP t_seconds test", "# TYPE t_seconds histogram"]
+    assert lines[2:] == [
+        't_seconds_bucket{stage="parse",le="0.1"} 2',
+        't_seconds_bucket{stage="parse",le="1"} 3',
+        't_seconds_bucket{stage="parse",le="+Inf"} 4',
+        't_seconds_sum{stage="parse"} 3.65',
+        't_seconds_count{stage="parse"} 4',
+    ]
+    assert re.fullmatch(r"[a-z_]+", h.name)
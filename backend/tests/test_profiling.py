@@ -0,0 +1,68 @@
+import json
+import pstats
+import sys
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.settings import get_settings
+
+client = TestClient(app)
+
+MAPPING = {"name_col": "name", "lat_col": "lat", "lon_col": "lon"}
+CSV = "name,lat,lon\n" + "".join(f"P{i},{40 + i / 100:.2f},9.2\n" for i in range(50))
+
+
+def _post(**headers):
+    return client.post(
+        "/kml/points",
+        params={"profile": "true"},
+        files={"file": ("p.csv", CSV, "text/csv")},
+        data={"mapping": json.dumps(MAPPING)},
+        headers=headers,
+    )
+
+
+def test_profile_is_refused_unless_enabled_with_the_token(monkeypatch):
+    get_settings.cache_clear()
+    try:
+        assert _post().status_code == 403
+
+        monkeypatch.setenv("CSV2KML_PROFILE_TOKEN", "s3cret")
+        get_settings.cache_clear()
+        assert _post().status_code == 403
+        assert _post(**{"X-Profile-Token": "wrong"}).status_code == 403
+    finally:
+        get_settings.cache_clear()
+
+
+def test_profile_reports_stages_and_hot_functions(monkeypatch, tmp_path):
+    monkeypatch.setenv("CSV2KML_PROFILE_TOKEN", "s3cret")
+    monkeypatch.setenv("CSV2KML_PROFILE_DIR", str(tmp_path))
+    # process mode is ignored: the profile needs the conversion in this process
+    monkeypatch.setenv("CSV2KML_WORKER_MODE", "process")
+    get_settings.cache_clear()
+    try:
+        r = _post(**{"X-Profile-Token": "s3cret"})
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "application/json"
+        report = r.json()
+
+        assert report["kind"] == "points" and report["rows"] == 50
+        assert report["output_bytes"] > 0
+        assert report["profile_scope"] == ("process" if sys.version_info >= (3, 12) else "conversion")
+        assert {"upload", "hash", "queue", "parse", "build"} <= set(report["stages"])
+        hot = report["hot_functions"]
+        assert 0 < len(hot) <= 25
+        assert hot[0]["own_seconds"] >= hot[-1]["own_seconds"]
+
+        stats = pstats.Stats(report["pstats_file"])
+        assert any(func == "convert_points" for _, _, func in stats.stats)  # type: ignore[attr-defined]
+
+        # the same request without profile still gets the KML
+        r = client.post(
+            "/kml/points", files={"file": ("p.csv", CSV, "text/csv")}, data={"mapping": json.dumps(MAPPING)}
+        )
+        assert r.status_code == 200 and "<Placemark>" in r.text
+    finally:
+        get_settings.cache_clear()
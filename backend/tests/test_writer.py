@@ -0,0 +1,86 @@
+import random
+import xml.etree.ElementTree as ET
+from html import escape
+
+from app.kml.features import KmlLink, KmlPoint, LinkTable
+from app.kml.graph_builder import build_kml_graph
+from app.kml.links_builder import KmlLineStyle, build_kml_links
+from app.kml.writer import (
+    PLACEMARKS_PER_BLOCK,
+    MinifyOptions,
+    escape_text,
+    fixed_coordinate,
+    iter_link_placemarks,
+    iter_point_placemarks,
+)
+
+NS = {"k": "http://www.opengis.net/kml/2.2"}
+
+
+def test_escape_text_matches_html_escape():
+    rnd = random.Random(1)
+    alphabet = "ab1 &<>\"'é%"
+    for _ in range(2000):
+        value = "".join(rnd.choice(alphabet) for _ in range(rnd.randrange(8)))
+        assert escape_text(value) == escape(value)
+    plain = "Tower 12"
+    assert escape_text(plain) is plain
+
+
+def test_placemarks_come_in_blocks_one_per_line():
+    points = [KmlPoint(f"P{i}", 1.0, 2.0) for i in range(PLACEMARKS_PER_BLOCK + 1)]
+    blocks = list(iter_point_placemarks(points, "s"))
+    assert [b.count("\n") for b in blocks] == [PLACEMARKS_PER_BLOCK, 1]
+    assert blocks[1] == (
+        f"<Placemark><name>P{PLACEMARKS_PER_BLOCK}</name><styleUrl>#s</styleUrl>"
+        "<description><![CDATA[]]></description><Point><coordinates>2.0,1.0,0</coordinates></Point></Placemark>\n"
+    )
+
+
+def test_documents_are_compact_and_escape_values_once():
+    links = LinkTable.of([KmlLink("A & B", 1.0, 2.0, 3.0, 4.0, "x<br/>y", 2), KmlLink("C", 5.0, 6.0, 7.0, 8.0)])
+    kml = build_kml_links("Net & co", links, KmlLineStyle(color="ff00ff00"))
+
+    assert kml.startswith('<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n')
+    assert "<name>A &amp; B</name>" in kml
+    assert "<![CDATA[x&lt;br/&gt;y]]>" in kml
+    assert "  " not in kml
+    root = ET.fromstring(kml)
+    assert root.find("k:Document/k:name", NS).text == "Net & co"
+    assert [p.find("k:name", NS).text for p in root.iterfind(".//k:Placemark", NS)] == ["A & B", "C"]
+
+    graph = ET.fromstring(build_kml_graph("g", [KmlPoint("<P>", 1.0, 2.0)], links))
+    folders = {f.find("k:name", NS).text: f for f in graph.iterfind(".//k:Folder", NS)}
+    assert len(folders["Points"].findall("k:Placemark", NS)) == 1
+    assert len(folders["Links"].findall("k:Placemark", NS)) == 2
+
+
+def test_minified_coordinates():
+    assert fixed_coordinate(12.496400000000001, 6) == "12.4964"
+    assert fixed_coordinate(-0.00001234, 6) == "-0.000012"
+    assert fixed_coordinate(0.0000001, 6) == "0"
+    assert fixed_coordinate(40.2, 0) == "40"
+
+    link = KmlLink("L", 1.23456789, 2.0, -3.5, 4.00000001, "", 1)
+    (block,) = iter_link_placemarks([link], None, MinifyOptions(coord_decimals=3, altitude=True))
+    assert block == (
+        "<Placemark><name>L</name><LineString><tessellate>1</tessellate>"
+        "<coordinates>2,1.235,0 4,-3.5,0</coordinates></LineString></Placemark>\n"
+    )
+    # null decimals: coordinates as parsed, only the altitude dropped
+    (block,) = iter_point_placemarks([KmlPoint("P", 1.23456789, 2.0)], None, MinifyOptions(coord_decimals=None))
+    assert "<coordinates>2.0,1.23456789</coordinates>" in block
+
+
+def test_kmz_stream_writes_entries_past_the_zip64_limit(monkeypatch):
+    import io
+    import zipfile
+
+    from app.kml.kmz import iter_kmz
+
+    # a streamed entry larger than the (lowered) 2 GiB limit of plain zip headers
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 1024)
+    chunks = [b"<Placemark/>" * 100 for _ in range(10)]
+    data = b"".join(iter_kmz(iter(chunks)))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.read("doc.kml") == b"".join(chunks)
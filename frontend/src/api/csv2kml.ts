@@ -6,11 +6,15 @@ function getDetailMessage(fallback: string, resStatus: number, err: any) {
     return err?.detail ?? `${fallback} (${resStatus})`;
 }
 
+// Preview only needs the first rows: upload a prefix instead of the whole file.
+const PREVIEW_MAX_BYTES = 1024 * 1024;
+
 export async function  csvPreview(file: File, maxRows = 20): Promise<Preview> {
+    const partial = file.size > PREVIEW_MAX_BYTES;
     const fd = new FormData();
-    fd.append("file", file)
+    fd.append("file", partial ? file.slice(0, PREVIEW_MAX_BYTES) : file, file.name)
 
-    const res = await fetch(`${API_BASE_URL}/csv/preview?max_rows=${maxRows}`, {
+    const res = await fetch(`${API_BASE_URL}/csv/preview?max_rows=${maxRows}&partial=${partial}`, {
         method: "POST",
         body: fd,
     });